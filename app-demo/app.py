@@ -9,9 +9,12 @@ Home: describing the project
 5. Display Network: Visualising the steps of network construction
 """
 
+import os
 import streamlit as st
+from settings.settings import PIPELINE_FOLDER
 from pages import event_collection, home, infobox_extraction, \
     build_network, display_network, wikidata_retrieval
+from pages.helpers import load_pipeline_outputs, get_shared_cache, display_stage_breakdown
 
 PAGES = {
     "Home": home,
@@ -26,5 +29,15 @@ st.sidebar.title('Navigation')
 selection = st.sidebar.radio("Go to", list(PAGES.keys()))
 st.session_state["data_in_cache"] = True
 
+if os.path.exists(os.path.join(PIPELINE_FOLDER, "manifest.json")) and \
+    st.sidebar.button("Load last pipeline run"):
+    loaded = load_pipeline_outputs()
+    st.sidebar.success(f"Loaded: {', '.join(loaded)}")
+
 page = PAGES[selection]
 page.app()
+display_stage_breakdown()
+
+STATS = get_shared_cache().stats()
+st.sidebar.caption(f"Shared results: {STATS['results']} ({STATS['size_mb']} MB), " + \
+    f"{STATS['handles']} in use")
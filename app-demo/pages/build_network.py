@@ -5,19 +5,16 @@ from datetime import datetime
 import pandas as pd
 import streamlit as st
 
-from graph_building.converter import WikipediaConverter, WikidataConverter, init_graph
+from narrative.instrumentation import span
 from .helpers import get_session_state_val, check_session_state_value, \
-    init_update_session_state
+    init_update_session_state, get_session_state_key, \
+    get_shared_result
 
 @st.cache(show_spinner=False)
 def build_network(df_wp, df_wd):
     """ Build graph with rdf triples """
-    graph = init_graph()
-    converter_wp = WikipediaConverter()
-    graph, counter = converter_wp(graph, df_wp)
-
-    converter_wd = WikidataConverter()
-    return converter_wd(graph, df_wd, counter)
+    from graph_building.converter import build_narrative_graph  # rdflib only loaded here
+    return build_narrative_graph(df_wp=df_wp, df_wd=df_wd)
 
 def app():
     """ Main app page """
@@ -40,10 +37,16 @@ def app():
             # Populating ontology by converting wikipedia semi-structured data
             # and wikidata triples
             build_start = datetime.now()
-            graph, _ = build_network(df_wp=df_wp, df_wd=df_wd)
+            params = {"from": [get_session_state_key(var="wikipedia_for_graph"),
+                               get_session_state_key(var="wikidata_for_graph")]}
+            with span("stage", stage="graph"):
+                graph = get_shared_result(var="graph", params=params) \
+                    if None not in params["from"] else None
+                if graph is None:
+                    graph, _ = build_network(df_wp=df_wp, df_wd=df_wd)
 
             if check_session_state_value(var="data_in_cache", value=True):
-                init_update_session_state(var="graph", value=graph)
+                init_update_session_state(var="graph", value=graph, params=params)
             build_end = datetime.now()
 
             init_update_session_state(var="build_nt_time",
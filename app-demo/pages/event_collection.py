@@ -4,15 +4,14 @@ Streamlit page: collecting events
 """
 
 import os
-import yaml
 import streamlit as st
 
 from settings.settings import ROOT_PATH
+from narrative.pipeline import load_content
 from .helpers import collect_data_st, display_html_graph
 
 
-with open(os.path.join(ROOT_PATH, "app-demo/content/event_collection.yaml")) as file:
-    content = yaml.load(file, Loader=yaml.FullLoader)
+content = load_content()
 
 
 def app():
@@ -10,16 +10,55 @@ import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
-from wikipedia_narrative.map_wikidata_wikipedia import add_wikipedia_page
-from kb_sparql.gather_events import build_args_for_collect, collect_data
+from wikipedia_narrative.map_wikidata_wikipedia import iter_wikipedia_page
+from wikipedia_narrative.title_index import TitleIndex
+from narrative.pipeline import load_outputs, read_manifest, get_text_info
+from settings.settings import PIPELINE_FOLDER, SHARED_CACHE_MAX_MB
+from kb_sparql.gather_events import build_args_for_collect, iter_collect_data
+from narrative.instrumentation import TRACER, span, count
 from .vis import get_fig_hist_plotly
+from .shared_cache import SharedResultCache, Handle, content_hash
 
 
-def init_update_session_state(var, value):
-    """ Initializing a cached value """
+# Results shared by all sessions (cf. shared_cache.py), the session only holds handles
+SHARED_VARS = ["wikidata_collected", "wikidata_for_graph", "wikipedia_text", "infobox_collected",
+               "wikipedia_collected", "wikipedia_for_graph", "graph"]
+
+
+@st.experimental_singleton
+def get_shared_cache():
+    """ Cache shared by all sessions of the process """
+    return SharedResultCache(max_mb=SHARED_CACHE_MAX_MB)
+
+
+def init_update_session_state(var, value, params: dict = None):
+    """ Initializing a cached value.
+    For SHARED_VARS, value is stored once per process under (var, params),
+    if another session already stored a result for them, that result is kept """
+    if var in SHARED_VARS:
+        value = get_shared_cache().put(key=SharedResultCache.key(var, params), value=value)
     st.session_state[var] = value
 
 
+def get_shared_result(var, params: dict = None):
+    """ Result computed by any session for (var, params), None if there is none.
+    If found, the session gets a handle to it """
+    handle = get_shared_cache().get_handle(SharedResultCache.key(var, params))
+    if handle is None:
+        count("cache_misses", cache="shared")
+        return None
+    count("cache_hits", cache="shared")
+    st.session_state[var] = handle
+    return handle.get()
+
+
+def get_session_state_key(var):
+    """ Shared cache key of a session value (None if not shared), to be used
+    as parameter of the results computed from it """
+    value = st.session_state.get(var)
+    return value.key if isinstance(value, Handle) else None
+
+
 def check_session_state_value(var, value):
     """ Comparing cached value and value """
     return st.session_state[var] == value
@@ -32,7 +71,8 @@ def check_val_in_session_state(var):
 
 def get_session_state_val(var):
     """ Get cached value """
-    return st.session_state[var]
+    value = st.session_state[var]
+    return value.get() if isinstance(value, Handle) else value
 
 
 def add_download_link(to_download, file_end_name: str, extension: str):
@@ -44,6 +84,45 @@ def add_download_link(to_download, file_end_name: str, extension: str):
         f'download="{file_name}">Download {extension} file</a>'
     st.markdown(linko, unsafe_allow_html=True)
 
+def stream_collect_data(id_query_type_l: list[tuple], content: dict,
+                        combined: bool = False) -> pd.core.frame.DataFrame:
+    """ Collecting events (one query per path, or one UNION query if combined) and mapping
+    them to Wikipedia pages, showing the table, counters and histogram while results arrive.
+    Results so far are kept in the session (`wikidata_partial`) in case of interruption """
+    args = build_args_for_collect(id_query_type_l)
+    nb_queries = 1 if combined else len(args)
+    progress, counter, table, hist = st.progress(0), st.empty(), st.empty(), st.empty()
+
+    df_wd = pd.DataFrame()
+    for i, curr_df in enumerate(iter_collect_data(args_collect_list=args, combined=combined)):
+        df_wd = pd.concat([df_wd, curr_df]).drop_duplicates().fillna("")
+        st.session_state["wikidata_partial"] = df_wd.assign(wikipedia_page="")
+        progress.progress(0.5 * (i + 1) / nb_queries)
+        counter.markdown(f"_{df_wd.shape[0]} events collected ({i + 1}/{nb_queries} queries)_")
+        table.dataframe(df_wd.tail(content["max_nb"]))
+        hist.plotly_chart(get_fig_hist_plotly(
+            df_input=df_wd, x_data="query_type", tickangle=45,
+            title="Distribution of types of events retrieved from Wikidata"),
+            use_container_width=True)
+
+    # Add Wikipedia info
+    mapped = list()
+    chunks = iter_wikipedia_page(df_wd, col_wikidata=content["col_wikidata"]) \
+        if not df_wd.empty else list()
+    for chunk in chunks:
+        mapped.append(chunk)
+        nb_mapped = sum(curr.shape[0] for curr in mapped)
+        st.session_state["wikidata_partial"] = pd.concat(
+            mapped + [df_wd.iloc[nb_mapped:].assign(wikipedia_page="")])
+        progress.progress(0.5 + 0.5 * nb_mapped / df_wd.shape[0])
+        counter.markdown(f"_{nb_mapped}/{df_wd.shape[0]} events mapped to Wikipedia_")
+        table.dataframe(chunk)
+
+    for placeholder in [progress, counter, table, hist]:
+        placeholder.empty()
+    return pd.concat(mapped) if mapped else df_wd.assign(wikipedia_page="")
+
+
 def collect_data_st(content: dict):
     """ Select type of graph path to use """
     paths = st.multiselect(
@@ -64,91 +143,142 @@ def collect_data_st(content: dict):
     # 2. 1. + Adding a column to map each wikidata page to a wikipedia one
     # 3. 2. + Retrieving text content from Wikipedia pages
 
-    if st.button("Collect events"):
-
-        # Collect data from Wikidata
-        id_query_type_l = [(content['path_for_event'][path]["id"],
-                            content['path_for_event'][path]["query_type"],
-                            content["year_begin"], content["year_end"]) \
-                            for path in paths]
+    id_query_type_l = [(content['path_for_event'][path]["id"],
+                        content['path_for_event'][path]["query_type"],
+                        content["year_begin"], content["year_end"]) \
+                        for path in paths]
+    combined = st.checkbox("Retrieve all paths with a single query", value=False)
+    params = {"id_query_type": sorted(id_query_type_l)}
+    if combined:
+        params["combined"] = True
+
+    col_start, col_stop = st.columns([0.2, 0.8])
+    start_clicked = col_start.button("Collect events")
+    # Any click reruns the page, which interrupts a running collection
+    stop_clicked = col_stop.button("Stop")
+
+    if start_clicked:
+        # Collect data from Wikidata, displayed while it arrives
         collect_start = datetime.now()
-        df_wd = collect_data(
-            args_collect_list=build_args_for_collect(id_query_type_l)) \
-                .drop_duplicates()
-        df_wd = df_wd.fillna("")
-        collect_end = datetime.now()
-
+        with span("stage", stage="events"):
+            df_wd = get_shared_result(var="wikidata_collected", params=params)
 
-        # Add Wikipedia info
-        df_wd = add_wikipedia_page(df_wd, col_wikidata=content["col_wikidata"],
-                                save_path=None)
+            if df_wd is None:  # Not already collected by any session
+                df_wd = stream_collect_data(id_query_type_l=id_query_type_l, content=content,
+                                            combined=combined)
+        st.session_state.pop("wikidata_partial", None)
         collect_end = datetime.now()
 
         init_update_session_state(var=content["session_state_wd"],
                                   value=collect_end - collect_start)
 
-        st.markdown("""
-        #
-        ## Collected data and figures
-        --- """)
+    elif stop_clicked and check_val_in_session_state(var="wikidata_partial"):
+        df_wd = st.session_state.pop("wikidata_partial")
+        params["partial"] = content_hash(df_wd)
+        st.warning(f"Collection stopped, the {df_wd.shape[0]} events collected so far are kept")
 
+    else:
+        return
+
+    title_index = TitleIndex().update_from_df(
+        df_wd, col_wikidata=content["col_wikidata"], col_wikipedia="wikipedia_page")
+
+    st.markdown("""
+    #
+    ## Collected data and figures
+    --- """)
+
+    if start_clicked:
         it_took =  \
             "Collecting data from Wikidata and scraping Wikipedia urls"
         st.markdown(f"_{it_took} took:\n {st.session_state[content['session_state_wd']]} s_")
 
 
-        # Output result
-        paginate(df_wd, session_state_var_page=content["session_state_var_page"],
-                 max_nb=content["max_nb"])
-        add_download_link(to_download=df_wd.to_csv(index=False).encode(),
-                          file_end_name="collected-data", extension="csv")
-
-
-        # Visualisations (type of events, duplicates events, type of instances)
-        st.plotly_chart(
-            figure_or_data=get_fig_hist_plotly(
-                df_input=df_wd, x_data="query_type",
-                tickangle=45, title="Distribution of types of events retrieved from Wikidata"),
-                use_container_width=True)
-
-        df_nb_query_type = df_wd.groupby(content["col_wikidata"]).agg({'query_type': "nunique"})
-        df_nb_query_type = df_nb_query_type[df_nb_query_type.query_type > 1]
-        df_filtered = df_wd[df_wd[content["col_wikidata"]]\
-            .isin(df_nb_query_type.index)][[content['col_main_name'], 'query_type']]
-
-        if df_filtered.shape[0] > 1:
-            st.write("Some instances could be retrieved with two different query types. " + \
-                "Below is the list of such instances:")
-            st.dataframe(
-                df_filtered.pivot_table(
-                    index=content['col_main_name'], columns='query_type', aggfunc=len))
-
-        st.write("Recap of instances collected")
-
-        curr_df = df_wd[[col for col in df_wd \
-            if col in ['event', 'eventLabel', 'wikipedia_page']]]
-        nb_all  = curr_df.shape[0]
-        curr_df = curr_df.drop_duplicates()
-        nb_unique = curr_df.shape[0]
-        curr_df = curr_df[~curr_df[content['col_main_name']].str.contains('Q[1-9]')]
-        nb_label = curr_df.shape[0]
-        nb_mapped = len([url for url in curr_df.wikipedia_page if url != ""])
-
-        st.markdown(
-            f"""
-            |  Type | Nb  | % of all instances collected |
-            |---|---|---|
-            |  All collected instances | {nb_all}  | 100 |
-            | Unique collected instances  | {nb_unique}  | {round(100*nb_unique/nb_all, 1)}  |
-            | Unique collected instances with labels | {nb_label}  | {round(100*nb_label/nb_all, 1)}  |
-            | Unique collected instances with labels and Wikipedia mapping  | {nb_mapped}  | {round(100*nb_mapped/nb_all, 1)}  |
-            \n
-            """
-        )
-        st.markdown("\n\n")
-
-        if check_session_state_value(var="data_in_cache", value=True):
-            init_update_session_state(var="wikidata_collected", value=df_wd)
+    # Output result
+    paginate(df_wd, session_state_var_page=content["session_state_var_page"],
+             max_nb=content["max_nb"])
+    add_download_link(to_download=df_wd.to_csv(index=False).encode(),
+                      file_end_name="collected-data", extension="csv")
+
+
+    # Visualisations (type of events, duplicates events, type of instances)
+    st.plotly_chart(
+        figure_or_data=get_fig_hist_plotly(
+            df_input=df_wd, x_data="query_type",
+            tickangle=45, title="Distribution of types of events retrieved from Wikidata"),
+            use_container_width=True)
+
+    df_nb_query_type = df_wd.groupby(content["col_wikidata"]).agg({'query_type': "nunique"})
+    df_nb_query_type = df_nb_query_type[df_nb_query_type.query_type > 1]
+    df_filtered = df_wd[df_wd[content["col_wikidata"]]\
+        .isin(df_nb_query_type.index)][[content['col_main_name'], 'query_type']]
+
+    if df_filtered.shape[0] > 1:
+        st.write("Some instances could be retrieved with two different query types. " + \
+            "Below is the list of such instances:")
+        st.dataframe(
+            df_filtered.pivot_table(
+                index=content['col_main_name'], columns='query_type', aggfunc=len))
+
+    st.write("Recap of instances collected")
+
+    curr_df = df_wd[[col for col in df_wd \
+        if col in ['event', 'eventLabel', 'wikipedia_page']]]
+    nb_all  = curr_df.shape[0]
+    curr_df = curr_df.drop_duplicates()
+    nb_unique = curr_df.shape[0]
+    curr_df = curr_df[~curr_df[content['col_main_name']].str.contains('Q[1-9]')]
+    nb_label = curr_df.shape[0]
+    nb_mapped = len([url for url in curr_df.wikipedia_page if url != ""])
+
+    st.markdown(
+        f"""
+        |  Type | Nb  | % of all instances collected |
+        |---|---|---|
+        |  All collected instances | {nb_all}  | 100 |
+        | Unique collected instances  | {nb_unique}  | {round(100*nb_unique/nb_all, 1)}  |
+        | Unique collected instances with labels | {nb_label}  | {round(100*nb_label/nb_all, 1)}  |
+        | Unique collected instances with labels and Wikipedia mapping  | {nb_mapped}  | {round(100*nb_mapped/nb_all, 1)}  |
+        \n
+        """
+    )
+    st.markdown("\n\n")
+
+    if check_session_state_value(var="data_in_cache", value=True):
+        init_update_session_state(var="wikidata_collected", value=df_wd, params=params)
+        init_update_session_state(var="title_index", value=title_index)
+
+
+def display_stage_breakdown():
+    """ Duration, requests, bytes, cache hits/misses and errors of the last run
+    of each stage (cf. narrative/instrumentation.py), if tracing is on """
+    breakdown = TRACER.stage_breakdown()
+    if breakdown:
+        with st.sidebar.expander("Stage breakdown"):
+            st.dataframe(pd.DataFrame(breakdown).set_index("stage"))
+
+
+def load_pipeline_outputs(folder: str = PIPELINE_FOLDER) -> list[str]:
+    """ Filling session state with the artifacts of the last headless pipeline run
+    (cf. narrative/pipeline.py) instead of recomputing them. Returns loaded stages """
+    outputs, manifest = load_outputs(folder=folder), read_manifest(folder=folder)
+    stage_to_var = {
+        "events_mapped": "wikidata_collected", "wikidata_for_graph": "wikidata_for_graph",
+        "infoboxes": "infobox_collected", "wikipedia_for_graph": "wikipedia_for_graph",
+        "graph": "graph"
+    }
+    for stage, var in stage_to_var.items():
+        if stage in outputs:
+            init_update_session_state(var=var, value=outputs[stage],
+                                      params={"pipeline": manifest[stage]["key"]})
+    if "events_mapped" in outputs:
+        init_update_session_state(var="title_index", value=TitleIndex().update_from_df(
+            outputs["events_mapped"], col_wikidata="event", col_wikipedia="wikipedia_page"))
+    if "page_content" in outputs:
+        init_update_session_state(var="wikipedia_text",
+                                  value=get_text_info(outputs["page_content"]),
+                                  params={"pipeline": manifest["page_content"]["key"]})
+    return list(outputs.keys())
 
 
 def display_html_graph(html_path: str, size: int):
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache for the results of the app, shared by all user sessions.
+Each result is kept once (keyed by its name and the parameters it was computed with),
+sessions only hold handles. Results without handles are evicted (least recently used
+first) when the cache goes above its memory cap.
+"""
+import json
+import pickle
+import hashlib
+import logging
+import weakref
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+
+def estimate_size(value) -> int:
+    """ Approximate memory size of value in bytes """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, "serialize") and hasattr(value, "triples"):  # rdflib graph
+        return 500 * len(value)
+    try:
+        return len(pickle.dumps(value))
+    except Exception:
+        return 0
+
+
+def content_hash(value) -> str:
+    """ Hash of the content of value, e.g. to key partial results: results computed with
+    the same parameters but interrupted at different points should not share an entry """
+    if isinstance(value, pd.DataFrame):
+        try:
+            return hashlib.sha256(pd.util.hash_pandas_object(value).values.tobytes() + \
+                json.dumps(list(map(str, value.columns))).encode()).hexdigest()
+        except TypeError:  # unhashable cells, e.g. lists
+            pass
+    return hashlib.sha256(pickle.dumps(value)).hexdigest()
+
+
+class Handle:
+    """ Reference to a result in the shared cache, released when garbage collected
+    (e.g. when replaced in, or together with, the session state) """
+
+    def __init__(self, cache, key: str):
+        self.key = key
+        cache.acquire(key)
+        self._cache = cache
+        weakref.finalize(self, cache.release, key)
+
+    def get(self):
+        """ Result pointed by the handle """
+        return self._cache.get(self.key)
+
+
+class SharedResultCache:
+    """ Immutable results, reference-counted, with a memory cap in MB """
+
+    def __init__(self, max_mb: float = 2000):
+        self.max_bytes = max_mb * 1024 * 1024
+        self._entries = OrderedDict()  # key -> [value, size, nb of handles]
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(var: str, params: dict = None) -> str:
+        """ Key of a result from its name and parameters """
+        return hashlib.sha256(json.dumps({"var": var, "params": params or dict()},
+                              sort_keys=True, default=str).encode()).hexdigest()
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        """ Total size of the results in bytes """
+        return sum(entry[1] for entry in self._entries.values())
+
+    def put(self, key: str, value) -> Handle:
+        """ Storing value if key is not already there (the stored value is kept otherwise),
+        returns a handle to the stored value """
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = [value, estimate_size(value), 0]
+            handle = Handle(self, key)
+            self._evict()
+        return handle
+
+    def get(self, key: str):
+        """ Stored value, None if not in cache """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def get_handle(self, key: str):
+        """ New handle to an already stored value, None if not in cache """
+        with self._lock:
+            return Handle(self, key) if key in self._entries else None
+
+    def acquire(self, key: str):
+        """ One more handle on key """
+        with self._lock:
+            self._entries[key][2] += 1
+
+    def release(self, key: str):
+        """ One less handle on key """
+        with self._lock:
+            if key in self._entries:
+                self._entries[key][2] -= 1
+            self._evict()
+
+    def _evict(self):
+        """ Removing unreferenced results, least recently used first, until under the cap """
+        size = self.size
+        for key in [key for key, entry in self._entries.items() if entry[2] <= 0]:
+            if size <= self.max_bytes:
+                break
+            size -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            LOGGER.warning("Shared cache above its cap (%d MB), all results are in use",
+                           size // (1024 * 1024))
+
+    def stats(self) -> dict:
+        """ Number of results, handles and total size """
+        with self._lock:
+            return {"results": len(self._entries),
+                    "handles": sum(entry[2] for entry in self._entries.values()),
+                    "size_mb": round(self.size / (1024 * 1024), 1)}
@@ -1,40 +1,16 @@
 # -*- coding: utf-8 -*-
 """ Wikidata info retrieval """
-import os
-import yaml
 import streamlit as st
-import pandas as pd
-from settings.settings import ROOT_PATH
 
-from kb_sparql.query_db import SPARQL_QUERIES
-from kb_sparql.sparql_query import run_query_return_df
+from kb_sparql.gather_events import get_outgoing_nodes
+from kb_sparql.predicates import PRED_GROUPING_WD
+from narrative.instrumentation import span
+from narrative.pipeline import load_content
 from .helpers import get_session_state_val, add_download_link
-from .helpers import check_session_state_value, init_update_session_state
-
-with open(os.path.join(ROOT_PATH, "app-demo/content/event_collection.yaml")) as file:
-    content = yaml.load(file, Loader=yaml.FullLoader)
-
-query_template = SPARQL_QUERIES['forward_links']
-
-def get_clean_output_sparql(id_event):
-    """ Rename columns from sparql output """
-    to_keep = ["objectLabel.value", "wdLabel.value", "ps_.value", "ps_Label.value"]
-    renaming = {
-        "objectLabel.value": "eventLabel", "wdLabel.value": "predicate",
-        "ps_.value": "object", "ps_Label.value": "objectLabel"
-    }
-    return_df = run_query_return_df(query_template(id_event))[to_keep].rename(columns=renaming)
-    return_df['wd_page'] = f"http://www.wikidata.org/entity/{id_event}"
-    return return_df
-
-@st.cache(show_spinner=False)
-def get_outgoing_nodes(events):
-    """ SPARQL Query for outgoing nodes """
-    df_wd = pd.DataFrame(columns=["wd_page", "eventLabel", "predicate", "object", "objectLabel"])
-    for event in events:
-        id_event = event.split('/')[-1]
-        df_wd = pd.concat([df_wd, get_clean_output_sparql(id_event)])
-    return df_wd
+from .helpers import check_session_state_value, init_update_session_state, \
+    get_session_state_key, get_shared_result
+
+content = load_content()
 
 def app():
     """ Main func """
@@ -59,23 +35,18 @@ def app():
 
     if st.button("Extract outgoing nodes"):
 
-        df_wd = get_outgoing_nodes(events=data.event.values)
+        params = {"from": get_session_state_key(var="wikidata_collected")}
+        with span("stage", stage="wikidata_for_graph"):
+            df_wd = get_shared_result(var="wikidata_for_graph", params=params)
+            if df_wd is None:
+                df_wd = get_outgoing_nodes(events=data.event.values)
         add_download_link(to_download=df_wd.to_csv(index=False).encode(),
                           file_end_name="collected-wikidata", extension="csv")
 
         if check_session_state_value(var="data_in_cache", value=True):
-            init_update_session_state(var="wikidata_for_graph", value=df_wd)
-
-        pred_grouping_wd = {
-            'who': ['participant', 'organizer', 'founded by'],
-            'where': ['country', 'location', 'coordinate location',
-                    'located in the administrative territorial entity', 'continent'],
-            'when': ['point in time', 'start time', 'end time',
-                    'inception', 'dissolved, abolished or demolished date'],
-            'temporal_link': ['part of', 'followed by', 'replaces',
-                            'replaced by', 'follows', 'time period'],
-            'causal_link': ['has effect'],
-        }
+            init_update_session_state(var="wikidata_for_graph", value=df_wd, params=params)
+
+        pred_grouping_wd = PRED_GROUPING_WD
 
         inverse_pred_wd = {x: k for k, v in pred_grouping_wd.items() for x in v}
         predicates_narrative_wd = [x for _, v in pred_grouping_wd.items() for x in v]
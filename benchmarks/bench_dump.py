@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+""" Dump index (kb_sparql/dump_backend.py): ingestion of the fixture dump, and queries
+answered from the index, checked against the recorded SPARQL results """
+import os
+
+import pytest
+
+from kb_sparql.dump_backend import build_index
+from kb_sparql.query_db import SPARQL_QUERIES
+from kb_sparql.sparql_results import from_json, get_col_to_keep
+from benchmarks.synthetic import FIXTURES, load_fixture
+
+DUMP = os.path.join(FIXTURES, "wikidata_dump_Q6534.json")
+
+
+@pytest.fixture(scope="module")
+def dump_index(tmp_path_factory):
+    return build_index(DUMP, str(tmp_path_factory.mktemp("dump") / "index.sqlite"), ["Q6534"])
+
+
+def bench_build_index(benchmark, tmp_path):
+    benchmark(build_index, DUMP, str(tmp_path / "index.sqlite"), ["Q6534"])
+
+
+@pytest.mark.parametrize("query_type", ["obj-part-of-id", "forward_links"])
+def bench_dump_query(benchmark, dump_index, query_type):
+    query = SPARQL_QUERIES[query_type]("Q6534")
+    df_output = benchmark(dump_index.run_query_clean_df, query)
+    expected = from_json(load_fixture(f"sparql_{query_type}_Q6534.json"), get_col_to_keep(query))
+    columns = list(expected.columns)
+    assert list(df_output.columns) == columns
+    assert df_output.sort_values(columns, ignore_index=True).equals(
+        expected.sort_values(columns, ignore_index=True))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+""" Compact event table (kb_sparql/event_table.py): building it from the wide DataFrames,
+joining the outgoing links with the events on urls vs QIDs, memory use """
+import pytest
+import pandas as pd
+
+from kb_sparql.event_table import EventTable
+from kb_sparql.sparql_results import apply_dtypes
+from benchmarks.synthetic import collected_events, forward_links
+
+TABLES = dict()
+
+
+def event_table(n_events):
+    """ Wide DataFrames and event table, built once per scale """
+    if n_events not in TABLES:
+        events, links = collected_events(n_events), forward_links(n_events)
+        TABLES[n_events] = (events, links, EventTable.from_frames(events=events, links=links))
+    return TABLES[n_events]
+
+
+def join_wide(events, links):
+    return links.merge(events[["event", "query_type"]].rename(columns={"event": "wd_page"}),
+                       on="wd_page")
+
+
+def join_qid(table):
+    return table.links.merge(table.events[["qid", "query_type"]], on="qid")
+
+
+def bench_build_event_table(scaled, n_events):
+    events, links, _ = event_table(n_events)
+    scaled(n_events, EventTable.from_frames, events=events, links=links)
+
+
+@pytest.mark.parametrize("key", ["wide", "qid"])
+def bench_join_links_events(scaled, n_events, key):
+    events, links, table = event_table(n_events)
+    df_output = scaled(n_events, join_wide, events=events, links=links) if key == "wide" \
+        else scaled(n_events, join_qid, table=table)
+    assert df_output.shape[0] == links.shape[0]
+
+
+def bench_event_table_memory(benchmark, n_events):
+    events, links, table = event_table(n_events)
+    wide = int(events.memory_usage(deep=True).sum() + links.memory_usage(deep=True).sum())
+    benchmark.extra_info.update({"n_events": n_events, "wide_bytes": wide,
+                                 "compact_bytes": table.memory_usage()})
+    benchmark(table.links_frame)
+    assert table.memory_usage() < wide / 2
+
+
+def bench_event_table_round_trip(benchmark, n_events):
+    """ Wide DataFrames given back as they were, incl. dates out of the datetime range
+    (before 1677, BCE) """
+    events, links, _ = event_table(n_events)
+    events = apply_dtypes(events.assign(pointintime=[
+        "1515-09-13T00:00:00Z", "-0100-01-01T00:00:00Z"] + \
+            [f"{date}T00:00:00Z" for date in events.pointintime[2:]]).astype(
+                {"query_type": "category"}))
+    links = apply_dtypes(links.assign(start=["1515-09-13T00:00:00Z", "-0100-01-01T00:00:00Z",
+                                             "1789-07-14T00:00:00Z", ""] + \
+        [None] * (links.shape[0] - 4)).astype({"predicate": "category"}))
+    table = benchmark(EventTable.from_frames, events=events, links=links)
+    assert events.pointintime.notna().all() and links.start.notna().sum() == 3
+    pd.testing.assert_frame_equal(table.events_frame(), events)
+    pd.testing.assert_frame_equal(table.links_frame(), links)
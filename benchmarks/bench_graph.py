@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+""" RDF conversion, Turtle serialization and queries on the narrative graph """
+import pandas as pd
+import pytest
+
+from graph_building.converter import WikidataConverter, WikipediaConverter, init_graph
+from kb_sparql.local_kg_query import QUERY_EVENT, QUERY_POINT_IN_TIME, \
+    QUERY_EVENT_TYPE, QUERY_ACTOR_ROLE
+from benchmarks.synthetic import forward_links, load_fixture, wikipedia_for_graph
+
+QUERIES = {"event": QUERY_EVENT, "point_in_time": QUERY_POINT_IN_TIME,
+           "event_type": QUERY_EVENT_TYPE, "actor_role": QUERY_ACTOR_ROLE}
+
+GRAPHS = dict()
+
+
+def convert(converter, df_info):
+    return converter(init_graph(), df_info)
+
+
+def narrative_graph(n_events):
+    """ Graph from both converters, built once per scale """
+    if n_events not in GRAPHS:
+        graph, counter = WikipediaConverter()(init_graph(), wikipedia_for_graph(n_events))
+        GRAPHS[n_events], _ = WikidataConverter()(graph, forward_links(n_events), counter)
+    return GRAPHS[n_events]
+
+
+def bench_wikidata_converter_recorded(benchmark):
+    recorded = load_fixture("sparql_forward_links_Q6534.json")["results"]["bindings"]
+    df_wd = pd.DataFrame(
+        [(row["objectLabel"]["value"], row["wdLabel"]["value"],
+          row["ps_"]["value"], row["ps_Label"]["value"]) for row in recorded],
+        columns=["eventLabel", "predicate", "object", "objectLabel"])
+    df_wd["wd_page"] = "http://www.wikidata.org/entity/Q6534"
+    benchmark(convert, WikidataConverter(), df_wd)
+
+
+def bench_wikidata_converter(scaled, n_events):
+    scaled(n_events, convert, converter=WikidataConverter(), df_info=forward_links(n_events))
+
+
+def bench_wikipedia_converter(scaled, n_events):
+    scaled(n_events, convert, converter=WikipediaConverter(),
+           df_info=wikipedia_for_graph(n_events))
+
+
+def bench_turtle_serialization(scaled, n_events):
+    graph = narrative_graph(n_events)
+    scaled(n_events, graph.serialize, format="turtle")
+
+
+@pytest.mark.parametrize("query", list(QUERIES))
+def bench_local_kg_query(scaled, n_events, query):
+    graph = narrative_graph(n_events)
+    scaled(n_events, lambda: list(graph.query(QUERIES[query])))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+""" Import time of the library modules, each one in a fresh interpreter """
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "kb_sparql.gather_events", "wikipedia_narrative.map_wikidata_wikipedia",
+    "wikipedia_narrative.store_page_content", "wikipedia_narrative.info_boxes.get_infobox",
+    "graph_building.converter", "narrative.pipeline",
+]
+
+# Only loaded when first used (cf. narrative/cache.py for streamlit)
+DEFERRED = ["streamlit", "wptools", "plotly", "bs4"]
+
+
+def import_module(module: str) -> dict:
+    """ Importing module in a new interpreter: cumulative import time (-X importtime)
+    and deferred modules that were loaded anyway """
+    code = f"import sys, {module}; print(','.join(x for x in {DEFERRED} if x in sys.modules))"
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    line = [line for line in output.stderr.splitlines() if line.endswith(f"| {module}")][-1]
+    return {"import_ms": int(line.split("|")[1]) / 1000,
+            "loaded": [x for x in output.stdout.strip().split(",") if x]}
+
+
+@pytest.mark.parametrize("module", MODULES)
+def bench_import(benchmark, module):
+    res = benchmark.pedantic(import_module, args=(module,), rounds=3, iterations=1)
+    benchmark.extra_info.update(res)
+    assert not res["loaded"], f"{module} imports {res['loaded']}"
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+""" Infobox preprocessing, link resolution and tabular conversion """
+from wikipedia_narrative.info_boxes.pre_process_infobox import \
+    filter_infobox_edges, merge_infobox_edges
+from wikipedia_narrative.info_boxes.link_resolver import LinkResolver
+from wikipedia_narrative.info_boxes.infobox_table import build_df_from_infobox
+from wikipedia_narrative.info_boxes.infobox_for_graph import filter_narrative_predicates
+from benchmarks.synthetic import infoboxes_with_href, load_fixture, raw_infoboxes
+
+
+def filter_all(infoboxes):
+    return [filter_infobox_edges(infobox) for infobox in infoboxes.values()]
+
+
+def merge_all(infoboxes):
+    # merge_infobox_edges modifies its input, copies are part of the measure
+    return [merge_infobox_edges(dict(infobox)) for infobox in infoboxes.values()]
+
+
+def bench_filter_infobox_edges(scaled, n_events):
+    scaled(n_events, filter_all, infoboxes=raw_infoboxes(n_events))
+
+
+def bench_merge_infobox_edges(scaled, n_events):
+    scaled(n_events, merge_all, infoboxes=raw_infoboxes(n_events))
+
+
+def bench_add_url_recorded(benchmark):
+    recorded = load_fixture("infobox_Coup_of_18_Brumaire.json")
+    infobox = {k: {"text": v} for k, v in recorded["infobox"].items()}
+    benchmark(lambda: LinkResolver(links=recorded["links"]).add_url(infobox))
+
+
+def bench_build_df_from_infobox(scaled, n_events):
+    scaled(n_events, build_df_from_infobox, infoboxes=infoboxes_with_href(n_events))
+
+
+def bench_filter_narrative_predicates(scaled, n_events):
+    df_infobox = build_df_from_infobox(infoboxes_with_href(n_events))
+    scaled(n_events, filter_narrative_predicates, df_input=df_infobox)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+""" Incremental refresh (kb_sparql/refresh.py) against the stand-in server: revision IDs
+are checked in bulk, and only the events edited by `/_edit` are retrieved again """
+import pandas as pd
+import pytest
+import requests
+
+import kb_sparql.refresh as refresh
+from kb_sparql.gather_events import FORWARD_LINKS_COLUMNS
+from narrative import standin_server
+
+EVENTS = [f"Q{i}" for i in range(1000, 1300)]
+
+
+@pytest.fixture
+def standin(tmp_path):
+    server = standin_server.start(port=0, folder=str(tmp_path / "recordings"))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetched(monkeypatch, standin):
+    """ Revision checks go to the stand-in, outgoing links are one row per event
+    with its revision (recording the events retrieved) """
+    monkeypatch.setattr(refresh, "WIKIDATA_API", f"{standin}/wikidata/w/api.php")
+    res = list()
+
+    def get_clean_output_sparql(wd_id, **kwargs):
+        res.append(wd_id)
+        revision = refresh.RevisionChecker().revisions([wd_id])[wd_id]
+        return pd.DataFrame([(f"{refresh.WD_ENTITY}{wd_id}", wd_id, "part of",
+                              f"{refresh.WD_ENTITY}Q{revision}", str(revision),
+                              pd.NaT, pd.NaT, pd.NaT)], columns=FORWARD_LINKS_COLUMNS)
+    monkeypatch.setattr(refresh, "get_clean_output_sparql", get_clean_output_sparql)
+    return res
+
+
+def bench_refresh_after_edit(benchmark, tmp_path, standin, fetched):
+    refresher = refresh.Refresher(str(tmp_path / "refresh"))
+    refresher.refresh_forward_links(EVENTS)
+    assert fetched == EVENTS
+    requests.get(f"{standin}/_edit").raise_for_status()
+
+    edited = [wd_id for wd_id in EVENTS if standin_server.synthetic_revision(wd_id, epoch=0) \
+        != standin_server.synthetic_revision(wd_id, epoch=1)]
+    fetched.clear()
+    links, delta = benchmark.pedantic(refresher.refresh_forward_links, args=(EVENTS,),
+                                      rounds=1, iterations=1)
+    assert edited and sorted(fetched) == sorted(edited)
+    assert links.shape[0] == len(EVENTS)
+    delta_ids = {url.split("/")[-1] for url in delta.wd_page}
+    assert delta_ids == set(edited)
+    assert (delta.change == "added").sum() == (delta.change == "removed").sum() == len(edited)
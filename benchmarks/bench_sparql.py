@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+""" SPARQL output decoding and cleaning """
+import pandas as pd
+
+import kb_sparql.sparql_query as sparql_query
+from kb_sparql.sparql_results import from_csv, from_json, get_col_to_keep
+from kb_sparql.query_db import SPARQL_QUERIES
+from kb_sparql.gather_events import get_clean_output_sparql
+from benchmarks.synthetic import load_fixture, sparql_collect_results
+
+QUERY = SPARQL_QUERIES["obj-part-of-id"]("Q6534")
+
+
+def bench_process_df_recorded(benchmark):
+    df_raw = pd.json_normalize(
+        load_fixture("sparql_obj-part-of-id_Q6534.json")["results"]["bindings"])
+    benchmark(sparql_query.process_df, df_raw, QUERY)
+
+
+def bench_json_normalize(scaled, n_events):
+    bindings = sparql_collect_results(n_events)["results"]["bindings"]
+    scaled(n_events, pd.json_normalize, data=bindings)
+
+
+def bench_process_df(scaled, n_events):
+    df_raw = pd.json_normalize(sparql_collect_results(n_events)["results"]["bindings"])
+    scaled(n_events, sparql_query.process_df, df_input=df_raw, query=QUERY)
+
+
+def bench_json_normalize_process_df(scaled, n_events):
+    """ Former decoding (`json` decoder), to compare with the typed decoders below """
+    bindings = sparql_collect_results(n_events)["results"]["bindings"]
+    scaled(n_events, lambda: sparql_query.process_df(pd.json_normalize(bindings), QUERY))
+
+
+def bench_typed_from_json(scaled, n_events):
+    scaled(n_events, from_json, results=sparql_collect_results(n_events),
+           variables=get_col_to_keep(QUERY))
+
+
+def bench_typed_from_csv(scaled, n_events):
+    body = from_json(sparql_collect_results(n_events), get_col_to_keep(QUERY)) \
+        .to_csv(index=False, date_format="%Y-%m-%dT%H:%M:%SZ").encode()
+    scaled(n_events, from_csv, body=body, variables=get_col_to_keep(QUERY))
+
+
+def bench_dates_out_of_range(benchmark):
+    """ Dates before 1677 and BCE dates are not lost (nanosecond datetimes in pandas 1.x) """
+    body = b"event,start,end\nhttp://www.wikidata.org/entity/Q1,1515-09-13T00:00:00Z," + \
+        b"-0100-01-01T00:00:00Z\nhttp://www.wikidata.org/entity/Q2,1789-07-14T00:00:00Z,\n"
+    df_output = benchmark(from_csv, body=body, variables=["event", "start", "end"])
+    assert df_output.start.notna().all() and pd.isna(df_output.end[1])
+    assert df_output.start[0] in ["1515-09-13T00:00:00Z", pd.Timestamp("1515-09-13", tz="UTC")]
+    assert df_output.start[1] == pd.Timestamp("1789-07-14", tz="UTC")
+    assert df_output.end[0] == "-0100-01-01T00:00:00Z"
+
+
+def bench_get_clean_output_sparql_recorded(benchmark, monkeypatch):
+    results = load_fixture("sparql_forward_links_Q6534.json")
+    monkeypatch.setattr(sparql_query, "query_df",
+                        lambda query, **kwargs: from_json(results, get_col_to_keep(query)))
+    benchmark(get_clean_output_sparql, "Q6534")
+
+
+def bench_render_query(benchmark):
+    benchmark(SPARQL_QUERIES["forward_links"], "Q6534", lang="fr")
+
+
+def bench_render_batch(benchmark):
+    ids = [f"Q{i}" for i in range(1, 1001)]
+    benchmark(SPARQL_QUERIES["forward_links"].render_batch, ids, lang="fr")
+
+
+def bench_get_col_to_keep(benchmark):
+    """ Projection of a rendered query (no parsing) """
+    benchmark(get_col_to_keep, QUERY)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+""" Wikidata -> Wikipedia mapping and Wikipedia page preprocessing """
+import pandas as pd
+
+from wikipedia_narrative.map_wikidata_wikipedia import iter_wikipedia_page
+from wikipedia_narrative.wikipedia_page import WikipediaPage
+from benchmarks.synthetic import collected_events, load_fixture, wikipedia_pages
+
+
+def add_wikipedia_page(df_pd, col_wikidata):
+    """ `add_wikipedia_page` without the streamlit cache, which would hit after the first round """
+    return pd.concat(iter_wikipedia_page(df_pd, col_wikidata=col_wikidata))
+
+
+def bench_add_wikipedia_page(scaled, n_events, recorded_wikidata_api):
+    scaled(n_events, add_wikipedia_page, df_pd=collected_events(n_events), col_wikidata="event")
+
+
+def bench_wikipedia_page_recorded(benchmark):
+    page = load_fixture("wikipedia_page_Coup_of_18_Brumaire.json")
+    benchmark(WikipediaPage, title=page["title"], content=page["content"])
+
+
+def build_pages(pages):
+    """ Preprocessing of each page + formatting by section """
+    return [WikipediaPage(title=title, content=content) \
+        .format_data_for_pipeline(granularity="section", titles=False) \
+            for title, content in pages]
+
+
+def bench_wikipedia_page(scaled, n_events):
+    scaled(n_events, build_pages, pages=wikipedia_pages(n_events))
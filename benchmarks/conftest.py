@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the benchmarks: event scales, offline guard and recorded responses
+"""
+import os
+import json
+import socket
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from benchmarks.synthetic import SCALES, load_fixture
+
+# Fewer rounds for the larger scales
+ROUNDS = {1000: 5, 10000: 3, 100000: 1}
+
+
+def pytest_addoption(parser):
+    parser.addoption("--scale", default="1k",
+                     help=f"comma-separated numbers of synthetic events, among {list(SCALES)}")
+
+
+def pytest_generate_tests(metafunc):
+    if "n_events" in metafunc.fixturenames:
+        scales = metafunc.config.getoption("scale").split(",")
+        if any(scale not in SCALES for scale in scales):
+            raise pytest.UsageError(f"--scale values should be among {list(SCALES)}")
+        metafunc.parametrize("n_events", [SCALES[scale] for scale in scales], ids=scales)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_folder(tmp_path_factory):
+    """ Persistent caches (KVStore, artifacts, stand-in recordings) in a temporary folder,
+    not in the CACHE_FOLDER of the developer """
+    from narrative import kv_store, artifacts, standin_server
+    from kb_sparql.labels import get_resolver
+    folder = str(tmp_path_factory.mktemp("cache"))
+    patch = pytest.MonkeyPatch()
+    patch.setattr(kv_store, "CACHE_FOLDER", folder)
+    patch.setattr(artifacts.ArtifactCache.__init__, "__defaults__",
+                  (os.path.join(folder, "artifacts"),))
+    patch.setattr(standin_server, "RECORDING_FOLDER", os.path.join(folder, "standin"))
+    get_resolver.cache_clear()
+    yield folder
+    patch.undo()
+    get_resolver.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    """ Any network access fails: benchmarks only use recorded or synthetic data,
+    or the local stand-in server (narrative/standin_server.py) """
+    connect = socket.socket.connect
+
+    def guard(sock, address, *args, **kwargs):
+        if isinstance(address, tuple) and address[0] in ["127.0.0.1", "localhost", "::1"]:
+            return connect(sock, address, *args, **kwargs)
+        raise RuntimeError("Benchmarks run offline, use the recorded fixtures")
+    monkeypatch.setattr(socket.socket, "connect", guard)
+
+
+@pytest.fixture
+def scaled(benchmark):
+    """ Benchmarking func(**kwargs) on n_events, with a number of rounds adapted to the scale """
+    def run(n_events, func, **kwargs):
+        benchmark.extra_info["n_events"] = n_events
+        return benchmark.pedantic(func, kwargs=kwargs, rounds=ROUNDS.get(n_events, 1),
+                                  iterations=1)
+    return run
+
+
+class RecordedResponse:
+    """ Minimal `requests` response """
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.content = json.dumps(data).encode()
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def recorded_wikidata_api(monkeypatch):
+    """ wbgetentities (sitelinks) answered from the recorded response, for any ID.
+    `requests.get` is patched before the worker processes are forked """
+    import requests
+    entity = load_fixture("wbgetentities_sitelinks_Q6534.json")["entities"]["Q6534"]
+
+    def get(url, *args, **kwargs):
+        wd_id = parse_qs(urlparse(url).query)["ids"][0]
+        sitelink = dict(entity["sitelinks"]["enwiki"], title=f"Page {wd_id}",
+                        url=f"https://en.wikipedia.org/wiki/Page_{wd_id}")
+        return RecordedResponse(
+            {"entities": {wd_id: dict(entity, id=wd_id, sitelinks={"enwiki": sitelink})}})
+    monkeypatch.setattr(requests, "get", get)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Re-recording the fixtures of the benchmarks from the live endpoints.
+From the root of the repository (requires network access):
+python -m benchmarks.record_fixtures
+"""
+import os
+import json
+
+import requests
+
+from kb_sparql.query_db import SPARQL_QUERIES
+from wikipedia_narrative.wikipedia_page import WikipediaPage
+from benchmarks.synthetic import FIXTURES
+from settings.settings import AGENT, WIKIDATA_SPARQL_ENDPOINT, WIKIDATA_API, WIKIPEDIA_URL
+
+
+def record_sparql(query_type: str, wd_id: str):
+    """ Raw SPARQL json results """
+    response = requests.get(WIKIDATA_SPARQL_ENDPOINT, headers={"User-Agent": AGENT},
+                            params={"query": SPARQL_QUERIES[query_type](wd_id), "format": "json"})
+    response.raise_for_status()
+    return response.json()
+
+
+def record_sitelinks(wd_id: str):
+    """ wbgetentities response, as used in `get_wp_url_from_wd_id` """
+    return requests.get(WIKIDATA_API, headers={"User-Agent": AGENT},
+                        params={"action": "wbgetentities", "props": "sitelinks/urls",
+                                "ids": wd_id, "format": "json"}).json()
+
+
+def record_page(title: str):
+    """ Wikipedia page content, as used in `WikipediaPage` """
+    page = WikipediaPage(title=title)
+    return {"title": page.title, "url": page.url, "content": page.content}
+
+
+def record_infobox(title: str):
+    """ Raw infobox + links found in its html, as used in `fetch_one_infobox` """
+    from wikipedia_narrative.info_boxes.get_infobox import extract_infobox_no_url, \
+        get_html_from_url, get_link_from_html
+    infobox = {k: v["text"] for k, v in extract_infobox_no_url(page_name=title).items()}
+    links = get_link_from_html(get_html_from_url(
+        f"{WIKIPEDIA_URL.format(lang='en')}/wiki/{title.replace(' ', '_')}"))
+    return {"page": title, "infobox": infobox, "links": links}
+
+
+def save(name: str, content):
+    """ Storing one fixture """
+    with open(os.path.join(FIXTURES, name), "w", encoding="utf-8") as file:
+        json.dump(content, file, indent=1, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    save("sparql_obj-part-of-id_Q6534.json", record_sparql("obj-part-of-id", "Q6534"))
+    save("sparql_forward_links_Q6534.json", record_sparql("forward_links", "Q6534"))
+    save("wbgetentities_sitelinks_Q6534.json", record_sitelinks("Q6534"))
+    save("wikipedia_page_Coup_of_18_Brumaire.json", record_page("Coup of 18 Brumaire"))
+    save("infobox_Coup_of_18_Brumaire.json", record_infobox("Coup of 18 Brumaire"))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic inputs for the benchmarks, shaped like the recorded fixtures
+and scaled to a number of events. Deterministic for a given seed.
+"""
+import json
+import os
+import random
+
+import pandas as pd
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+WD = "http://www.wikidata.org/entity/"
+XSD_DATETIME = "http://www.w3.org/2001/XMLSchema#dateTime"
+
+# (predicate, whether the object is a Wikidata entity)
+WD_PREDICATES = [
+    ("instance of", True), ("has effect", True), ("part of", True),
+    ("point in time", False), ("start time", False), ("end time", False),
+    ("location", True), ("country", True), ("continent", True),
+    ("participant", True), ("organizer", True), ("founded by", True),
+    ("follows", True), ("followed by", True), ("replaces", True),
+    ("Commons category", False), ("described by source", True),
+]
+
+# Each predicate is used at most once per event (cf. `WikipediaConverter._add_leader_deputy`)
+WP_PREDICATES = [
+    "partof", "preceded_by", "succeeded_by", "era", "event_start", "place", "location",
+    "founder", "organisers", "Participants", "combatant1", "combatant2",
+    "commander1", "commander2", "leader1", "leader2", "deputy1",
+]
+
+
+def load_fixture(name: str):
+    """ Recorded response in the fixtures folder """
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _date(rng: random.Random) -> str:
+    return f"{rng.randint(1789, 1799)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def sparql_collect_results(n_events: int, seed: int = 0) -> dict:
+    """ SPARQL json results of an `obj-part-of-id` query returning n_events events """
+    rng = random.Random(seed)
+    bindings = list()
+    for i in range(n_events):
+        binding = {"event": {"type": "uri", "value": f"{WD}Q{i + 1}"},
+                   "eventLabel": {"type": "literal", "xml:lang": "en", "value": f"Event {i}"}}
+        for var in rng.choice([["pointintime"], ["start", "end"], ["inception", "dissolved"]]):
+            binding[var] = {"type": "literal", "datatype": XSD_DATETIME,
+                            "value": f"{_date(rng)}T00:00:00Z"}
+        bindings.append(binding)
+    return {"head": {"vars": ["event", "eventLabel", "pointintime", "start", "end",
+                              "inception", "dissolved"]},
+            "results": {"bindings": bindings}}
+
+
+def collected_events(n_events: int, seed: int = 0) -> pd.core.frame.DataFrame:
+    """ Output of the event collection (before the Wikipedia mapping) """
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        "event": [f"{WD}Q{i + 1}" for i in range(n_events)],
+        "eventLabel": [f"Event {i}" for i in range(n_events)],
+        "pointintime": [_date(rng) for _ in range(n_events)],
+        "query_type": [rng.choice(["obj-part-of-id", "id-has-significant-event-obj"]) \
+            for _ in range(n_events)],
+    })
+
+
+def forward_links(n_events: int, links_per_event: int = 8,
+                  seed: int = 0) -> pd.core.frame.DataFrame:
+    """ Outgoing links of each event (input of `WikidataConverter`).
+    Objects are drawn from a pool ten times smaller than the events, as in real data """
+    rng = random.Random(seed)
+    nb_objects = max(n_events // 10, 1)
+    rows = list()
+    for i in range(n_events):
+        for predicate, is_entity in rng.sample(WD_PREDICATES, k=links_per_event):
+            if is_entity:
+                obj_id = rng.randrange(nb_objects)
+                obj, obj_l = f"{WD}Q{10**7 + obj_id}", f"Object {obj_id}"
+            else:
+                obj = obj_l = _date(rng)
+            rows.append((f"{WD}Q{i + 1}", f"Event {i}", predicate, obj, obj_l))
+    return pd.DataFrame(rows, columns=["wd_page", "eventLabel", "predicate",
+                                       "object", "objectLabel"])
+
+
+def wikipedia_for_graph(n_events: int, links_per_event: int = 8,
+                        seed: int = 0) -> pd.core.frame.DataFrame:
+    """ Infobox links of each event with their Wikidata IDs (input of `WikipediaConverter`) """
+    rng = random.Random(seed)
+    nb_objects = max(n_events // 10, links_per_event)
+    rows = list()
+    for i in range(n_events):
+        # Distinct objects per event (cf. `WikipediaConverter._add_combatant_commander_link`)
+        for predicate, obj_id in zip(rng.sample(WP_PREDICATES, k=links_per_event),
+                                     rng.sample(range(nb_objects), k=links_per_event)):
+            rows.append((f"Event {i}", predicate, f"Object {obj_id}", f"Q{10**7 + obj_id}",
+                         f"{WD}Q{i + 1}", f"{WD}Q{10**7 + obj_id}"))
+    return pd.DataFrame(rows, columns=["eventLabel", "predicate", "objectLabel", "wd_id",
+                                       "wd_page", "obj_wd"])
+
+
+def raw_infoboxes(n_events: int, seed: int = 0) -> dict[str, dict]:
+    """ wptools-like infoboxes (label -> text), variations of the recorded one """
+    rng = random.Random(seed)
+    template = load_fixture("infobox_Coup_of_18_Brumaire.json")["infobox"]
+    # year_* labels always come with their date_* label (cf. `merge_infobox_edges`)
+    extra = [("date_start", "year_start"), ("date_end", "year_end"), ("Location",),
+             ("commanders1",), ("flag_p1",), ("flag_s2",), ("title_leader",), ("house_type",)]
+    res = dict()
+    for i in range(n_events):
+        infobox = {k: v for k, v in template.items() if rng.random() < 0.8}
+        infobox.update({k: f"[[Object {rng.randrange(1000)}]]" \
+            for labels in rng.sample(extra, k=3) for k in labels})
+        res[f"Event {i}"] = infobox
+    return res
+
+
+def infoboxes_with_href(n_events: int, seed: int = 0) -> dict[str, dict]:
+    """ Infoboxes after link resolution (label -> {text, href}), input of `build_df_from_infobox` """
+    rng = random.Random(seed)
+    res = dict()
+    for i in range(n_events):
+        infobox = dict()
+        for predicate in rng.sample(WP_PREDICATES, k=8):
+            hrefs = [f"https://en.wikipedia.org/wiki/Object_{rng.randrange(1000)}" \
+                for _ in range(rng.randint(0, 3))]
+            infobox[predicate] = {"text": " ".join(f"[[{x.split('/')[-1]}]]" for x in hrefs) \
+                or "no link", "href": hrefs}
+        res[f"Event {i}"] = infobox
+    return res
+
+
+def wikipedia_pages(n_pages: int, seed: int = 0) -> list[tuple[str, str]]:
+    """ (title, content) of pages, recorded content with varying length """
+    rng = random.Random(seed)
+    content = load_fixture("wikipedia_page_Coup_of_18_Brumaire.json")["content"]
+    summary, rest = content.split("\n\n== ", 1)
+    return [(f"Event {i}", "\n".join([summary] * rng.randint(1, 4)) + "\n\n== " + rest) \
+        for i in range(n_pages)]
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 """ Converting triples/key-values to sem-friendly format """
+import logging
 from rdflib.namespace import RDF, RDFS
 from rdflib import URIRef, Namespace, Literal, Graph, XSD
 
+from settings.settings import PROFILE_CONVERTERS
+from graph_building.profiling import ConverterProfiler
+from kb_sparql.event_table import EventTable
+
+LOGGER = logging.getLogger(__name__)
+
 
 class Converter:
     """ Base class for converter"""
@@ -45,6 +52,15 @@ class Converter:
             list(graph.objects(o1, URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#value'))) \
             for o1 in list(graph.objects(sub_1, pred_1)))
 
+    @staticmethod
+    def _iter_events(df_info):
+        """ (event, event label, rows of the event), rows are grouped by event once
+        instead of filtering df_info for each event """
+        helper_df = df_info[["wd_page", "eventLabel"]].drop_duplicates()
+        rows = df_info.groupby("wd_page", sort=False).indices
+        for event, event_label in zip(helper_df.wd_page.values, helper_df.eventLabel.values):
+            yield event, event_label, df_info.iloc[rows.get(event, [])]
+
     def __call__(self, graph, df_info):
         return graph
 
@@ -90,6 +106,12 @@ class WikidataConverter(Converter):
             'founded by': self.ns_wd.P112,
         }
 
+        self.qualifier_to_ts = {
+            'start': self.ns_sem.hasBeginTimeStamp,
+            'end': self.ns_sem.hasEndTimeStamp,
+            'pointintime': self.ns_sem.hasTimeStamp,
+        }
+
         self.temp_link_to_wd = {
             'follows': self.ns_wd.P155,
             'followed by': self.ns_wd.P156,
@@ -101,6 +123,15 @@ class WikidataConverter(Converter):
     def _get_variables(row):
         return URIRef(row.wd_page), URIRef(row.object), row.objectLabel, row.predicate
 
+    @staticmethod
+    def _get_qualifier(row, name):
+        """ Time qualifier of the statement (cf. `forward_links_qualified` query),
+        None if missing. Values are datetimes (typed decoding) or strings """
+        value = row.get(name)
+        if value is None or value != value or value == "":  # NaN/NaT
+            return None
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ") if hasattr(value, "strftime") else str(value)
+
     def _add_instance_of(self, graph, row, counter):
         sub, obj, obj_l, _ = self._get_variables(row)
         graph.add((sub, self.ns_sem.eventType, obj))
@@ -163,6 +194,11 @@ class WikidataConverter(Converter):
             graph.add((blank_n, self.ns_sem.roleType, self.part_to_wd[pred]))
             graph.add((self.part_to_wd[pred], RDF.type, self.ns_sem.RoleType))
             graph = self._add_label(graph=graph, uri=self.part_to_wd[pred], label=pred)
+            # Time of the participation, e.g. start/end of a participant statement
+            for qualifier, pred_ts in self.qualifier_to_ts.items():
+                value = self._get_qualifier(row, qualifier)
+                if value:
+                    graph.add((blank_n, pred_ts, Literal(value, datatype=XSD.date)))
 
         return graph, counter
 
@@ -174,11 +210,8 @@ class WikidataConverter(Converter):
         return graph
 
     def __call__(self, graph, df_info, counter=0):
-        helper_df = df_info[["wd_page", "eventLabel"]].drop_duplicates()
-        events, event_labels = helper_df.wd_page.values, helper_df.eventLabel.values
-        for index, event in enumerate(events):
-            graph = self._add_event(graph, event, event_labels[index])
-            curr_df = df_info[df_info.wd_page == event]
+        for event, event_label, curr_df in self._iter_events(df_info):
+            graph = self._add_event(graph, event, event_label)
 
             for _, row in curr_df.iterrows():
                 if row.predicate in self.func:
@@ -257,6 +290,7 @@ class WikipediaConverter(Converter):
 
     @staticmethod
     def _get_variables(row):
+        # Wikidata IDs of objects were already searched in the title index (cf. `add_wd_id`)
         return URIRef(row.wd_page), URIRef(row.obj_wd), row.objectLabel, row.predicate
 
     def _add_temporal_link(self, graph, row, counter, pred_opt=None):
@@ -375,12 +409,9 @@ class WikipediaConverter(Converter):
         return graph, counter
 
     def __call__(self, graph, df_info, counter=0):
-        helper_df = df_info[["wd_page", "eventLabel"]].drop_duplicates()
-        events, event_labels = helper_df.wd_page.values, helper_df.eventLabel.values
-        for index, event in enumerate(events):
-            print(event)
-            graph = self._add_event(graph, event, event_labels[index])
-            curr_df = df_info[df_info.wd_page == event]
+        for event, event_label, curr_df in self._iter_events(df_info):
+            LOGGER.debug("Converting %s", event)
+            graph = self._add_event(graph, event, event_label)
 
             for _, row in curr_df.iterrows():
                 if not row.predicate.startswith("house"):
@@ -420,6 +451,27 @@ def init_graph():
     graph.bind("ex", Namespace("http://example.org/"))
     return graph
 
+def build_narrative_graph(df_wp, df_wd, profiler=None):
+    """ Graph from Wikipedia infobox data (first) and Wikidata triples
+    (DataFrame or EventTable). If profiler (cf. profiling.py), or if PROFILE_CONVERTERS, the handlers are profiled """
+    log_profile = profiler is None and PROFILE_CONVERTERS
+    if log_profile:
+        profiler = ConverterProfiler()
+    if isinstance(df_wd, EventTable):
+        df_wd = df_wd.links_frame()
+    graph = init_graph()
+    converter_wp = WikipediaConverter()
+    converter_wd = WikidataConverter()
+    if profiler is not None:
+        profiler.attach(converter_wp)
+        profiler.attach(converter_wd)
+
+    graph, counter = converter_wp(graph, df_wp)
+    graph, counter = converter_wd(graph, df_wd, counter)
+    if log_profile:
+        LOGGER.info("Converter handlers:\n%s", profiler.report().to_string())
+    return graph, counter
+
 def build_graph_by_type(df_pd, save_folder, converter, c_type):
     """ Filtering graph on type of link (causal etc) (given a converter) """
     for type_link in df_pd.type.unique():
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling the graph building on saved inputs: csv files downloaded from the app
+(`collected-wikipedia-data-for-triples`, `collected-wikidata`) or Parquet files of the
+headless pipeline (`wikipedia_for_graph`, `wikidata_for_graph`).
+
+Modes:
+- `handlers`: calls, time and triples per converter handler + graph size over time (csv)
+- `cprofile`: cProfile stats (.prof, e.g. `flameprof <output>.prof > <output>.svg`)
+- `sampling`: sampled stacks in collapsed format (.folded, e.g. `flamegraph.pl` or speedscope)
+
+From the root of the repository:
+python -m graph_building.profile_converters -wp df_wp.csv -wd df_wd.csv -m sampling -o out/graph
+"""
+import os
+import pstats
+import cProfile
+import argparse
+
+import pandas as pd
+
+from graph_building.converter import build_narrative_graph
+from graph_building.profiling import ConverterProfiler, SamplingProfiler
+
+MODES = ["handlers", "cprofile", "sampling"]
+
+
+def read_input(path: str) -> pd.core.frame.DataFrame:
+    """ Converter input from a csv or Parquet file """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".csv"):
+        # Wikidata IDs such as `Q` (not found) should stay strings
+        return pd.read_csv(path, keep_default_na=False)
+    raise ValueError("Input files should be .csv or .parquet files")
+
+
+def profile(df_wp: pd.core.frame.DataFrame, df_wd: pd.core.frame.DataFrame,
+            mode: str, output: str, interval_ms: float = 5, top: int = 25):
+    """ Building the graph under the profiler of `mode`, results in files starting with output """
+    if mode not in MODES:
+        raise ValueError(f"`mode` should be one of {MODES}")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    if mode == "handlers":
+        profiler = ConverterProfiler()
+        graph, _ = build_narrative_graph(df_wp=df_wp, df_wd=df_wd, profiler=profiler)
+        profiler.report().to_csv(f"{output}_handlers.csv", index=False)
+        profiler.graph_size_df().to_csv(f"{output}_graph_size.csv", index=False)
+        print(profiler.report().head(top).to_string())
+
+    elif mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        graph, _ = build_narrative_graph(df_wp=df_wp, df_wd=df_wd)
+        profiler.disable()
+        profiler.dump_stats(f"{output}.prof")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+
+    else:
+        with SamplingProfiler(interval=interval_ms / 1000) as profiler:
+            graph, _ = build_narrative_graph(df_wp=df_wp, df_wd=df_wd)
+        profiler.write_collapsed(f"{output}.folded")
+        print(f"{sum(profiler.stacks.values())} samples, {len(profiler.stacks)} distinct stacks")
+
+    print(f"Graph: {len(graph)} triples, profile in {output}*")
+    return graph
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-wp", "--wikipedia", required=True,
+                    help="csv/parquet input of the Wikipedia converter (infobox links)")
+    ap.add_argument("-wd", "--wikidata", required=True,
+                    help="csv/parquet input of the Wikidata converter (outgoing links)")
+    ap.add_argument("-m", "--mode", default="handlers", help=f"profiling mode, among {MODES}")
+    ap.add_argument("-o", "--output", required=True,
+                    help="prefix of the output files, e.g. `profiles/graph`")
+    ap.add_argument("-i", "--interval_ms", default=5, type=float,
+                    help="interval between two samples for the `sampling` mode, in ms")
+    ap.add_argument("-n", "--top", default=25, type=int,
+                    help="number of handlers/functions printed")
+    ARGS = vars(ap.parse_args())
+
+    profile(df_wp=read_input(ARGS["wikipedia"]), df_wd=read_input(ARGS["wikidata"]),
+            mode=ARGS["mode"], output=ARGS["output"], interval_ms=ARGS["interval_ms"],
+            top=ARGS["top"])
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling the converters (cf. converter.py)
+
+- `ConverterProfiler`: per-handler call counts, cumulative/own time and triples added,
+graph size after each event. Handlers of a converter instance are wrapped by `attach`,
+converters that are not attached are not affected.
+- `SamplingProfiler`: samples the stack of a thread at a fixed interval, output in the
+collapsed stack format of flamegraph.pl/speedscope.
+
+Opt-in with NARRATIVE_PROFILE_CONVERTERS=1 for `build_narrative_graph`,
+or with the command line in profile_converters.py.
+"""
+import os
+import sys
+import time
+import threading
+from functools import wraps
+from collections import Counter, defaultdict
+
+import pandas as pd
+from rdflib import Graph
+
+# Converter methods profiled by `ConverterProfiler`
+HANDLER_PREFIXES = ("_add_", "_search_nested_pred", "_get_variables")
+
+
+class ConverterProfiler:
+    """ Calls, time and triples of each handler. Time and triples of a handler include
+    the ones of the handlers it calls (cumulative), `own_s` excludes them """
+
+    def __init__(self):
+        self.stats = defaultdict(lambda: {"calls": 0, "cum_s": 0.0, "own_s": 0.0, "triples": 0})
+        # (seconds since start, converter, nb of events so far, nb of triples)
+        self.graph_size = list()
+        self.nb_events = Counter()
+        self.start = time.perf_counter()
+        self._children = list()  # time spent in nested handlers, one per open call
+
+    def attach(self, converter):
+        """ Wrapping the handlers of converter (instance attributes + `func` mapping) """
+        name = type(converter).__name__
+        wrapped = dict()
+        for attr in dir(converter):
+            if attr.startswith(HANDLER_PREFIXES) and callable(getattr(converter, attr)):
+                wrapped[attr] = self._wrap(name, attr, getattr(converter, attr))
+                setattr(converter, attr, wrapped[attr])
+        converter.func = {k: wrapped.get(v.__name__, v) for k, v in converter.func.items()}
+        return converter
+
+    def _wrap(self, converter_name: str, handler: str, func):
+        name = f"{converter_name}.{handler}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            graph = kwargs.get("graph", args[0] if args else None)
+            graph = graph if isinstance(graph, Graph) else None
+            size = len(graph) if graph is not None else None
+            self._children.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self._children.pop()
+                if self._children:
+                    self._children[-1] += elapsed
+                stats = self.stats[name]
+                stats["calls"] += 1
+                stats["cum_s"] += elapsed
+                stats["own_s"] += elapsed - children
+                if graph is not None:
+                    stats["triples"] += len(graph) - size
+                if handler == "_add_event":
+                    self.nb_events[converter_name] += 1
+                    self.graph_size.append((time.perf_counter() - self.start, converter_name,
+                                            self.nb_events[converter_name], len(graph)))
+        return wrapper
+
+    def report(self) -> pd.core.frame.DataFrame:
+        """ One row per handler, sorted by cumulative time """
+        if not self.stats:
+            return pd.DataFrame(columns=["handler", "calls", "cum_s", "own_s", "triples"])
+        return pd.DataFrame([dict(handler=name, **stats) for name, stats in self.stats.items()]) \
+            .sort_values(by="cum_s", ascending=False).reset_index(drop=True)
+
+    def graph_size_df(self) -> pd.core.frame.DataFrame:
+        """ Size of the graph after each event """
+        return pd.DataFrame(self.graph_size,
+                            columns=["seconds", "converter", "nb_events", "nb_triples"])
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """ Stack of thread_id (default: the thread creating the profiler) every `interval` s,
+    while in the `with` block. Samples are aggregated by stack """
+
+    def __init__(self, interval: float = 0.005, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = list()
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def write_collapsed(self, path: str):
+        """ One `frame;frame;... count` line per stack (flamegraph.pl, speedscope) """
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, nb in self.stacks.most_common():
+                file.write(f"{stack} {nb}\n")
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+""" Timeline data (streamlit-timeline format) from the narrative graph """
+from datetime import datetime
+
+import pandas as pd
+from prettytable import PrettyTable
+
+from kb_sparql.local_kg_query import QUERY_EVENT, QUERY_POINT_IN_TIME, \
+    QUERY_EVENT_TYPE, QUERY_ACTOR_ROLE
+
+
+def run_sparql_query(graph, query):
+    """ Querying with sparql """
+    return list(graph.query(query))
+
+
+def pd_to_html(df_pd):
+    """ dataframe to html table """
+
+    cols = list(df_pd.columns)[2:]
+    t_html = PrettyTable(cols)
+    for _, row in df_pd.iterrows():
+        t_html.add_row([row[col] for col in cols])
+    return t_html.get_html_string()
+
+
+def get_events(graph) -> list[tuple]:
+    """ Events with begin&end timestamps, then events with points in time (start=end date),
+    sorted by start date """
+    events, event_uris = [], set()
+    for row in run_sparql_query(graph=graph, query=QUERY_EVENT):
+        if row.event not in event_uris:
+            events.append((row.event, str(row.l), row.tbegin, row.tend))
+            event_uris.add(row.event)
+
+    for row in run_sparql_query(graph=graph, query=QUERY_POINT_IN_TIME):
+        if row.event not in event_uris:
+            events.append((row.event, str(row.l), row.pointintime, None))
+            event_uris.add(row.event)
+
+    events.sort(key = lambda x: x[2])
+    return events
+
+
+def get_event_types(graph) -> pd.core.frame.DataFrame:
+    """ Info about event types """
+    res = run_sparql_query(graph=graph, query=QUERY_EVENT_TYPE)
+    return pd.DataFrame([(row.s, str(row.l), row.etl) for row in res],
+                        columns=["event", "label", "event_type"]).drop_duplicates()
+
+
+def get_actors(graph) -> pd.core.frame.DataFrame:
+    """ Info about actors and roles """
+    res = run_sparql_query(graph=graph, query=QUERY_ACTOR_ROLE)
+    return pd.DataFrame([(row.s, str(row.l), row.valreadable, row.rolereadable) for row in res],
+                        columns=["event", "label", "actor", "role"]).drop_duplicates()
+
+
+def get_timeline_data(events, text_info, info_event_type, info_actor):
+    """ Timeline data in order """
+    data = {
+        "title": {
+            "text": {"headline": "French Revolution Timeline"}
+        },
+        "events": []
+    }
+    for _, label, start, end in events:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        curr_info = {
+            "text": {"headline": label},
+            "start_date": {"year": start_date.year,
+                           "month": start_date.month, "day": start_date.day}
+        }
+        if end:
+            end_date = datetime.strptime(end, "%Y-%m-%d")
+            curr_info["end_date"] = {
+                "year": end_date.year,
+                "month": end_date.month, "day": end_date.day
+            }
+
+        text = []
+        if label in text_info:
+            text.append(f"<p>{text_info[label]}</p>")
+
+        event_type = info_event_type[info_event_type.label == label]
+        if event_type.shape[0] > 0:
+            text.append(pd_to_html(event_type))
+
+        actors = info_actor[info_actor.label == label]
+        if actors.shape[0] > 0:
+            text.append(pd_to_html(actors))
+
+        curr_info["text"]["text"] = "\n".join(text)
+        data["events"].append(curr_info)
+    return data
+
+
+def build_timeline(graph, text_info: dict[str, str]) -> dict:
+    """ Timeline data from the graph, text_info = summary of each event """
+    return get_timeline_data(events=get_events(graph), text_info=text_info,
+                             info_event_type=get_event_types(graph),
+                             info_actor=get_actors(graph))
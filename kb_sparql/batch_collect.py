@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Collecting events for several topics and languages in one run, from a yaml manifest
+(cf. batch_manifest.yaml):
+
+languages: [en, fr]           # languages of all topics
+topics:
+  french_revolution:
+    id: Q6534                 # root Wikidata ID
+    year_begin: '1789'
+    year_end: '1799'
+    languages: [en]           # optional, replaces the default languages
+    queries:                  # keys of SPARQL_QUERIES, run from `id` ...
+      - obj-part-of-id
+      - {id: Q142, query_type: obj-instance-of-historical-country-and-has-country-id}  # ... or not
+
+All topics share one HTTP session and one persistent query cache (KVStore `sparql_queries`).
+Identical queries are run once, and with `expand` the outgoing links of events found
+by several topics are retrieved once. Outputs are written concurrently, one folder per
+topic and language: <output>/<topic>/<lang>/events.csv (+ forward_links.csv)
+
+From the root of the repository:
+python -m kb_sparql.batch_collect -m kb_sparql/batch_manifest.yaml -o data/batch -e
+(with `-d <index>`, queries are answered from a dump index, cf. dump_backend.py)
+"""
+import os
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+import requests
+import pandas as pd
+from requests.adapters import HTTPAdapter
+
+from kb_sparql.query_db import SPARQL_QUERIES
+from kb_sparql.sparql_results import get_col_to_keep, from_json
+from kb_sparql.dump_backend import DumpIndex
+from kb_sparql.labels import fill_labels
+from kb_sparql.gather_events import build_args_for_collect, clean_forward_links, \
+    FORWARD_LINKS_QUERY, FORWARD_LINKS_COLUMNS
+from narrative.kv_store import KVStore
+from narrative.instrumentation import span, count
+from settings.settings import AGENT, WIKIDATA_SPARQL_ENDPOINT
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SparqlClient:
+    """ SPARQL queries over one HTTP session (connection pool shared by threads),
+    results are stored in a persistent cache shared by all runs """
+
+    def __init__(self, endpoint: str = WIKIDATA_SPARQL_ENDPOINT, store: KVStore = None,
+                 pool_size: int = 8, refresh: bool = False):
+        self.endpoint = endpoint
+        self.store = store if store is not None else KVStore(name="sparql_queries")
+        self.refresh = refresh
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": AGENT,
+                                     "Accept": "application/sparql-results+json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _key(self, query: str) -> str:
+        return hashlib.sha256(f"{self.endpoint}\n{query}".encode()).hexdigest()
+
+    def bindings(self, query: str) -> list[dict]:
+        """ Bindings of the json results of query, from the cache unless `refresh` """
+        key = self._key(query)
+        if not self.refresh:
+            cached = self.store.get(key)
+            if cached is not None:
+                return cached
+        with span("request", service="sparql"):
+            count("requests", service="sparql")
+            try:
+                response = self.session.get(self.endpoint, params={"query": query, "format": "json"})
+                response.raise_for_status()
+            except Exception:
+                count("errors", service="sparql")
+                raise
+        count("bytes", len(response.content), service="sparql")
+        res = response.json()["results"]["bindings"]
+        self.store.set(key, res)
+        return res
+
+    def run_query_clean_df(self, query: str) -> pd.core.frame.DataFrame:
+        """ Same output as `sparql_query.run_query_clean_df` (typed columns) """
+        return fill_labels(from_json({"results": {"bindings": self.bindings(query)}},
+                                     get_col_to_keep(query)), query)
+
+
+def check_manifest(manifest: dict):
+    """ Checking topics and query types of the manifest """
+    if not manifest.get("topics"):
+        raise ValueError("The manifest should have at least one topic in `topics`")
+    for name, topic in manifest["topics"].items():
+        for key in ["id", "year_begin", "year_end", "queries"]:
+            if key not in topic:
+                raise ValueError(f"Topic `{name}` has no `{key}`")
+        if not (topic.get("languages") or manifest.get("languages")):
+            raise ValueError(f"No `languages` for topic `{name}` (nor for all topics)")
+        for query in topic["queries"]:
+            query_type = query["query_type"] if isinstance(query, dict) else query
+            if query_type not in SPARQL_QUERIES:
+                raise ValueError(f"Unknown query type `{query_type}` in topic `{name}`, " + \
+                    f"query types are: {list(SPARQL_QUERIES)}")
+
+
+def load_manifest(path: str) -> dict:
+    """ Checked manifest from a yaml file """
+    with open(path, encoding="utf-8") as file:
+        manifest = yaml.load(file, Loader=yaml.FullLoader)
+    check_manifest(manifest)
+    return manifest
+
+
+class BatchCollector:
+    """ Events (and outgoing links if `expand`) of each topic and language of the manifest """
+
+    def __init__(self, manifest: dict, client: SparqlClient = None, max_workers: int = 4,
+                 expand: bool = False, col_wikidata: str = "event"):
+        check_manifest(manifest)
+        self.manifest = manifest
+        self.client = client if client is not None else SparqlClient(pool_size=max_workers)
+        self.max_workers = max_workers
+        self.expand = expand
+        self.col_wikidata = col_wikidata
+
+    def plan(self) -> dict[tuple[str, str], list[tuple[str, str]]]:
+        """ (topic, lang) -> list of (query_type, query) """
+        res = dict()
+        for name, topic in self.manifest["topics"].items():
+            id_query_type_l = [
+                (query["id"], query["query_type"]) if isinstance(query, dict) \
+                    else (topic["id"], query) for query in topic["queries"]]
+            id_query_type_l = [(curr_id, query_type, str(topic["year_begin"]),
+                                str(topic["year_end"])) for curr_id, query_type in id_query_type_l]
+            for lang in topic.get("languages") or self.manifest["languages"]:
+                res[(name, lang)] = [
+                    (arg["query_type"], SPARQL_QUERIES[arg["query_type"]](arg["id"], lang=lang)) \
+                        for arg in build_args_for_collect(id_query_type_l, lang=lang)]
+        return res
+
+    def _map(self, func, items: list) -> dict:
+        """ func on each (distinct) item, concurrently """
+        items = list(dict.fromkeys(items))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(items, executor.map(func, items)))
+
+    def _collect(self, query: str) -> pd.core.frame.DataFrame:
+        return self.client.run_query_clean_df(query)
+
+    def _forward_links(self, id_lang: tuple[str, str]) -> pd.core.frame.DataFrame:
+        id_event, lang = id_lang
+        query = SPARQL_QUERIES[FORWARD_LINKS_QUERY](id_event, lang=lang)
+        return clean_forward_links(self.client.run_query_clean_df(query), id_event) \
+            [FORWARD_LINKS_COLUMNS]
+
+    def collect(self) -> dict[tuple[str, str], dict[str, pd.core.frame.DataFrame]]:
+        """ (topic, lang) -> {"events": DataFrame, ("forward_links": DataFrame)} """
+        plan = self.plan()
+        queries = [query for todo in plan.values() for _, query in todo]
+        results = self._map(self._collect, queries)
+        LOGGER.info("%s queries planned, %s distinct", len(queries), len(results))
+
+        res = dict()
+        for (name, lang), todo in plan.items():
+            dfs = [results[query].assign(query_type=query_type, lang=lang) \
+                for query_type, query in todo if results[query].shape[0] > 0]
+            events = pd.concat(dfs).drop_duplicates() if dfs else \
+                pd.DataFrame(columns=[self.col_wikidata, "query_type", "lang"])
+            res[(name, lang)] = {"events": events}
+
+        if self.expand:
+            ids = {key: [event.split("/")[-1] for event in output["events"][self.col_wikidata] \
+                .unique()] for key, output in res.items()}
+            to_fetch = [(id_event, lang) for (_, lang), id_events in ids.items() \
+                for id_event in id_events]
+            links = self._map(self._forward_links, to_fetch)
+            LOGGER.info("Outgoing links of %s events, %s distinct", len(to_fetch), len(links))
+            for (name, lang), id_events in ids.items():
+                res[(name, lang)]["forward_links"] = pd.concat(
+                    [links[(id_event, lang)] for id_event in id_events]) if id_events else \
+                    pd.DataFrame(columns=FORWARD_LINKS_COLUMNS)
+        return res
+
+    def run(self, output: str) -> dict[str, dict[str, dict[str, int]]]:
+        """ Collecting and writing the csv files of each topic/language in output.
+        Returns the number of rows of each file """
+        res = self.collect()
+
+        def write(item):
+            (name, lang), dfs = item
+            folder = os.path.join(output, name, lang)
+            os.makedirs(folder, exist_ok=True)
+            for file_name, df_output in dfs.items():
+                df_output.to_csv(os.path.join(folder, f"{file_name}.csv"), index=False)
+            return name, lang, {file_name: df_output.shape[0] for file_name, df_output in dfs.items()}
+
+        summary = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for name, lang, nb_rows in executor.map(write, res.items()):
+                summary.setdefault(name, dict())[lang] = nb_rows
+        with open(os.path.join(output, "summary.json"), "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=4)
+        return summary
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-m", "--manifest", required=True,
+                    help="yaml file with the topics and languages to collect")
+    ap.add_argument("-o", "--output", required=True,
+                    help="output folder, one sub-folder per topic and language")
+    ap.add_argument("-e", "--expand", action="store_true",
+                    help="also retrieve the outgoing links of the events")
+    ap.add_argument("-w", "--workers", default=4, type=int,
+                    help="number of concurrent queries (and file writes)")
+    ap.add_argument("-r", "--refresh", action="store_true",
+                    help="run queries even if their results are in the cache")
+    ap.add_argument("-d", "--dump_index", default=None,
+                    help="if given, SQLite index of a dump to query instead of the endpoint")
+    ARGS = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    SUMMARY = BatchCollector(
+        manifest=load_manifest(ARGS["manifest"]), expand=ARGS["expand"],
+        client=DumpIndex(ARGS["dump_index"]) if ARGS["dump_index"] else \
+            SparqlClient(pool_size=ARGS["workers"], refresh=ARGS["refresh"]),
+        max_workers=ARGS["workers"]).run(output=ARGS["output"])
+    LOGGER.info("Rows written: %s", SUMMARY)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-hop expansion of Wikidata nodes (breadth-first)
+
+From seed IDs, the outgoing links of each frontier are retrieved with batched
+`forward_links_qualified` queries (one `VALUES` block per batch). Objects reached by an
+allowed predicate of the hop become the next frontier, unless already visited.
+- hops: one list of allowed predicates per hop, groups of PRED_GROUPING_WD (`who`, `where`...),
+English labels of their predicates or property IDs (`P...`). Links are matched on the
+property of the statement (`property` column), whatever the language of the labels (`lang`)
+- max_nodes: budget of visited nodes (seeds included)
+
+The crawl state (visited nodes, frontier, position in the frontier) is saved in
+<folder>/state.json after each batch, and the links of each batch in <folder>/links.
+A crawl with the same parameters resumes from the last saved batch.
+
+From the root of the repository, e.g. actors and places of the collected events,
+then places of the actors:
+python -m kb_sparql.crawler -f data/crawl -i data/events.csv -H who,where -H where
+"""
+import os
+import json
+import hashlib
+import logging
+import argparse
+
+import pandas as pd
+
+from kb_sparql.query_db import SPARQL_QUERIES
+from kb_sparql.predicates import PRED_GROUPING_WD, resolve_predicates
+from kb_sparql.sparql_query import run_query_clean_df, run_query_paginated
+from kb_sparql.gather_events import FORWARD_LINKS_QUERY, FORWARD_LINKS_RENAMING, \
+    FORWARD_LINKS_COLUMNS
+from narrative.instrumentation import span, count
+
+LOGGER = logging.getLogger(__name__)
+
+WD_ENTITY = "http://www.wikidata.org/entity/"
+
+
+class Crawler:
+    """ Breadth-first crawl of the outgoing links of seeds, state saved in folder """
+
+    def __init__(self, folder: str, seeds: list[str], hops: list[list[str]],
+                 max_nodes: int = 1000, batch_size: int = 50, lang: str = "en",
+                 page_size: int = None):
+        if not seeds:
+            raise ValueError("At least one seed should be given")
+        if not hops:
+            raise ValueError("At least one hop should be given")
+        self.folder = folder
+        self.seeds = list(dict.fromkeys(seed.split("/")[-1] for seed in seeds))
+        self.hops = [list(hop) for hop in hops]
+        self.allowed = [resolve_predicates(hop) for hop in self.hops]
+        self.max_nodes = max_nodes
+        self.batch_size = batch_size
+        self.lang = lang
+        self.page_size = page_size
+        self.state_path = os.path.join(folder, "state.json")
+        os.makedirs(os.path.join(folder, "links"), exist_ok=True)
+        self.state = self._load_state()
+
+    @property
+    def params_hash(self) -> str:
+        """ Parameters a saved crawl should have to be resumed """
+        return hashlib.sha256(json.dumps(
+            [self.seeds, self.hops, self.max_nodes, self.lang]).encode()).hexdigest()
+
+    def _load_state(self) -> dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as file:
+                state = json.load(file)
+            if state["params"] == self.params_hash:
+                LOGGER.info("Resuming crawl at hop %s, %s/%s nodes of the frontier done",
+                            state["depth"], state["position"], len(state["frontier"]))
+                return state
+            LOGGER.info("Parameters changed, previous crawl in %s is discarded", self.folder)
+            for name in state["batches"]:
+                if os.path.exists(os.path.join(self.folder, "links", name)):
+                    os.remove(os.path.join(self.folder, "links", name))
+        return {"params": self.params_hash, "depth": 0, "frontier": self.seeds[:self.max_nodes],
+                "position": 0, "next_frontier": list(), "visited": self.seeds[:self.max_nodes],
+                "batches": list(), "done": False}
+
+    def _save_state(self):
+        with open(f"{self.state_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.state, file)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def fetch(self, ids: list[str]) -> pd.core.frame.DataFrame:
+        """ Outgoing links of ids (one query), same columns as `get_outgoing_nodes`
+        and the property ID of each link (`property`) """
+        query = SPARQL_QUERIES[FORWARD_LINKS_QUERY].render_batch(ids, lang=self.lang)
+        with span("request", service="crawler"):
+            df_output = run_query_paginated(query, page_size=self.page_size) \
+                if self.page_size else run_query_clean_df(query)
+        properties = df_output.reindex(columns=["wd"])["wd"].astype(object) \
+            .str.replace(f"^{WD_ENTITY}", "", regex=True)
+        df_output = df_output.rename(columns={"object": "wd_page"}) \
+            .reindex(columns=["wd_page"] + list(FORWARD_LINKS_RENAMING)) \
+            .rename(columns=FORWARD_LINKS_RENAMING)
+        return df_output[FORWARD_LINKS_COLUMNS].assign(property=properties.values)
+
+    def _expand(self, df_links: pd.core.frame.DataFrame, depth: int):
+        """ Adding unvisited objects of allowed predicates to the next frontier """
+        visited = set(self.state["visited"])
+        objects = df_links[df_links.property.isin(self.allowed[depth])].object.dropna().astype(str)
+        for obj in objects[objects.str.startswith(WD_ENTITY)].unique():
+            obj = obj.split("/")[-1]
+            if len(self.state["visited"]) >= self.max_nodes:
+                break
+            if obj not in visited:
+                visited.add(obj)
+                self.state["visited"].append(obj)
+                self.state["next_frontier"].append(obj)
+
+    def run(self) -> pd.core.frame.DataFrame:
+        """ Crawling until all hops are done (or the budget is reached), returns all links """
+        state = self.state
+        while not state["done"]:
+            depth, frontier = state["depth"], state["frontier"]
+            for position in range(state["position"], len(frontier), self.batch_size):
+                ids = frontier[position:position+self.batch_size]
+                df_links = self.fetch(ids).assign(depth=depth)
+                count("crawled_nodes", len(ids), service="crawler")
+                name = f"hop_{depth}_{position:07d}.parquet"
+                df_links.to_parquet(os.path.join(self.folder, "links", name), index=False)
+                self._expand(df_links, depth)
+                state["batches"].append(name)
+                state["position"] = position + self.batch_size
+                self._save_state()
+            LOGGER.info("Hop %s: %s nodes crawled, %s new nodes, %s visited in total",
+                        depth, len(frontier), len(state["next_frontier"]), len(state["visited"]))
+
+            state.update({"depth": depth + 1, "frontier": state["next_frontier"],
+                          "next_frontier": list(), "position": 0})
+            state["done"] = state["depth"] >= len(self.hops) or not state["frontier"]
+            self._save_state()
+        return self.links()
+
+    def links(self) -> pd.core.frame.DataFrame:
+        """ Links retrieved so far, with the hop (`depth`) of their subject """
+        if not self.state["batches"]:
+            return pd.DataFrame(columns=FORWARD_LINKS_COLUMNS + ["property", "depth"])
+        return pd.concat([pd.read_parquet(os.path.join(self.folder, "links", name)) \
+            for name in self.state["batches"]], ignore_index=True)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--folder", required=True,
+                    help="folder of the crawl state and links (a crawl is resumed from it)")
+    ap.add_argument("-s", "--seeds", nargs="*", default=None,
+                    help="seed Wikidata IDs (or urls)")
+    ap.add_argument("-i", "--input", default=None,
+                    help="csv with seed IDs/urls, e.g. events collected by gather_events.py")
+    ap.add_argument("-c", "--column", default="event",
+                    help="column of the seeds in `input`")
+    ap.add_argument("-H", "--hop", action="append", default=None,
+                    help="allowed predicates of one hop, comma separated (can be repeated). " + \
+                        f"Groups: {list(PRED_GROUPING_WD)}, labels of their predicates " + \
+                        "or property IDs (e.g. P710)")
+    ap.add_argument("-n", "--max_nodes", default=1000, type=int,
+                    help="maximum number of visited nodes")
+    ap.add_argument("-b", "--batch_size", default=50, type=int,
+                    help="number of nodes per query")
+    ap.add_argument("-l", "--lang", default="en", help="language of the labels")
+    ap.add_argument("-o", "--output", default=None,
+                    help="csv file for all the links (in `folder` by default)")
+    ARGS = vars(ap.parse_args())
+
+    if not (ARGS["seeds"] or ARGS["input"]):
+        raise ValueError("Seeds should be given with `seeds` or `input`")
+    SEEDS = ARGS["seeds"] or list()
+    if ARGS["input"]:
+        SEEDS += list(pd.read_csv(ARGS["input"])[ARGS["column"]].dropna().unique())
+    HOPS = [hop.split(",") for hop in ARGS["hop"]] if ARGS["hop"] else [list(PRED_GROUPING_WD)]
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    LINKS = Crawler(folder=ARGS["folder"], seeds=SEEDS, hops=HOPS, max_nodes=ARGS["max_nodes"],
+                    batch_size=ARGS["batch_size"], lang=ARGS["lang"]).run()
+    LINKS.to_csv(ARGS["output"] or os.path.join(ARGS["folder"], "links.csv"), index=False)
+    LOGGER.info("%s links saved", LINKS.shape[0])
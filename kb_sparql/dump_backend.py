@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Local alternative to the SPARQL endpoint: a Wikidata dump (or any subset of one)
+is streamed into a compact SQLite index, and the query types of SPARQL_QUERIES are
+answered from it with the same DataFrames as `sparql_query.run_query_clean_df`.
+
+Dumps are read line by line (plain, .gz or .bz2):
+- JSON dumps (`latest-all.json`): one entity per line
+- truthy N-Triples dumps (`latest-truthy.nt`): `wdt:` triples and labels, there are no
+statements (hence no ranks or qualifiers) in these dumps
+
+Only the entities around the seeds are kept:
+- each hop adds the entities linking to the kept ones with an `incoming` property
+(by default the properties of the query patterns, e.g. `?event wdt:P361 wd:$id`)
+and the objects of the kept ones
+- the labels (in `languages`) and dates of the entities referenced by the kept ones
+are added in a last pass
+Memory is bounded by the number of kept entities: each hop is one pass over the dump,
+and lines that do not mention a kept entity are not decoded.
+
+From the root of the repository:
+python -m kb_sparql.dump_backend -d latest-all.json.bz2 -o data/dump.sqlite -s Q6534 Q142
+Queries are then answered from the index when NARRATIVE_DUMP_INDEX is set to its path.
+"""
+import os
+import re
+import bz2
+import gzip
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+import itertools
+from functools import lru_cache
+
+import pandas as pd
+
+from kb_sparql.sparql_results import _keep_bound
+from kb_sparql.labels import fill_labels
+from narrative.instrumentation import span, count
+
+LOGGER = logging.getLogger(__name__)
+
+WD_ENTITY = "http://www.wikidata.org/entity/"
+WD_DIRECT = "http://www.wikidata.org/prop/direct/"
+LABEL_PREDICATES = {"http://www.w3.org/2000/01/rdf-schema#label", "http://schema.org/name"}
+
+# Properties of the `?x wdt:P wd:$id` patterns of SPARQL_QUERIES
+INCOMING_PROPERTIES = ["P361", "P17", "P1344"]
+# Properties kept for the referenced (not kept) entities
+DATE_PROPERTIES = ["P585", "P580", "P582", "P571", "P576"]
+QUALIFIERS = {"P580": "start", "P582": "end", "P585": "pointintime"}
+RANKS = {"deprecated": 0, "normal": 1, "preferred": 2}
+
+# Node patterns of SPARQL_QUERIES: node variable, property linking the node and `$id`
+# (`incoming`: ?node wdt:P wd:$id, `outgoing`: wd:$id wdt:P ?node) and date variables
+EVENT_DATES = {"pointintime": "P585", "start": "P580", "end": "P582",
+               "inception": "P571", "dissolved": "P576"}
+NODE_QUERIES = {
+    "obj-part-of-id": {"var": "event", "incoming": "P361", "dates": EVENT_DATES},
+    "obj-instance-of-historical-country-and-has-country-id": {
+        "var": "event", "incoming": "P17", "instance_of": "Q3024240",
+        "dates": {"inception": "P571", "end": "P576"}, "year_filter": ["inception", "end"]},
+    "id-has-significant-event-obj": {"var": "event", "outgoing": "P793", "dates": EVENT_DATES},
+    "p-participant-in-id": {"var": "p", "incoming": "P1344", "dates": dict()},
+}
+LINK_QUERIES = ["forward_links", "forward_links_qualified", "incoming_links"]
+DUMP_QUERIES = list(NODE_QUERIES) + LINK_QUERIES
+
+ID_IN_LINE = re.compile(r'"id":\s*"([QP]\d+)"')
+TRIPLE = re.compile(r'<([^>]*)>\s+<([^>]*)>\s+(?:<([^>]*)>|"((?:[^"\\]|\\.)*)"' + \
+                    r'(?:@([\w-]+)|\^\^<[^>]*>)?)\s*\.')
+ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+ESCAPED = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+TIME = re.compile(r"^\+?(-?\d+)-(\d\d)-(\d\d)")
+
+
+def open_dump(path: str):
+    """ Text stream of a (compressed) dump """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def get_format(path: str) -> str:
+    """ `nt` for N-Triples dumps, `json` otherwise """
+    return "nt" if re.search(r"\.nt(\.gz|\.bz2)?$", path) else "json"
+
+
+def format_time(value: str) -> str:
+    """ Wikidata time as in SPARQL results, e.g. +1789-00-00T00:00:00Z -> 1789-01-01T00:00:00Z """
+    return TIME.sub(lambda m: f"{m.group(1)}-{m.group(2).replace('00', '01')}-" + \
+        m.group(3).replace("00", "01"), value)
+
+
+def snak_value(snak: dict) -> tuple:
+    """ (value, is_item) of a snak, value is None for somevalue/novalue snaks """
+    if snak.get("snaktype") != "value":
+        return None, False
+    datavalue = snak["datavalue"]
+    value, value_type = datavalue["value"], datavalue["type"]
+    if value_type == "wikibase-entityid":
+        return value.get("id") or \
+            f"{value['entity-type'][0].upper()}{value['numeric-id']}", True
+    if value_type == "time":
+        return format_time(value["time"]), False
+    if value_type == "quantity":
+        return value["amount"].lstrip("+"), False
+    if value_type == "monolingualtext":
+        return value["text"], False
+    if value_type == "globecoordinate":
+        return f"Point({value['longitude']} {value['latitude']})", False
+    return str(value), False
+
+
+def entity_claims(entity: dict) -> list[tuple]:
+    """ (property, statement, rank, truthy, value, item, qualifiers, start, end, pointintime)
+    of the statements of a JSON entity """
+    res = list()
+    for prop, statements in entity.get("claims", dict()).items():
+        best = max([RANKS[statement["rank"]] for statement in statements] + [1])
+        for statement in statements:
+            value, item = snak_value(statement["mainsnak"])
+            if value is None:
+                continue
+            qualifiers = statement.get("qualifiers", dict())
+            times = {name: next((snak_value(snak)[0] for snak in qualifiers.get(qualifier, []) \
+                if snak.get("snaktype") == "value"), None) for qualifier, name in QUALIFIERS.items()}
+            rank = RANKS[statement["rank"]]
+            res.append((prop, statement["id"].replace("$", "-"), rank, int(rank == best > 0),
+                        value, int(item), sum(len(snaks) for snaks in qualifiers.values()),
+                        times["start"], times["end"], times["pointintime"]))
+    return res
+
+
+def unescape(literal: str) -> str:
+    """ Value of an N-Triples literal """
+    def replace(matches):
+        escaped = matches.group(1)
+        if escaped[0] in "uU" and len(escaped) > 1:
+            return chr(int(escaped[1:], 16))
+        return ESCAPED.get(escaped, escaped)
+    return ESCAPE.sub(replace, literal)
+
+
+def iter_records(path: str, fmt: str, interest: set = None):
+    """ (entity ID, {lang: label}, claims) records of the dump.
+    With interest, only the lines mentioning one of its IDs are decoded.
+    N-Triples dumps give one record per triple """
+    with open_dump(path) as file:
+        for line in file:
+            if fmt == "nt":
+                matches = TRIPLE.match(line)
+                if not matches or not matches.group(1).startswith(WD_ENTITY):
+                    continue
+                subject, predicate, obj, literal, lang = matches.groups()
+                subject = subject[len(WD_ENTITY):]
+                obj_id = obj[len(WD_ENTITY):] if obj and obj.startswith(WD_ENTITY) else None
+                if interest is not None and subject not in interest and obj_id not in interest:
+                    continue
+                if predicate in LABEL_PREDICATES and lang:
+                    yield subject, {lang: unescape(literal)}, list()
+                elif predicate.startswith(WD_DIRECT):
+                    value = obj_id or obj or unescape(literal)
+                    yield subject, dict(), [(predicate[len(WD_DIRECT):], None, 1, 1, value,
+                                             int(obj_id is not None), 0, None, None, None)]
+                continue
+
+            line = line.strip().rstrip(",")
+            if not line.startswith("{"):  # `[` and `]` of the dump
+                continue
+            if interest is not None and interest.isdisjoint(ID_IN_LINE.findall(line)):
+                continue
+            entity = json.loads(line)
+            yield entity["id"], {lang: label["value"] for lang, label \
+                in entity.get("labels", dict()).items()}, entity_claims(entity)
+
+
+class DumpIndex:
+    """ SQLite index of a dump, answering the query types of SPARQL_QUERIES
+    (`run_query_clean_df` has the same output as the one of sparql_query.py,
+    an index can be used as the client of batch_collect.py) """
+
+    chunk_size = 500
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise ValueError(f"No dump index at `{path}`, cf. `build_index`")
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _select(self, sql: str, ids: list, params: list = None) -> list[tuple]:
+        """ Rows of sql (with an `IN ({})` clause) for all ids, by chunks """
+        ids, res = list(ids), list()
+        with self._lock:
+            for i in range(0, len(ids), self.chunk_size):
+                chunk = ids[i:i+self.chunk_size]
+                res += self.conn.execute(sql.format(",".join("?"*len(chunk))),
+                                         chunk + (params or list())).fetchall()
+        return res
+
+    def labels(self, ids: list[str], lang: str = "en") -> dict[str, str]:
+        """ Label of each ID in the first language of lang (e.g. `fr,en`) that has one,
+        the ID itself otherwise (as the label service) """
+        langs = lang.split(",")
+        found = dict()
+        for curr_id, curr_lang, label in self._select(
+                "SELECT id, lang, label FROM labels WHERE id IN ({}) " + \
+                    f"AND lang IN ({','.join('?'*len(langs))})", set(ids), langs):
+            found.setdefault(curr_id, dict())[curr_lang] = label
+        return {curr_id: next((found.get(curr_id, dict())[curr_lang] for curr_lang in langs \
+            if curr_lang in found.get(curr_id, dict())), curr_id) for curr_id in ids}
+
+    def truthy(self, ids: list[str], properties: list[str]) -> dict[tuple[str, str], list[str]]:
+        """ (ID, property) -> truthy values (`wdt:`) """
+        res = dict()
+        for subject, prop, value in self._select(
+                "SELECT subject, property, value FROM claims WHERE subject IN ({}) " + \
+                    f"AND truthy = 1 AND property IN ({','.join('?'*len(properties))})",
+                ids, list(properties)):
+            res.setdefault((subject, prop), list()).append(value)
+        return res
+
+    def _nodes(self, spec: dict, ids: list[str]) -> list[tuple[str, str]]:
+        """ (node, ID) pairs of a pattern of NODE_QUERIES """
+        if "outgoing" in spec:
+            return self._select("SELECT value, subject FROM claims WHERE subject IN ({}) " + \
+                "AND property = ? AND truthy = 1 AND item = 1", ids, [spec["outgoing"]])
+        pairs = self._select("SELECT subject, value FROM claims WHERE value IN ({}) " + \
+            "AND property = ? AND truthy = 1 AND item = 1", ids, [spec["incoming"]])
+        if "instance_of" in spec:
+            types = self.truthy({node for node, _ in pairs}, ["P31"])
+            pairs = [(node, curr_id) for node, curr_id in pairs \
+                if spec["instance_of"] in types.get((node, "P31"), list())]
+        return pairs
+
+    @staticmethod
+    def _in_years(value: str, year_begin: int, year_end: int) -> bool:
+        """ year_begin-01-01 < value < year_end-12-31 (as the xsd:dateTime FILTER) """
+        matches = TIME.match(value or "")
+        if not matches:
+            return False
+        key = (int(matches.group(1)), value[matches.end(1):])
+        return (year_begin, "-01-01T00:00:00") < key < (year_end, "-12-31T00:00:00")
+
+    def _node_rows(self, name: str, ids: list[str], params: dict, batch_var: str) -> list[dict]:
+        spec = NODE_QUERIES[name]
+        pairs = sorted(set(self._nodes(spec, ids)))
+        dates = self.truthy({node for node, _ in pairs}, list(spec["dates"].values())) \
+            if spec["dates"] else dict()
+        labels = self.labels([node for node, _ in pairs], params.get("lang", "en"))
+        rows = list()
+        for node, curr_id in pairs:
+            values = [dates.get((node, prop)) or [None] for prop in spec["dates"].values()]
+            for combination in itertools.product(*values):
+                row = {spec["var"]: f"{WD_ENTITY}{node}", f"{spec['var']}Label": labels[node],
+                       **dict(zip(spec["dates"], combination))}
+                if spec.get("year_filter") and not any(self._in_years(
+                        row[var], int(params["year_begin"]), int(params["year_end"])) \
+                            for var in spec["year_filter"]):
+                    continue
+                if batch_var:
+                    row[batch_var] = f"{WD_ENTITY}{curr_id}"
+                rows.append(row)
+        return rows
+
+    def _link_rows(self, name: str, ids: list[str], params: dict, batch_var: str) -> list[dict]:
+        column = "value" if name == "incoming_links" else "subject"
+        claims = self._select(
+            "SELECT subject, property, statement, value, item, qualifiers, start, end, " + \
+                f"pointintime FROM claims WHERE {column} IN ({{}})" + \
+                (" AND item = 1" if column == "value" else ""), ids)
+        claims.sort(key=lambda claim: (claim[1], claim[2] or "", claim[3]))
+        labels = self.labels({claim[0] for claim in claims} | {claim[1] for claim in claims} | \
+            {claim[3] for claim in claims if claim[4]}, params.get("lang", "en"))
+        rows = list()
+        for subject, prop, _, value, item, qualifiers, start, end, pointintime in claims:
+            row = {"object": f"{WD_ENTITY}{subject}", "objectLabel": labels[subject],
+                   "wd": f"{WD_ENTITY}{prop}", "wdLabel": labels[prop],
+                   "ps_": f"{WD_ENTITY}{value}" if item else value,
+                   "ps_Label": labels[value] if item else value}
+            if name == "forward_links_qualified":
+                row.update({"start": start, "end": end, "pointintime": pointintime})
+            if batch_var:
+                row[batch_var] = f"{WD_ENTITY}{subject if column == 'subject' else value}"
+            # unprojected qualifier join of `forward_links`/`incoming_links`: one row per qualifier
+            rows += [row] * (max(qualifiers, 1) if name != "forward_links_qualified" else 1)
+        return rows
+
+    def run_query_clean_df(self, query) -> pd.core.frame.DataFrame:
+        """ Results of a query rendered from SPARQL_QUERIES (cf. query_template.py),
+        labels of queries rendered with `labels=False` are filled from the index """
+        if getattr(query, "name", None) not in DUMP_QUERIES:
+            raise ValueError("Only queries rendered from SPARQL_QUERIES can be run on a dump " + \
+                f"index, query types are: {DUMP_QUERIES}")
+        params = query.params
+        ids = params["_ids"] if "_ids" in params else [params["id"]]
+        batch_var = params.get("_batch_var")
+        with span("request", service="dump"):
+            count("requests", service="dump")
+            rows = self._node_rows(query.name, ids, params, batch_var) \
+                if query.name in NODE_QUERIES else \
+                    self._link_rows(query.name, ids, params, batch_var)
+        if "_limit" in params:
+            rows = rows[params["_offset"]:params["_offset"]+params["_limit"]]
+        return fill_labels(_keep_bound(pd.DataFrame(rows, columns=list(query.variables),
+                                                    dtype=object), list(query.variables)),
+                           query, resolver=self)
+
+
+@lru_cache(maxsize=4)
+def get_index(path: str) -> DumpIndex:
+    """ One index per path and process """
+    return DumpIndex(path)
+
+
+def select_entities(path: str, fmt: str, seeds: list[str], hops: int,
+                    incoming: list[str] = None) -> set:
+    """ Seeds and the entities reached in hops (one pass over the dump per hop) """
+    selected = set(seeds)
+    for hop in range(hops):
+        reached = set()
+        for entity_id, _, claims in iter_records(path, fmt, interest=selected):
+            if entity_id in selected:
+                reached.update(claim[4] for claim in claims if claim[5])
+            elif any(claim[5] and claim[4] in selected and \
+                    (incoming is None or claim[0] in incoming) for claim in claims):
+                reached.add(entity_id)
+        LOGGER.info("Hop %s: %s entities reached, %s new", hop, len(reached),
+                    len(reached - selected))
+        selected |= reached
+    return selected
+
+
+def build_index(path: str, output: str, seeds: list[str], hops: int = 1,
+                incoming: list[str] = INCOMING_PROPERTIES, languages: list[str] = None,
+                fmt: str = None, batch_size: int = 10000) -> DumpIndex:
+    """ Streaming the dump at path into a SQLite index at output.
+    incoming: properties followed backwards (None for all of them)
+    languages: languages of the labels (all of them if None) """
+    fmt = fmt or get_format(path)
+    if fmt not in ["json", "nt"]:
+        raise ValueError("`fmt` should be either `json` or `nt`")
+    seeds = [seed.split("/")[-1] for seed in seeds]
+    selected = select_entities(path, fmt, seeds, hops, incoming)
+
+    tmp_path = f"{output}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("CREATE TABLE claims (subject TEXT, property TEXT, statement TEXT, " + \
+        "rank INTEGER, truthy INTEGER, value TEXT, item INTEGER, qualifiers INTEGER, " + \
+            "start TEXT, end TEXT, pointintime TEXT)")
+    conn.execute("CREATE TABLE labels (id TEXT, lang TEXT, label TEXT, " + \
+        "PRIMARY KEY (id, lang)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def store(interest: set, properties: list[str] = None) -> set:
+        """ Labels and claims (of properties) of the entities of interest,
+        returns the entities and properties referenced by the stored claims """
+        referenced, claims_buffer, labels_buffer = set(), list(), list()
+        for entity_id, labels, claims in iter_records(path, fmt, interest=interest):
+            if entity_id not in interest:
+                continue
+            labels_buffer += [(entity_id, lang, label) for lang, label in labels.items() \
+                if languages is None or lang in languages]
+            claims = [claim for claim in claims if properties is None or claim[0] in properties]
+            claims_buffer += [(entity_id,) + claim for claim in claims]
+            referenced.update(claim[0] for claim in claims)
+            referenced.update(claim[4] for claim in claims if claim[5])
+            if len(claims_buffer) + len(labels_buffer) >= batch_size:
+                conn.executemany(f"INSERT INTO claims VALUES ({','.join('?'*11)})", claims_buffer)
+                conn.executemany("INSERT OR IGNORE INTO labels VALUES (?, ?, ?)", labels_buffer)
+                claims_buffer, labels_buffer = list(), list()
+        conn.executemany(f"INSERT INTO claims VALUES ({','.join('?'*11)})", claims_buffer)
+        conn.executemany("INSERT OR IGNORE INTO labels VALUES (?, ?, ?)", labels_buffer)
+        conn.commit()
+        return referenced
+
+    referenced = store(selected) - selected
+    LOGGER.info("%s entities stored, labels and dates of %s referenced entities",
+                len(selected), len(referenced))
+    store(referenced, properties=DATE_PROPERTIES)
+
+    conn.execute("CREATE INDEX claims_subject ON claims (subject, property)")
+    conn.execute("CREATE INDEX claims_value ON claims (value, property)")
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in {
+        "source": os.path.abspath(path), "format": fmt, "seeds": seeds, "hops": hops,
+        "incoming": incoming, "languages": languages, "entities": len(selected)}.items()])
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, output)
+    get_index.cache_clear()
+    return DumpIndex(output)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-d", "--dump", required=True,
+                    help="Wikidata JSON or truthy N-Triples dump (or subset), can be compressed")
+    ap.add_argument("-o", "--output", required=True, help="path of the SQLite index")
+    ap.add_argument("-s", "--seeds", nargs="+", required=True,
+                    help="seed Wikidata IDs (or urls), e.g. the `id` of gather_events.py")
+    ap.add_argument("-H", "--hops", default=1, type=int,
+                    help="number of hops from the seeds (one pass over the dump per hop)")
+    ap.add_argument("-p", "--properties", default=",".join(INCOMING_PROPERTIES),
+                    help="properties followed backwards, comma separated, or `all`")
+    ap.add_argument("-l", "--languages", default="en,fr",
+                    help="languages of the labels, comma separated, or `all`")
+    ARGS = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    build_index(path=ARGS["dump"], output=ARGS["output"], seeds=ARGS["seeds"],
+                hops=ARGS["hops"],
+                incoming=None if ARGS["properties"] == "all" else ARGS["properties"].split(","),
+                languages=None if ARGS["languages"] == "all" else ARGS["languages"].split(","))
+    LOGGER.info("Index saved at %s", ARGS["output"])
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Compact event table: events and their outgoing links keyed by integer Wikidata IDs
+
+Stages exchange wide DataFrames with full Wikidata urls, and labels repeated on each row
+(e.g. the url and label of an event on each of its outgoing links).
+`EventTable` stores each of them once:
+- `events`: one row per collected event, `qid` (int), `query_type` (categorical),
+  dates (datetime64 in UTC, cf. `parse_dates` in sparql_results.py), other columns as they are
+- `links`: one row per outgoing link, `qid`, `object_qid` (int, <NA> for other objects),
+  `predicate` (categorical), `value`/`valueLabel` of the other objects (categorical),
+  qualifier dates (as events dates)
+- `labels`: one label per entity (`qid` index), shared by events and objects
+
+Joins are made on `qid`. `events_frame` and `links_frame` give back the wide DataFrames
+(cf. FORWARD_LINKS_COLUMNS in gather_events.py).
+"""
+import re
+import pandas as pd
+
+from kb_sparql.sparql_results import parse_dates
+
+WD_ENTITY = "http://www.wikidata.org/entity/"
+DATE_COLUMNS = ["pointintime", "start", "end", "inception", "dissolved"]
+LINKS_COLUMNS = ["wd_page", "eventLabel", "predicate", "object", "objectLabel",
+                 "start", "end", "pointintime"]
+
+
+def wd_ids(values) -> list[str]:
+    """ Wikidata IDs (`Q...`) of Wikidata urls or IDs """
+    return [value.rsplit("/", 1)[-1] for value in values]
+
+
+def to_qid(values) -> pd.Series:
+    """ Wikidata urls or IDs -> integer QIDs, <NA> for other values """
+    values = (values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)) \
+        .astype("string")
+    ids = values.str.replace(f"^{re.escape(WD_ENTITY)}", "", regex=True)
+    is_qid = ids.str.fullmatch(r"Q\d+").fillna(False).values
+    qids = pd.Series(pd.NA, index=values.index, dtype="Int64")
+    qids[is_qid] = ids[is_qid].str.slice(1).astype("int64").values
+    return qids
+
+
+def to_url(qids: pd.Series) -> pd.Series:
+    """ Integer QIDs -> Wikidata urls, NaN for <NA> """
+    return (WD_ENTITY + "Q" + qids.astype("string")).astype(object) \
+        .where(qids.notna().values, None)
+
+
+def _typed(df_input: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+    """ Dates parsed (empty strings as NaT, dates out of the datetime range kept),
+    `query_type` as categorical """
+    df_input = df_input.copy()
+    for col in [col for col in DATE_COLUMNS if col in df_input.columns]:
+        if not pd.api.types.is_datetime64_any_dtype(df_input[col]):
+            df_input[col] = parse_dates(df_input[col])
+    if "query_type" in df_input.columns:
+        df_input["query_type"] = df_input["query_type"].astype("category")
+    return df_input
+
+
+class EventTable:
+    """ Events, outgoing links and labels of a collection, keyed by QID """
+
+    def __init__(self, events: pd.core.frame.DataFrame = None,
+                 links: pd.core.frame.DataFrame = None, labels: pd.core.frame.DataFrame = None,
+                 event_columns: list[str] = None, col_wikidata: str = "event"):
+        self.events = events if events is not None else pd.DataFrame({"qid": pd.Series(
+            dtype="Int64")})
+        self.links = links if links is not None else pd.DataFrame({"qid": pd.Series(
+            dtype="Int64")})
+        self.labels = labels if labels is not None else \
+            pd.DataFrame({"label": pd.Series(dtype=object)}, index=pd.Index([], dtype="Int64",
+                                                                            name="qid"))
+        # columns of the wide events DataFrame, in order
+        self.col_wikidata = col_wikidata
+        self.event_columns = event_columns or [col_wikidata, "eventLabel"]
+
+    def add_labels(self, qids: pd.Series, labels: pd.Series):
+        """ Interning labels: the first label of each QID is kept """
+        new = pd.DataFrame({"qid": qids.values, "label": labels.values}).dropna() \
+            .drop_duplicates(subset="qid").set_index("qid")
+        new = new[~new.index.isin(self.labels.index)]
+        self.labels = pd.concat([self.labels, new]) if self.labels.shape[0] else new
+        return self
+
+    def label(self, qids: pd.Series) -> pd.Series:
+        """ Label of each QID (NaN if unknown) """
+        return pd.Series(self.labels["label"].reindex(qids.values).values, index=qids.index,
+                         dtype=object)
+
+    @classmethod
+    def from_frames(cls, events: pd.core.frame.DataFrame = None,
+                    links: pd.core.frame.DataFrame = None, col_wikidata: str = "event"):
+        """ From the wide DataFrames: collected events (col_wikidata: url column)
+        and/or outgoing links (LINKS_COLUMNS) """
+        table = cls(col_wikidata=col_wikidata)
+        if events is not None:
+            table.event_columns = list(events.columns)
+            qids = to_qid(events[col_wikidata])
+            table.add_labels(qids, events["eventLabel"])
+            table.events = _typed(events.drop(columns=[col_wikidata, "eventLabel"])) \
+                .assign(qid=qids.values)
+        if links is not None:
+            qids, object_qids = to_qid(links["wd_page"]), to_qid(links["object"])
+            table.add_labels(qids, links["eventLabel"])
+            table.add_labels(object_qids, links["objectLabel"])
+            is_value = object_qids.isna().values
+            table.links = _typed(pd.DataFrame({
+                "qid": qids.values, "predicate": links["predicate"].astype("category").values,
+                "object_qid": object_qids.values,
+                "value": links["object"].where(is_value, None).astype("category").values,
+                "valueLabel": links["objectLabel"].where(is_value, None).astype("category") \
+                    .values,
+                **{col: links[col].values for col in ["start", "end", "pointintime"] \
+                    if col in links.columns}}))
+        return table
+
+    def wd_ids(self) -> list[str]:
+        """ Wikidata IDs of the events, without duplicates """
+        return [f"Q{qid}" for qid in self.events["qid"].dropna().unique()]
+
+    def event_labels(self) -> pd.core.frame.DataFrame:
+        """ (qid, eventLabel) of the events, without duplicates """
+        qids = self.events["qid"].drop_duplicates()
+        return pd.DataFrame({"qid": qids.values, "eventLabel": self.label(qids).values})
+
+    def events_frame(self) -> pd.core.frame.DataFrame:
+        """ Wide DataFrame of the events (as collected) """
+        qids = self.events["qid"]
+        df_output = self.events.drop(columns="qid").assign(
+            **{self.col_wikidata: to_url(qids).values, "eventLabel": self.label(qids).values})
+        return df_output[self.event_columns]
+
+    def links_frame(self) -> pd.core.frame.DataFrame:
+        """ Wide DataFrame of the outgoing links (input of `WikidataConverter`) """
+        is_value = self.links["object_qid"].isna().values
+        df_output = pd.DataFrame({
+            "wd_page": to_url(self.links["qid"]).values,
+            "eventLabel": self.label(self.links["qid"]).values,
+            "predicate": self.links["predicate"].values,
+            "object": to_url(self.links["object_qid"]).where(
+                ~is_value, self.links["value"].astype(object).values).values,
+            "objectLabel": self.label(self.links["object_qid"]).where(
+                ~is_value, self.links["valueLabel"].astype(object).values).values})
+        for col in ["start", "end", "pointintime"]:
+            if col in self.links.columns:
+                df_output[col] = self.links[col].values
+        return df_output
+
+    def memory_usage(self) -> int:
+        """ Size of the tables in bytes """
+        return sum(int(df.memory_usage(deep=True).sum()) \
+            for df in [self.events, self.links, self.labels])
@@ -2,8 +2,14 @@
 """ Collect events """
 import argparse
 import pandas as pd
-import streamlit as st
 import kb_sparql.sparql_query as sparql_query
+from kb_sparql.query_db import SPARQL_QUERIES, EVENT_BRANCHES, COLLECT_UNION
+from kb_sparql.query_template import RenderedQuery, render_fragment
+from kb_sparql.event_table import EventTable, wd_ids
+from narrative.cache import cached
+
+# Query of the outgoing links: one row per statement, with its time qualifiers
+FORWARD_LINKS_QUERY = "forward_links_qualified"
 
 ARGS = [
     {"id": "Q6534", "query_type": "obj-part-of-id",
@@ -15,12 +21,13 @@ ARGS = [
 ]
 
 
-ARGS_PROPERTY = {"id": None, "query_type": "forward_links",
+ARGS_PROPERTY = {"id": None, "query_type": FORWARD_LINKS_QUERY,
                  "path": "unique_events_demo.csv", "column": "event",
                  "clean_df": 1, "save_path": "unique_events_forward_links.csv"}
 
 
-def build_args_for_collect(id_query_type_l: list[tuple[str, str, str, str]]) -> list[dict]:
+def build_args_for_collect(id_query_type_l: list[tuple[str, str, str, str]],
+                           lang: str = "en") -> list[dict]:
     """
     Args:
         - id_query_type_l:
@@ -30,6 +37,7 @@ def build_args_for_collect(id_query_type_l: list[tuple[str, str, str, str]]) ->
             <Wikidata ID> is the starting point to retrieve data from wikidata,
             <query_type> specifies the key to the SPARQL query to be run.
             query_type should be a key in SPARQL_QUERIES in the ./query_db.py script
+        - lang: language of the labels
     Returns:
         - list of arguments to call the sparql_query.py script
     """
@@ -37,21 +45,59 @@ def build_args_for_collect(id_query_type_l: list[tuple[str, str, str, str]]) ->
     for (curr_id, query_type, y_b, y_e) in id_query_type_l:
         if query_type == "obj-instance-of-historical-country-and-has-country-id":
             res.append({"id": {"id": curr_id, "year_begin": y_b, "year_end": y_e},
-                        "query_type": query_type, "path": None,
+                        "query_type": query_type, "path": None, "lang": lang,
                         "column": None, "clean_df": 1, "save_path": None})
         else:
-            res.append({"id": curr_id, "query_type": query_type,
+            res.append({"id": curr_id, "query_type": query_type, "lang": lang,
              "path": None, "column": None, "clean_df": 1, "save_path": None})
     return res
 
 
-@st.cache(show_spinner=False)
-def collect_data(args_collect_list: list[dict] = ARGS) -> pd.core.frame.DataFrame:
+def build_union_query(args_collect_list: list[dict] = ARGS) -> RenderedQuery:
+    """ One query for all the arguments of args_collect_list (cf. `build_args_for_collect`):
+    one UNION branch per argument, the query type of each row is in `query_type` """
+    langs = {arg.get("lang", "en") for arg in args_collect_list}
+    if len(langs) != 1:
+        raise ValueError("All arguments of a combined query should have the same `lang`")
+    lang, branches = langs.pop(), list()
+    for arg in args_collect_list:
+        if arg["query_type"] not in EVENT_BRANCHES:
+            raise ValueError(f"Query type `{arg['query_type']}` can not be combined, " + \
+                f"query types are: {list(EVENT_BRANCHES)}")
+        params = dict(arg["id"]) if isinstance(arg["id"], dict) else {"id": arg["id"]}
+        values = SPARQL_QUERIES[arg["query_type"]].check_params({**params, "lang": lang})
+        branches.append("{" + render_fragment(EVENT_BRANCHES[arg["query_type"]], values) + \
+            f'\n        BIND("{arg["query_type"]}" AS ?query_type) }}')
+    return COLLECT_UNION.render(_branches="\n        UNION\n        ".join(branches), lang=lang)
+
+
+def iter_collect_data(args_collect_list: list[dict] = ARGS, combined: bool = False):
+    """ Running each sparql query of args_collect_list (cf. `collect_data`),
+    the DataFrame of each query is yielded as soon as it is retrieved
+    (queries without results are skipped).
+    If combined, all query types are retrieved with one UNION query (`build_union_query`),
+    except when queries are answered from a dump index """
+    if combined and args_collect_list and not sparql_query.DUMP_INDEX:
+        curr_df = sparql_query.get_output_sparql(build_union_query(args_collect_list))
+        if isinstance(curr_df, pd.DataFrame):
+            yield curr_df
+        return
+    for arg in args_collect_list:
+        curr_df = sparql_query.main(arg)
+        if isinstance(curr_df, pd.DataFrame):
+            yield curr_df
+
+
+@cached(show_spinner=False)
+def collect_data(args_collect_list: list[dict] = ARGS,
+                 combined: bool = False) -> pd.core.frame.DataFrame:
     """
     Args:
         - args_collect_list
             List of arguments to extract Wikidata content.
             Cf. ARGS above example for further specifications
+        - combined
+            If True, one UNION query for all the arguments instead of one query each
     Returns:
         - DataFrame containing all instances found
             within wikidata with the SPARQL queries
@@ -60,15 +106,59 @@ def collect_data(args_collect_list: list[dict] = ARGS) -> pd.core.frame.DataFram
 
     # Running each sparql query given in input
     # Concatenate results in dataframe
-    for arg in args_collect_list:
-        curr_df = sparql_query.main(arg)
-        if isinstance(curr_df, pd.DataFrame):
-            df_concat = pd.concat([df_concat, curr_df]) \
-                if isinstance(df_concat, pd.DataFrame) else curr_df
+    for curr_df in iter_collect_data(args_collect_list, combined=combined):
+        df_concat = pd.concat([df_concat, curr_df]) \
+            if isinstance(df_concat, pd.DataFrame) else curr_df
 
     return df_concat
 
 
+# Columns of the collected events (`query_type`: combined queries only)
+EVENT_COLUMNS = ["event", "eventLabel", "pointintime", "start", "end", "inception",
+                 "dissolved"]
+
+
+FORWARD_LINKS_RENAMING = {
+    "objectLabel": "eventLabel", "wdLabel": "predicate",
+    "ps_": "object", "ps_Label": "objectLabel",
+    # qualifiers of the statement (empty for the `forward_links` query)
+    "start": "start", "end": "end", "pointintime": "pointintime"
+}
+FORWARD_LINKS_COLUMNS = ["wd_page", "eventLabel", "predicate", "object", "objectLabel",
+                         "start", "end", "pointintime"]
+
+
+def clean_forward_links(df_clean: pd.core.frame.DataFrame, id_event: str) \
+        -> pd.core.frame.DataFrame:
+    """ Renaming columns of the cleaned sparql output (cf. `sparql_query.run_query_clean_df`)
+    of the `forward_links` query of id_event """
+    return_df = df_clean.reindex(columns=list(FORWARD_LINKS_RENAMING)) \
+        .rename(columns=FORWARD_LINKS_RENAMING)
+    return_df['wd_page'] = f"http://www.wikidata.org/entity/{id_event}"
+    return return_df
+
+
+def get_clean_output_sparql(id_event: str, lang: str = "en",
+                            query_type: str = FORWARD_LINKS_QUERY) -> pd.core.frame.DataFrame:
+    """ Outgoing links of one event, renaming columns from sparql output
+    query_type: `forward_links_qualified` or `forward_links` """
+    return clean_forward_links(sparql_query.run_query_clean_df(
+        SPARQL_QUERIES[query_type](id_event, lang=lang)), id_event)
+
+
+@cached(show_spinner=False)
+def get_outgoing_nodes(events, lang: str = "en",
+                       query_type: str = FORWARD_LINKS_QUERY) -> pd.core.frame.DataFrame:
+    """ SPARQL Query for outgoing nodes of each event (Wikidata urls or IDs, or EventTable) """
+    columns = FORWARD_LINKS_COLUMNS
+    ids = events.wd_ids() if isinstance(events, EventTable) else wd_ids(events)
+    dfs = [get_clean_output_sparql(wd_id, lang=lang, query_type=query_type) \
+        [columns] for wd_id in ids]
+    df_wd = pd.concat(dfs) if dfs else pd.DataFrame(columns=columns)
+    # categories of each event are merged
+    return df_wd.astype({"predicate": "category"})
+
+
 def check_args(args: dict):
     """ Checking args in command line to execute script"""
     if args["type"] not in ["collect", "expand"]:
@@ -105,13 +195,15 @@ if __name__ == '__main__':
                         "Ids will be taken in the column given in argument")
     ap.add_argument("-c", "--column", default="event",
                     help="if args `path` given, column to extract the ids from")
+    ap.add_argument("-u", "--union", action="store_true",
+                    help="if type is `collect`, one UNION query for all query types")
     ARGS = vars(ap.parse_args())
 
     check_args(args=ARGS)
 
     if ARGS["type"] == "collect":
 
-        DF_CONCAT = collect_data()
+        DF_CONCAT = collect_data(combined=ARGS["union"])
         DF_CONCAT.to_csv(ARGS["save"])
         DF_CONCAT.drop_duplicates().to_csv(
             f"{'/'.join(ARGS['save'].split('/')[:-1])}" + \
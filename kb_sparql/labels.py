@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Labels of Wikidata entities, out of the SPARQL queries
+
+Queries rendered with `labels=False` (cf. query_template.py) return the IDs of the
+`?xLabel` variables instead of running the label service. Their labels are then
+filled by a resolver: missing labels are retrieved with `wbgetentities` (50 IDs per call)
+and stored in a persistent ID -> {lang: label} cache (KVStore `wd_labels`),
+so that frequent entities (France, Paris...) are retrieved once for all queries.
+
+Languages can be fallback chains (e.g. `fr,en`), as in the label service:
+the first language with a label is used, the ID itself if there is none.
+"""
+from functools import lru_cache
+from collections import Counter
+import requests
+import pandas as pd
+
+from kb_sparql.sparql_results import apply_dtypes
+from narrative.kv_store import KVStore
+from settings.settings import AGENT, WIKIDATA_API
+from narrative.mediawiki import get_json
+
+WD_ENTITY = "http://www.wikidata.org/entity/"
+
+
+class LabelResolver:
+    """ Wikidata ID -> label, from a cache shared by all runs.
+    Languages without label are stored as well (`None`), not to be retrieved again """
+
+    batch_size = 50
+
+    def __init__(self, store: KVStore = None):
+        self.store = store if store is not None else KVStore(name="wd_labels")
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": AGENT})
+        self.stats = Counter()
+
+    def _query_batch(self, ids: list[str], langs: list[str]) -> dict[str, dict]:
+        """ One API call for up to `batch_size` IDs: ID -> {lang: label or None}.
+        Raises if the call failed """
+        entities = get_json(self.session, WIKIDATA_API, params={
+            "action": "wbgetentities", "props": "labels", "ids": "|".join(ids),
+            "languages": "|".join(langs), "format": "json"},
+                            service="wikidata_api").get("entities", dict())
+
+        # redirected IDs are returned with the ID of their target
+        redirects = {entity["redirects"]["from"]: entity_id \
+            for entity_id, entity in entities.items() if "redirects" in entity}
+        res = dict()
+        for curr_id in ids:
+            labels = entities.get(redirects.get(curr_id, curr_id), dict()).get("labels", dict())
+            res[curr_id] = {lang: labels[lang]["value"] if lang in labels else None \
+                for lang in langs}
+        return res
+
+    @staticmethod
+    def _pick(labels: dict, langs: list[str]):
+        """ Label in the first language of langs that has one, False if it is not known yet """
+        for lang in langs:
+            if lang not in labels:
+                return False
+            if labels[lang] is not None:
+                return labels[lang]
+        return None
+
+    def labels(self, ids: list[str], lang: str = "en") -> dict[str, str]:
+        """ Label of each ID in the first language of lang (e.g. `fr,en`) that has one,
+        the ID itself otherwise (as the label service) """
+        ids, langs = list(dict.fromkeys(ids)), lang.split(",")
+        cached = self.store.get_many(ids)
+        missing = [curr_id for curr_id in ids if self._pick(cached.get(curr_id, dict()), langs) \
+            is False]
+        self.stats["cache"] += len(ids) - len(missing)
+        self.stats["network"] += len(missing)
+        for i in range(0, len(missing), self.batch_size):
+            found = self._query_batch(missing[i:i+self.batch_size], langs)
+            found = {curr_id: {**cached.get(curr_id, dict()), **labels} \
+                for curr_id, labels in found.items()}
+            self.store.set_many(found)
+            cached.update(found)
+        return {curr_id: self._pick(cached.get(curr_id, dict()), langs) or curr_id \
+            for curr_id in ids}
+
+    def __call__(self, wd_id: str, lang: str = "en") -> str:
+        return self.labels([wd_id], lang=lang)[wd_id]
+
+
+def fill_labels(df_input: pd.core.frame.DataFrame, query: str,
+                resolver=None) -> pd.core.frame.DataFrame:
+    """ Filling the label columns of the results of a query rendered with `labels=False`,
+    columns are then the ones of the query with labels.
+    resolver: any object with a `labels(ids, lang)` method (LabelResolver by default) """
+    labels = getattr(query, "params", dict()).get("_labels")
+    if not labels or df_input.shape[0] == 0:
+        return df_input
+    values = {var: df_input[var].astype(object) for var in set(labels.values()) \
+        if var in df_input.columns}
+    ids = {value[len(WD_ENTITY):] for col in values.values() for value in col.dropna() \
+        if value.startswith(WD_ENTITY)}
+    names = (resolver or get_resolver()).labels(sorted(ids), lang=query.params["lang"]) \
+        if ids else dict()
+    df_input = df_input.copy()
+    for label, var in labels.items():
+        if var in values:
+            df_input[label] = values[var].map(lambda value: names[value[len(WD_ENTITY):]] \
+                if isinstance(value, str) and value.startswith(WD_ENTITY) else value).astype(object)
+    return apply_dtypes(df_input[[col for col in query.params["_variables"] \
+        if col in df_input.columns]])
+
+
+@lru_cache(maxsize=1)
+def get_resolver() -> LabelResolver:
+    """ Resolver shared by the queries of the process """
+    return LabelResolver()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Wikidata predicates (English labels) relevant for the narratives, grouped by the type
+of information they link to (used in the app and by the crawler)
+"""
+import re
+
+PRED_GROUPING_WD = {
+    'who': ['participant', 'organizer', 'founded by'],
+    'where': ['country', 'location', 'coordinate location',
+              'located in the administrative territorial entity', 'continent'],
+    'when': ['point in time', 'start time', 'end time',
+             'inception', 'dissolved, abolished or demolished date'],
+    'temporal_link': ['part of', 'followed by', 'replaces',
+                      'replaced by', 'follows', 'time period'],
+    'causal_link': ['has effect'],
+}
+
+# Wikidata property ID of each predicate of PRED_GROUPING_WD
+# (labels depend on the language of the queries, IDs do not)
+PRED_IDS_WD = {
+    'participant': 'P710', 'organizer': 'P664', 'founded by': 'P112',
+    'country': 'P17', 'location': 'P276', 'coordinate location': 'P625',
+    'located in the administrative territorial entity': 'P131', 'continent': 'P30',
+    'point in time': 'P585', 'start time': 'P580', 'end time': 'P582', 'inception': 'P571',
+    'dissolved, abolished or demolished date': 'P576',
+    'part of': 'P361', 'followed by': 'P156', 'replaces': 'P1365', 'replaced by': 'P1366',
+    'follows': 'P155', 'time period': 'P2348',
+    'has effect': 'P1542',
+}
+PROPERTY_ID = re.compile(r"P\d+")
+
+
+def resolve_predicates(names: list[str]) -> set[str]:
+    """ Property IDs of names, each name being a group of PRED_GROUPING_WD,
+    a predicate of PRED_GROUPING_WD (English label) or a property ID (`P...`) """
+    res = set()
+    for name in names:
+        for pred in PRED_GROUPING_WD.get(name, [name]):
+            if pred in PRED_IDS_WD:
+                res.add(PRED_IDS_WD[pred])
+            elif PROPERTY_ID.fullmatch(pred):
+                res.add(pred)
+            else:
+                raise ValueError(f"Unknown predicate `{pred}`, predicates should be groups " + \
+                    f"({list(PRED_GROUPING_WD)}), labels of their predicates or property IDs")
+    return res
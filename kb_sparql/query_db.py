@@ -2,15 +2,17 @@
 """
 SPARQL_QUERIES:
 - keys: naming used through the repo for specific SPARQL queries
-- values: function taking a wikidata ID (str) as input and returning a string SPARQL query
+- values: query templates (cf. query_template.py), parameters are the Wikidata ID `$id`
+(`$year_begin`/`$year_end` for some queries) and the language of the labels `$lang`.
+Called with a wikidata ID (str) as input, they return a string SPARQL query
+(labels in English by default)
 """
+from kb_sparql.query_template import QueryTemplate
 
-SPARQL_QUERIES = {
-    "forward_links": lambda id: \
-        """
+SPARQL_QUERIES = {template.name: template for template in [
+    QueryTemplate("forward_links", """
         SELECT ?objectLabel ?wdLabel ?ps_ ?ps_Label {
-            VALUES (?object) {(wd:""" + id + """)} """ + \
-            """
+            VALUES (?object) {(wd:$id)} 
             ?object ?p ?statement .
             ?statement ?ps ?ps_ .
 
@@ -22,15 +24,32 @@ SPARQL_QUERIES = {
             ?wdpq wikibase:qualifier ?pq .
             }
 
-            SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+            SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         } ORDER BY ?wd ?statement ?ps_
-        """,
+        """),
 
-    "incoming_links": lambda id: \
-        """
+    # Same as `forward_links` without the unprojected qualifier join (one row per statement
+    # instead of one per qualifier), with the time qualifiers and the property of each statement
+    QueryTemplate("forward_links_qualified", """
+        SELECT ?objectLabel ?wd ?wdLabel ?ps_ ?ps_Label ?start ?end ?pointintime {
+            VALUES (?object) {(wd:$id)}
+            ?object ?p ?statement .
+            ?statement ?ps ?ps_ .
+
+            ?wd wikibase:claim ?p.
+            ?wd wikibase:statementProperty ?ps.
+
+            OPTIONAL { ?statement pq:P580 ?start . }
+            OPTIONAL { ?statement pq:P582 ?end . }
+            OPTIONAL { ?statement pq:P585 ?pointintime . }
+
+            SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
+        } ORDER BY ?wd ?statement ?ps_
+        """),
+
+    QueryTemplate("incoming_links", """
         SELECT ?objectLabel ?wdLabel ?ps_Label {
-            VALUES (?ps_) {(wd:""" + id + """)} """ + \
-            """
+            VALUES (?ps_) {(wd:$id)} 
             ?object ?p ?statement .
             ?statement ?ps ?ps_ .
 
@@ -42,61 +61,85 @@ SPARQL_QUERIES = {
             ?wdpq wikibase:qualifier ?pq .
             }
 
-            SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+            SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         } ORDER BY ?wd ?statement ?ps_
-        """,
+        """),
 
-    "obj-part-of-id": lambda id: \
-        """
+    QueryTemplate("obj-part-of-id", """
         SELECT ?event ?eventLabel ?pointintime ?start ?end ?inception ?dissolved
         WHERE {
-        ?event wdt:P361 wd:""" + id + """. """ + \
-        """
+        ?event wdt:P361 wd:$id. 
         OPTIONAL { ?event wdt:P585 ?pointintime. }
         OPTIONAL { ?event wdt:P580 ?start. }
         OPTIONAL { ?event wdt:P582 ?end. }
         OPTIONAL { ?event wdt:P571 ?inception. }
         OPTIONAL { ?event wdt:P576 ?dissolved. }
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         }
-        """,
+        """),
 
-    "obj-instance-of-historical-country-and-has-country-id": lambda input: \
-        """
+    QueryTemplate("obj-instance-of-historical-country-and-has-country-id", """
         SELECT ?event ?eventLabel ?inception ?end
         WHERE {
         ?event wdt:P31 wd:Q3024240;
-               wdt:P17 wd:""" + input["id"] + """. """ + \
-        """
+               wdt:P17 wd:$id. 
         OPTIONAL { ?event wdt:P571 ?inception. }
         OPTIONAL { ?event wdt:P576 ?end. }
-        FILTER (('""" + input["year_begin"] + """-01-01T00:00:00+00:00'^^xsd:dateTime < ?inception && ?inception < '""" + input["year_end"] + """-12-31T00:00:00+00:00'^^xsd:dateTime) ||
-                ('""" + input["year_begin"] + """-01-01T00:00:00+00:00'^^xsd:dateTime < ?end && ?end < '""" + input["year_end"] + """-12-31T00:00:00+00:00'^^xsd:dateTime))
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+        FILTER (('$year_begin-01-01T00:00:00+00:00'^^xsd:dateTime < ?inception && ?inception < '$year_end-12-31T00:00:00+00:00'^^xsd:dateTime) ||
+                ('$year_begin-01-01T00:00:00+00:00'^^xsd:dateTime < ?end && ?end < '$year_end-12-31T00:00:00+00:00'^^xsd:dateTime))
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         }
-        """,  # Q142 = France
+        """),  # Q142 = France
 
-    "id-has-significant-event-obj": lambda id: \
-        """
+    QueryTemplate("id-has-significant-event-obj", """
         SELECT ?event ?eventLabel ?pointintime ?start ?end ?inception ?dissolved
         WHERE {
-        wd:""" + id + """ wdt:P793 ?event.
+        wd:$id wdt:P793 ?event.
         OPTIONAL { ?event wdt:P585 ?pointintime. }
         OPTIONAL { ?event wdt:P580 ?start. }
         OPTIONAL { ?event wdt:P582 ?end. }
         OPTIONAL { ?event wdt:P571 ?inception. }
         OPTIONAL { ?event wdt:P576 ?dissolved. }
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         }
-        """,
+        """),
 
-    "p-participant-in-id": lambda id: \
-        """
+    QueryTemplate("p-participant-in-id", """
         SELECT ?p ?pLabel
         WHERE {
-        ?p wdt:P1344 wd:""" + id + """. """ + \
-        """
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+        ?p wdt:P1344 wd:$id. 
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
         }
-        """,
+        """),
+]}
+
+# Patterns binding ?event for the event query types above, combined in `COLLECT_UNION`
+# (parameters are validated by the template of the query type)
+EVENT_BRANCHES = {
+    "obj-part-of-id": """
+        ?event wdt:P361 wd:$id.""",
+    "obj-instance-of-historical-country-and-has-country-id": """
+        ?event wdt:P31 wd:Q3024240;
+               wdt:P17 wd:$id.
+        OPTIONAL { ?event wdt:P571 ?inception. }
+        OPTIONAL { ?event wdt:P576 ?end. }
+        FILTER (('$year_begin-01-01T00:00:00+00:00'^^xsd:dateTime < ?inception && ?inception < '$year_end-12-31T00:00:00+00:00'^^xsd:dateTime) ||
+                ('$year_begin-01-01T00:00:00+00:00'^^xsd:dateTime < ?end && ?end < '$year_end-12-31T00:00:00+00:00'^^xsd:dateTime))""",
+    "id-has-significant-event-obj": """
+        wd:$id wdt:P793 ?event.""",
 }
+
+# Events of several query types in one query: one UNION branch per query type, tagged with
+# `?query_type` (`$_branches`), dates retrieved once per event
+COLLECT_UNION = QueryTemplate("collect-union", """
+        SELECT DISTINCT ?event ?eventLabel ?pointintime ?start ?end ?inception ?dissolved ?query_type
+        WHERE {
+        $_branches
+        OPTIONAL { ?event wdt:P585 ?pointintime. }
+        OPTIONAL { ?event wdt:P580 ?start. }
+        OPTIONAL { ?event wdt:P582 ?end. }
+        OPTIONAL { ?event wdt:P571 ?inception. }
+        OPTIONAL { ?event wdt:P576 ?dissolved. }
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "$lang" }
+        }
+        """)
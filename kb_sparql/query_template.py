@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+SPARQL query templates: parameters are written `$name` (or `${name}`) in the query text.
+Each template is parsed once (projection, parameters), rendering only joins
+the validated values with the literal parts of the query.
+
+Parameters of PARAM_PATTERNS are validated (e.g. `id` should be a Wikidata ID),
+others are escaped as the content of a string literal, except parameters starting with `_`:
+fragments of query rendered by the caller (e.g. UNION branches), inserted as they are.
+
+Templates whose `id` is a term (`wd:$id`) can also be rendered for many IDs at once
+(`render_batch`): the ID becomes a variable bound by a single `VALUES` block
+and added to the projection.
+
+Templates can also be rendered without the label service (`labels=False`, by default
+if SPARQL_LABELS is `resolver`): `?xLabel` variables are replaced by `?x` in the projection,
+and the labels are filled after the query (cf. labels.py).
+"""
+import re
+
+from settings.settings import SPARQL_LABELS
+
+PARAM_PATTERNS = {
+    "id": re.compile(r"[QPL]\d+"),
+    "year_begin": re.compile(r"-?\d{1,4}"),
+    "year_end": re.compile(r"-?\d{1,4}"),
+    # language or fallback chain, e.g. `fr` or `fr,en`
+    "lang": re.compile(r"[a-z]{2,3}(-[a-z0-9]+)*(,[a-z]{2,3}(-[a-z0-9]+)*)*"),
+}
+DEFAULTS = {"lang": "en"}
+
+PLACEHOLDER = re.compile(r"\$(?:(\w+)|\{(\w+)\})")
+PROJECTION = re.compile(r"SELECT (?:DISTINCT |REDUCED )?(.+?) ({|WHERE)", re.DOTALL)
+ID_VALUES = re.compile(r"VALUES \(\?(\w+)\) \{\(wd:\$id\)\}")
+LABEL_SERVICE = re.compile(r"\n[ \t]*SERVICE wikibase:label \{[^}]*\}")
+
+
+class RenderedQuery(str):
+    """ Query text, with the projected variables of the template
+    (and its name and parameters, e.g. to answer it from a local index, cf. dump_backend.py) """
+
+    def __new__(cls, text: str, variables: tuple, name: str = None, params: dict = None):
+        query = super().__new__(cls, text)
+        query.variables = variables
+        query.name = name
+        query.params = params or dict()
+        return query
+
+    def __reduce__(self):
+        return (RenderedQuery, (str(self), self.variables, self.name, self.params))
+
+
+def escape_literal(value: str) -> str:
+    """ Value usable inside a SPARQL string literal """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("'", "\\'") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
+def get_projection(text: str) -> tuple:
+    """ Variables of the SELECT clause """
+    matches = PROJECTION.search(text)
+    if not matches:
+        raise ValueError(("Problem with the query"))
+    return tuple(elt.strip() for elt in matches.group(1).split("?") if elt.strip())
+
+
+def strip_labels(text: str) -> str:
+    """ Query without the label service, `?x` is projected instead of `?xLabel` """
+    matches = PROJECTION.search(text)
+    variables = get_projection(text)
+    projection = list(dict.fromkeys(var[:-len("Label")] if var.endswith("Label") else var \
+        for var in variables))
+    text = f"{text[:matches.start(1)]}{' '.join(f'?{var}' for var in projection)}" + \
+        text[matches.end(1):]
+    return LABEL_SERVICE.sub("", text)
+
+
+def render_fragment(text: str, values: dict) -> str:
+    """ Fragment of query with its `$param` placeholders replaced by (validated) values """
+    return "".join(values[part[0]] if isinstance(part, tuple) else part \
+        for part in compile_parts(text))
+
+
+def compile_parts(text: str) -> list:
+    """ Literal parts (str) and parameters (1-tuples with the parameter name) of text """
+    parts, start = list(), 0
+    for matches in PLACEHOLDER.finditer(text):
+        parts.append(text[start:matches.start()])
+        parts.append((matches.group(1) or matches.group(2),))
+        start = matches.end()
+    parts.append(text[start:])
+    return [part for part in parts if part != ""]
+
+
+class QueryTemplate:
+    """ SPARQL query with `$param` placeholders.
+    Calling the template works as the former SPARQL_QUERIES functions:
+    `template(<ID>, lang=...)` or `template({"id": ..., "year_begin": ...}, lang=...)` """
+
+    def __init__(self, name: str, text: str, batch_var: str = "root"):
+        self.name = name
+        self.text = text
+        self.parts = compile_parts(text)
+        self.params = tuple(dict.fromkeys(part[0] for part in self.parts \
+            if isinstance(part, tuple)))
+        self.variables = get_projection(text)
+        # label variable -> variable it is the label of
+        self.labels = {var: var[:-len("Label")] for var in self.variables if var.endswith("Label")}
+        self.bare_parts = compile_parts(strip_labels(text))
+        self.bare_variables = get_projection(strip_labels(text))
+        self.batch_var, self.batch_parts, self.batch_variables = None, None, None
+        self.bare_batch_parts, self.bare_batch_variables = None, None
+        if "id" in self.params:
+            self._compile_batch(batch_var)
+
+    def __repr__(self):
+        return f"QueryTemplate({self.name!r}, params={self.params})"
+
+    def _compile_batch(self, batch_var: str):
+        """ Same query with a `VALUES` block for the IDs (`$_ids` parameter) """
+        matches = ID_VALUES.search(self.text)
+        if matches:  # IDs already bound to a variable
+            batch_var = matches.group(1)
+            text = ID_VALUES.sub(f"VALUES ?{batch_var} {{ $_ids }}", self.text)
+        else:
+            if not re.search(r"wd:\$id\b", self.text):
+                return
+            text = re.sub(r"wd:\$id\b", f"?{batch_var}", self.text)
+            start = text.index("{", PROJECTION.search(text).end(1))
+            text = f"{text[:start+1]}\n        VALUES ?{batch_var} {{ $_ids }}{text[start+1:]}"
+        if batch_var not in self.variables:
+            matches = PROJECTION.search(text)
+            end = matches.start(1) + len(matches.group(1).rstrip())
+            text = f"{text[:end]} ?{batch_var}{text[end:]}"
+        self.batch_var = batch_var
+        self.batch_parts = compile_parts(text)
+        self.batch_variables = get_projection(text)
+        self.bare_batch_parts = compile_parts(strip_labels(text))
+        self.bare_batch_variables = get_projection(strip_labels(text))
+
+    def check_params(self, params: dict) -> dict:
+        """ Validated and escaped values of all parameters """
+        params = {**DEFAULTS, **params}
+        missing = [param for param in self.params if param not in params]
+        if missing:
+            raise ValueError(f"Missing parameters {missing} for query `{self.name}`")
+        res = dict()
+        for param in self.params:
+            value = str(params[param])
+            if param.startswith("_"):
+                res[param] = value
+            elif param in PARAM_PATTERNS:
+                if not PARAM_PATTERNS[param].fullmatch(value):
+                    raise ValueError(f"Invalid value `{value}` for `{param}` " + \
+                        f"in query `{self.name}`")
+                res[param] = value
+            else:
+                res[param] = escape_literal(value)
+        return res
+
+    @staticmethod
+    def _join(parts: list, values: dict) -> str:
+        return "".join(values[part[0]] if isinstance(part, tuple) else part for part in parts)
+
+    def _rendered(self, text: str, variables: tuple, bare_variables: tuple,
+                  params: dict, labels: bool) -> RenderedQuery:
+        """ Query with its parameters, and the label variables to fill if `labels` is False """
+        if labels or not self.labels:
+            return RenderedQuery(text, variables, name=self.name, params={**DEFAULTS, **params})
+        return RenderedQuery(text, bare_variables, name=self.name, params={
+            **DEFAULTS, **params, "_labels": self.labels, "_variables": variables})
+
+    def render(self, labels: bool = None, **params) -> RenderedQuery:
+        """ Query for one set of parameters (without label service if labels is False) """
+        values = self.check_params(params)
+        if labels is None:
+            labels = SPARQL_LABELS == "service"
+        return self._rendered(self._join(self.parts if labels else self.bare_parts, values),
+                              self.variables, self.bare_variables, params, labels)
+
+    def render_batch(self, ids: list[str], labels: bool = None, **params) -> RenderedQuery:
+        """ One query for all ids, the ID of each row is in the `batch_var` column """
+        if self.batch_parts is None:
+            raise ValueError(f"Query `{self.name}` can not be rendered for several IDs")
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            raise ValueError("`ids` should not be empty")
+        values = {param: value for param, value in self.check_params(
+            {**params, "id": ids[0]}).items() if param != "id"}
+        for curr_id in ids:
+            if not PARAM_PATTERNS["id"].fullmatch(str(curr_id)):
+                raise ValueError(f"Invalid value `{curr_id}` for `id` in query `{self.name}`")
+        values["_ids"] = " ".join(f"wd:{curr_id}" for curr_id in ids)
+        if labels is None:
+            labels = SPARQL_LABELS == "service"
+        return self._rendered(
+            self._join(self.batch_parts if labels else self.bare_batch_parts, values),
+            self.batch_variables, self.bare_batch_variables,
+            {**params, "_ids": ids, "_batch_var": self.batch_var}, labels)
+
+    def __call__(self, value=None, lang: str = "en", labels: bool = None) -> RenderedQuery:
+        params = dict(value) if isinstance(value, dict) else {"id": value}
+        return self.render(**params, lang=lang, labels=labels)
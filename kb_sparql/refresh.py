@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental refresh of the collected events and of their outgoing links
+
+The revision ID (`lastrevid`) of each event is stored with the tables of a collection
+(<folder>/revisions.json). A refresh checks the current revisions in bulk
+(`wbgetentities` with props=info, 50 IDs per call), and only the outgoing links of new
+or edited events are retrieved again and merged into the stored table.
+Events themselves are found by the collection queries, which are run again
+(one UNION query with `combined`, cf. gather_events.py).
+
+Rows added and removed by the last refresh of each table are saved in
+<folder>/delta_<table>.parquet (`change` column: `added` or `removed`),
+for incremental updates downstream.
+Labels of the objects of unchanged events are not refreshed.
+
+From the root of the repository (events of the app content file):
+python -m kb_sparql.refresh -f data/refresh
+"""
+import os
+import json
+import logging
+import argparse
+from collections import Counter
+
+import requests
+import pandas as pd
+
+from kb_sparql.gather_events import iter_collect_data, build_args_for_collect, \
+    get_clean_output_sparql, FORWARD_LINKS_QUERY, FORWARD_LINKS_COLUMNS, EVENT_COLUMNS
+from kb_sparql.event_table import wd_ids
+from settings.settings import AGENT, WIKIDATA_API
+from narrative.instrumentation import count
+from narrative.mediawiki import get_json
+
+LOGGER = logging.getLogger(__name__)
+
+WD_ENTITY = "http://www.wikidata.org/entity/"
+
+
+class RevisionChecker:
+    """ Current revision ID of Wikidata entities (never cached), None for deleted ones """
+
+    batch_size = 50
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": AGENT})
+        self.stats = Counter()
+
+    def _query_batch(self, ids: list[str]) -> dict[str, int]:
+        """ One API call for up to `batch_size` IDs. Raises if the call failed:
+        a failed check is not an edit """
+        entities = get_json(self.session, WIKIDATA_API, params={
+            "action": "wbgetentities", "props": "info", "ids": "|".join(ids),
+            "format": "json"}, service="wikidata_api").get("entities", dict())
+
+        # redirected IDs are returned with the ID of their target
+        redirects = {entity["redirects"]["from"]: entity_id \
+            for entity_id, entity in entities.items() if "redirects" in entity}
+        return {curr_id: entities.get(redirects.get(curr_id, curr_id), dict()).get("lastrevid") \
+            for curr_id in ids}
+
+    def revisions(self, ids: list[str]) -> dict[str, int]:
+        """ Revision ID of each ID """
+        ids, res = list(dict.fromkeys(ids)), dict()
+        for i in range(0, len(ids), self.batch_size):
+            res.update(self._query_batch(ids[i:i+self.batch_size]))
+        self.stats["checked"] += len(ids)
+        return res
+
+
+def diff_tables(old: pd.core.frame.DataFrame,
+                new: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+    """ Rows of new that are not in old (`added`) and rows of old not in new (`removed`) """
+    columns = list(dict.fromkeys(list(new.columns) + list(old.columns)))
+    old, new = old.reindex(columns=columns), new.reindex(columns=columns)
+    hash_old = pd.util.hash_pandas_object(old.astype(str), index=False).values
+    hash_new = pd.util.hash_pandas_object(new.astype(str), index=False).values
+    added = new[~pd.Series(hash_new).isin(set(hash_old)).values]
+    removed = old[~pd.Series(hash_old).isin(set(hash_new)).values]
+    return pd.concat([added.assign(change="added"), removed.assign(change="removed")],
+                     ignore_index=True)
+
+
+class Refresher:
+    """ Tables of a collection (`events`, `forward_links`) stored in folder,
+    with the revision IDs of the events """
+
+    def __init__(self, folder: str, lang: str = "en", query_type: str = FORWARD_LINKS_QUERY,
+                 checker: RevisionChecker = None):
+        self.folder = folder
+        self.lang = lang
+        self.query_type = query_type
+        self.checker = checker if checker is not None else RevisionChecker()
+        self.revisions_path = os.path.join(folder, "revisions.json")
+        os.makedirs(folder, exist_ok=True)
+
+    def read(self, name: str) -> pd.core.frame.DataFrame:
+        """ Stored table, None if there is none yet """
+        path = os.path.join(self.folder, f"{name}.parquet")
+        return pd.read_parquet(path) if os.path.exists(path) else None
+
+    def _write(self, name: str, df_output: pd.core.frame.DataFrame,
+               delta: pd.core.frame.DataFrame):
+        df_output.to_parquet(os.path.join(self.folder, f"{name}.parquet"), index=False)
+        delta.to_parquet(os.path.join(self.folder, f"delta_{name}.parquet"), index=False)
+
+    def read_revisions(self) -> dict[str, int]:
+        """ Revision ID of each event, when its outgoing links were last retrieved """
+        if not os.path.exists(self.revisions_path):
+            return dict()
+        with open(self.revisions_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def _write_revisions(self, revisions: dict[str, int]):
+        with open(f"{self.revisions_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(revisions, file)
+        os.replace(f"{self.revisions_path}.tmp", self.revisions_path)
+
+    def refresh_events(self, args_collect_list: list[dict], combined: bool = True) \
+            -> tuple[pd.core.frame.DataFrame, pd.core.frame.DataFrame]:
+        """ Running the collection queries again, returns the events and their delta """
+        dfs = list(iter_collect_data(args_collect_list, combined=combined))
+        events = pd.concat(dfs).drop_duplicates() if dfs else pd.DataFrame(
+            columns=EVENT_COLUMNS + (["query_type"] if combined else list()))
+        old = self.read("events")
+        delta = diff_tables(old if old is not None else pd.DataFrame(), events)
+        self._write("events", events, delta)
+        LOGGER.info("Events: %s rows, %s added, %s removed", events.shape[0],
+                    (delta.change == "added").sum(), (delta.change == "removed").sum())
+        return events, delta
+
+    def refresh_forward_links(self, events: list[str]) \
+            -> tuple[pd.core.frame.DataFrame, pd.core.frame.DataFrame]:
+        """ Outgoing links of events (Wikidata urls or IDs), only retrieved for new events and
+        events edited since the last refresh. Returns all the links and their delta.
+        If the revisions cannot be checked, the refresh fails before any change """
+        ids = list(dict.fromkeys(wd_ids(events)))
+        stored, current = self.read_revisions(), self.checker.revisions(ids)
+        new = [curr_id for curr_id in ids if curr_id not in stored]
+        changed = [curr_id for curr_id in ids \
+            if curr_id in stored and current[curr_id] != stored[curr_id]]
+        removed = [curr_id for curr_id in stored if curr_id not in current]
+        count("refreshed", len(new) + len(changed), service="refresh")
+
+        old = self.read("forward_links")
+        if old is None:
+            old = pd.DataFrame(columns=FORWARD_LINKS_COLUMNS)
+        dfs = [get_clean_output_sparql(curr_id, lang=self.lang, query_type=self.query_type) \
+            [FORWARD_LINKS_COLUMNS] for curr_id in new + changed]
+        fetched = pd.concat(dfs, ignore_index=True) if dfs else \
+            pd.DataFrame(columns=FORWARD_LINKS_COLUMNS)
+
+        replaced = old.wd_page.isin([f"{WD_ENTITY}{curr_id}" for curr_id in changed + removed])
+        links = pd.concat([df for df in [old[~replaced], fetched] if df.shape[0] > 0],
+                          ignore_index=True) if (~replaced).any() or fetched.shape[0] > 0 \
+            else pd.DataFrame(columns=FORWARD_LINKS_COLUMNS)
+        links = links.astype({"predicate": "category"})
+        delta = diff_tables(old[replaced], fetched)
+        self._write("forward_links", links, delta)
+        self._write_revisions({curr_id: current[curr_id] for curr_id in ids})
+        LOGGER.info("Outgoing links: %s events, %s new, %s edited, %s removed, " + \
+            "%s rows added, %s removed", len(ids), len(new), len(changed), len(removed),
+                    (delta.change == "added").sum(), (delta.change == "removed").sum())
+        return links, delta
+
+
+if __name__ == '__main__':
+    from narrative.pipeline import get_config
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--folder", required=True,
+                    help="folder of the stored tables, revision IDs and deltas")
+    ap.add_argument("-yb", "--year_begin", default=None, help="start of the year range")
+    ap.add_argument("-ye", "--year_end", default=None, help="end of the year range")
+    ap.add_argument("-l", "--lang", default="en", help="language of the labels")
+    ap.add_argument("-s", "--separate", action="store_true",
+                    help="one collection query per query type instead of one UNION query")
+    ARGS = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    CONFIG = get_config(year_begin=ARGS["year_begin"], year_end=ARGS["year_end"])
+    REFRESHER = Refresher(folder=ARGS["folder"], lang=ARGS["lang"])
+    EVENTS, _ = REFRESHER.refresh_events(build_args_for_collect(
+        [(CONFIG["path_for_event"][path]["id"], CONFIG["path_for_event"][path]["query_type"],
+          CONFIG["year_begin"], CONFIG["year_end"]) for path in CONFIG["paths"]],
+        lang=ARGS["lang"]), combined=not ARGS["separate"])
+    if EVENTS.shape[0] > 0:
+        REFRESHER.refresh_forward_links(list(EVENTS[CONFIG["col_wikidata"]].unique()))
@@ -1,35 +1,52 @@
 # -*- coding: utf-8 -*-
 """ Querying KG with SPARQL queries """
+import os
 import re
+import json
+import socket
+import hashlib
+import logging
 import argparse
+from urllib.error import HTTPError, URLError
 import pandas as pd
 from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
 
 from kb_sparql.query_db import SPARQL_QUERIES
-from settings.settings import AGENT
+from kb_sparql.query_template import RenderedQuery, PROJECTION
+from kb_sparql.sparql_results import get_col_to_keep, query_df
+from kb_sparql.dump_backend import DUMP_QUERIES, get_index
+from kb_sparql.labels import fill_labels
+from kb_sparql.event_table import wd_ids
+from settings.settings import AGENT, WIKIDATA_SPARQL_ENDPOINT, SPARQL_DECODER, \
+    SPARQL_PAGE_SIZE, SPARQL_MIN_PAGE_SIZE, SPARQL_MAX_ROWS, SPARQL_PAGE_TIMEOUT, DUMP_INDEX
+from narrative.instrumentation import span, count
 
+LOGGER = logging.getLogger(__name__)
 
-def run_query_return_df(query: str, sparql_endpoint: str = \
-        "https://query.wikidata.org/sparql") -> pd.core.frame.DataFrame:
+
+def run_query_return_df(query: str, sparql_endpoint: str = WIKIDATA_SPARQL_ENDPOINT,
+                        timeout: int = None) -> pd.core.frame.DataFrame:
     """ Executing input SPARQL query
     and returning results in dataframe format """
     sparql = SPARQLWrapper(sparql_endpoint,
                            agent=AGENT)
     sparql.setQuery(query)
     sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    if timeout:
+        sparql.setTimeout(timeout)
+    with span("request", service="sparql"):
+        count("requests", service="sparql")
+        try:
+            body = sparql.query().response.read()
+        except Exception:
+            count("errors", service="sparql")
+            raise
+    count("bytes", len(body), service="sparql")
+    results = json.loads(body)
     return pd.json_normalize(results['results']['bindings'])
 
 
-def get_col_to_keep(query: str) -> list[str]:
-    """ Retrieving columns to keep from sparql query output in DataFrame format format """
-    pattern = "SELECT (.+?) ({|WHERE)"
-    matches = re.search(pattern, query.replace("\n", " "))
-    if not matches:
-        raise ValueError(("Problem with the query"))
-    return [elt.strip() for elt in matches.group(1).split("?") if elt != '']
-
-
 def process_df(df_input: pd.core.frame.DataFrame, query:str) -> pd.core.frame.DataFrame:
     """ Cleaning DataFrame output of sparql query
     1. Only keeping columns specified in sparql query
@@ -40,14 +57,172 @@ def process_df(df_input: pd.core.frame.DataFrame, query:str) -> pd.core.frame.Da
     return df_input[[col for col in cols if col in df_input.columns]]
 
 
-def get_output_sparql(query:str, clean_df:bool = 1, save_path:str = None):
+def run_query_clean_df(query: str, decoder: str = SPARQL_DECODER,
+                       timeout: int = None) -> pd.core.frame.DataFrame:
+    """ Output of `process_df`, decoded directly with typed columns if decoder is `typed`
+    (cf. sparql_results.py), from `run_query_return_df` if `json`.
+    Queries of SPARQL_QUERIES are answered from the dump index if DUMP_INDEX is set,
+    labels of queries rendered with `labels=False` are filled by `fill_labels` (cf. labels.py) """
+    if decoder not in ["typed", "json"]:
+        raise ValueError("`decoder` should be either `typed` or `json`")
+    if DUMP_INDEX and getattr(query, "name", None) in DUMP_QUERIES:
+        return get_index(DUMP_INDEX).run_query_clean_df(query)
+    if decoder == "typed":
+        return fill_labels(query_df(query, timeout=timeout), query)
+    return fill_labels(process_df(run_query_return_df(query, timeout=timeout), query), query)
+
+
+def get_order_variables(query: str) -> list[str]:
+    """ Variables ordering the results of query: its projected variables, the variable of
+    each label (`?x` for `?xLabel`, if bound in the query) instead of the label """
+    variables, res = get_col_to_keep(query), list()
+    body = query[PROJECTION.search(query).end(1):]
+    for var in variables:
+        if var.endswith("Label"):
+            var = var[:-len("Label")]
+            if not re.search(rf"\?{var}\b", body):
+                continue
+        if var not in res:
+            res.append(var)
+    return res
+
+
+def paginate_query(query: str, limit: int, offset: int) -> str:
+    """ Window of query. Windows are stable if the query is ordered:
+    without ORDER BY, results are ordered by `get_order_variables` """
+    if re.search(r"\bLIMIT\s+\d+", query, re.IGNORECASE):
+        raise ValueError("Paginated queries should not have a LIMIT")
+    text = query.rstrip()
+    if not re.search(r"\bORDER\s+BY\b", text, re.IGNORECASE):
+        variables = get_order_variables(query)
+        if not variables:
+            raise ValueError("Paginated queries without ORDER BY should project a variable " + \
+                "bound in the query, or the label of one")
+        text += " ORDER BY " + " ".join(f"?{var}" for var in variables)
+    text = f"{text} LIMIT {limit} OFFSET {offset}"
+    if isinstance(query, RenderedQuery):
+        return RenderedQuery(text, query.variables, name=query.name,
+                             params={**query.params, "_limit": limit, "_offset": offset})
+    return text
+
+
+def is_timeout(error: Exception) -> bool:
+    """ Query stopped by the endpoint (e.g. 60 s on the public one) or by the client """
+    if isinstance(error, HTTPError):
+        return error.code in [500, 502, 504]
+    if isinstance(error, URLError):
+        return isinstance(error.reason, (socket.timeout, TimeoutError))
+    if isinstance(error, EndPointInternalError):  # HTTP 500, with the Java exception
+        return "timeout" in str(error).lower()
+    return isinstance(error, (socket.timeout, TimeoutError))
+
+
+def iter_query_pages(query: str, page_size: int = SPARQL_PAGE_SIZE, offset: int = 0,
+                     max_rows: int = SPARQL_MAX_ROWS, min_page_size: int = SPARQL_MIN_PAGE_SIZE,
+                     decoder: str = SPARQL_DECODER, timeout: int = SPARQL_PAGE_TIMEOUT):
+    """ Running query in LIMIT/OFFSET windows from offset, yielding (offset, page) tuples.
+    The page size is halved when a page times out (down to min_page_size) and
+    doubled back (up to page_size) after 3 pages without timeout.
+    Stops at the last page or when max_rows rows (offset included) were retrieved """
+    curr_size, successes = page_size, 0
+    while offset < max_rows:
+        limit = min(curr_size, max_rows - offset)
+        try:
+            page = run_query_clean_df(paginate_query(query, limit, offset),
+                                      decoder=decoder, timeout=timeout)
+        except Exception as error:
+            if not is_timeout(error) or curr_size <= min_page_size:
+                raise
+            count("timeouts", service="sparql")
+            count("retries", service="sparql")
+            curr_size, successes = max(curr_size // 2, min_page_size), 0
+            LOGGER.warning("Page at offset %s timed out, retrying with %s rows", offset, curr_size)
+            continue
+
+        if page.shape[0] > 0:
+            yield offset, page
+        offset += page.shape[0]
+        if page.shape[0] < limit:
+            return
+        successes += 1
+        if successes >= 3 and curr_size < page_size:
+            curr_size, successes = min(curr_size * 2, page_size), 0
+    LOGGER.warning("Row cap reached (%s rows), remaining results were not retrieved", max_rows)
+
+
+def run_query_paginated(query: str, **kwargs) -> pd.core.frame.DataFrame:
+    """ All pages of query in one DataFrame (kwargs: cf. `iter_query_pages`) """
+    pages = [page for _, page in iter_query_pages(query, **kwargs)]
+    if not pages:
+        return pd.DataFrame()
+    df_output = pd.concat(pages, ignore_index=True)
+    variables = getattr(query, "params", dict()).get("_variables") or get_col_to_keep(query)
+    return df_output[[col for col in variables if col in df_output.columns]]
+
+
+def save_query_pages(query: str, folder: str, **kwargs) -> list[str]:
+    """ Streaming the pages of query to Parquet files in folder (kwargs: cf. `iter_query_pages`).
+    The offset is saved after each page: an interrupted run on the same query resumes
+    from the last saved page. Returns the paths of the pages """
+    os.makedirs(folder, exist_ok=True)
+    state_path = os.path.join(folder, "state.json")
+    query_hash = hashlib.sha256(str(query).encode()).hexdigest()
+    state = dict()
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as file:
+            state = json.load(file)
+    if state.get("query") != query_hash:
+        for page in state.get("pages", list()):
+            if os.path.exists(os.path.join(folder, page)):
+                os.remove(os.path.join(folder, page))
+        state = {"query": query_hash, "offset": 0, "pages": list(), "done": False}
+
+    def save_state():
+        with open(f"{state_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=4)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    if not state["done"]:
+        for offset, page in iter_query_pages(query, offset=state["offset"], **kwargs):
+            name = f"page_{offset:09d}.parquet"
+            page.to_parquet(os.path.join(folder, name), index=False)
+            state["pages"].append(name)
+            state["offset"] = offset + page.shape[0]
+            save_state()
+        state["done"] = True
+        save_state()
+    return [os.path.join(folder, page) for page in state["pages"]]
+
+
+def read_query_pages(folder: str) -> pd.core.frame.DataFrame:
+    """ Pages saved by `save_query_pages` in one DataFrame """
+    with open(os.path.join(folder, "state.json"), encoding="utf-8") as file:
+        pages = json.load(file)["pages"]
+    if not pages:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(os.path.join(folder, page)) for page in pages],
+                     ignore_index=True)
+
+
+def get_output_sparql(query:str, clean_df:bool = 1, save_path:str = None,
+                      decoder: str = SPARQL_DECODER, page_size: int = None,
+                      pages_folder: str = None):
     """ Running SPARQL query, getting dataframe output and
     1. Clean it if clean_df
-    2. Save it if save_path """
-    df_f = run_query_return_df(query)
+    2. Save it if save_path
+    With page_size, the query is run in windows of page_size rows (always cleaned),
+    streamed to pages_folder if given """
+    if pages_folder:
+        save_query_pages(query, pages_folder, page_size=page_size or SPARQL_PAGE_SIZE,
+                         decoder=decoder)
+        df_f = read_query_pages(pages_folder)
+    elif page_size:
+        df_f = run_query_paginated(query, page_size=page_size, decoder=decoder)
+    else:
+        df_f = run_query_clean_df(query, decoder=decoder) if clean_df else \
+            run_query_return_df(query)
     if df_f.shape[0] == 0:
         return None
-    df_f = process_df(df_f, query) if clean_df else df_f
     if save_path:
         df_f.to_csv(save_path)
     return df_f
@@ -59,6 +234,9 @@ def check_args(args: dict):
         raise ValueError("Query type currently not handled, please retry. " + \
             "Queries types are the keys in the SPARQL_QUERIES dictionnary.")
 
+    if args.get("pages_folder") and not args["id"]:
+        raise ValueError("`pages_folder` can only be used with `id`")
+
     if args['clean_df'] not in ['0', '1', 0, 1]:
         raise ValueError("Please check your argument, should be 1 or 0")
 
@@ -76,9 +254,12 @@ def check_args(args: dict):
 def main(args):
     """ Main func when executing script """
     if args["id"]:  # Running one SPARQL query type from one ID
-        df_output = get_output_sparql(query=SPARQL_QUERIES[args['query_type']](args['id']),
+        df_output = get_output_sparql(query=SPARQL_QUERIES[args['query_type']](
+                                          args['id'], lang=args.get("lang", "en")),
                                       clean_df=int(args["clean_df"]),
-                                      save_path=args["save_path"])
+                                      save_path=args["save_path"],
+                                      page_size=args.get("page_size"),
+                                      pages_folder=args.get("pages_folder"))
         if isinstance(df_output, pd.DataFrame):
             df_output['query_type'] = args['query_type']
 
@@ -87,14 +268,13 @@ def main(args):
         if df_path.shape[0] == 0:
             raise ValueError(("csv should not be empty"))
 
-        ids = df_path[args["column"]]
-        if ids[0].startswith("http"):
-            ids = [x.split("/")[-1] for x in ids]
+        ids = wd_ids(df_path[args["column"]])
 
         df_output = None
 
         for curr_id in ids:
-            curr_df = get_output_sparql(query=SPARQL_QUERIES[args['query_type']](curr_id))
+            curr_df = get_output_sparql(query=SPARQL_QUERIES[args['query_type']](
+                curr_id, lang=args.get("lang", "en")), page_size=args.get("page_size"))
             if isinstance(curr_df, pd.DataFrame):
                 df_output = pd.concat([df_output, curr_df]) \
                     if isinstance(df_output, pd.DataFrame) else curr_df
@@ -124,6 +304,14 @@ if __name__ == '__main__':
                     help="whether to clean or not the sparqlwrapper output")
     ap.add_argument("-s", '--save_path', default=None,
                     help="if not None, path to store the df to, must be a .csv file")
+    ap.add_argument("-l", '--lang', default="en",
+                    help="language of the labels, e.g. `en` or `fr`")
+    ap.add_argument("-ps", '--page_size', default=None, type=int,
+                    help="if given, the query is run in windows of page_size rows " + \
+                        "(e.g. incoming links of a hub entity)")
+    ap.add_argument("-pf", '--pages_folder', default=None,
+                    help="if given (with `id`), pages are saved in this folder as they " + \
+                        "are retrieved, an interrupted run resumes from the last page")
     ARGS = vars(ap.parse_args())
 
     check_args(args=ARGS)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Decoding SPARQL results directly into the columns of the query projection
+(the `value` of each binding, same output as `process_df` in sparql_query.py), with dtypes:
+- DATE_VARIABLES: datetime64 in UTC. Dates that cannot be datetimes (BCE, or out of the
+  pandas range, e.g. before 1677) keep their xsd:dateTime string, in an object column
+- CATEGORICAL_VARIABLES: category
+- other variables: strings, NaN when unbound
+
+Results are requested as CSV (no per-value type/language to decode and drop).
+JSON results (e.g. endpoints ignoring the Accept header) are read binding by binding,
+without `pd.json_normalize`.
+"""
+import io
+import json
+import pandas as pd
+from SPARQLWrapper import SPARQLWrapper, CSV
+
+from kb_sparql.query_template import RenderedQuery, get_projection
+from settings.settings import AGENT, WIKIDATA_SPARQL_ENDPOINT
+from narrative.instrumentation import span, count
+
+DATE_VARIABLES = {"pointintime", "start", "end", "inception", "dissolved"}
+CATEGORICAL_VARIABLES = {"wd", "wdLabel"}
+
+
+def get_col_to_keep(query: str) -> list[str]:
+    """ Retrieving columns to keep from sparql query output in DataFrame format format
+    (known without parsing for queries rendered from a template, cf. query_template.py) """
+    if isinstance(query, RenderedQuery):
+        return list(query.variables)
+    return list(get_projection(query))
+
+
+def _parse_date(value):
+    """ Timestamp in UTC, the value itself if it cannot be one """
+    if isinstance(value, pd.Timestamp):
+        return value
+    if not isinstance(value, str) or value == "":
+        return pd.NaT
+    if value.startswith("-"):  # BCE
+        return value
+    try:
+        timestamp = pd.Timestamp(value)
+    except (ValueError, OverflowError):
+        return value
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None \
+        else timestamp.tz_convert("UTC")
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """ xsd:dateTime values -> datetime64 in UTC. If some dates cannot be datetimes,
+    values are parsed one by one into an object column: Timestamps, and the raw strings
+    of the other dates (never NaT, not to be mistaken for missing dates) """
+    if not values.astype(str).str.startswith("-").any():
+        try:
+            return pd.to_datetime(values, utc=True)
+        except (ValueError, OverflowError):  # incl. OutOfBoundsDatetime
+            pass
+    return pd.Series([_parse_date(value) for value in values], index=values.index,
+                     dtype=object)
+
+
+def apply_dtypes(df_input: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+    """ Datetime and categorical columns, in place """
+    for col in df_input.columns:
+        if col in DATE_VARIABLES:
+            df_input[col] = parse_dates(df_input[col])
+        elif col in CATEGORICAL_VARIABLES:
+            df_input[col] = df_input[col].astype("category")
+    return df_input
+
+
+def _keep_bound(df_input: pd.core.frame.DataFrame, variables: list[str]) \
+        -> pd.core.frame.DataFrame:
+    """ Variables bound at least once, in projection order (as `process_df`) """
+    return apply_dtypes(df_input[[col for col in variables \
+        if col in df_input.columns and df_input[col].notna().any()]].copy())
+
+
+def from_csv(body: bytes, variables: list[str]) -> pd.core.frame.DataFrame:
+    """ DataFrame from SPARQL CSV results """
+    if not body.strip():
+        return pd.DataFrame()
+    df_output = pd.read_csv(io.BytesIO(body), dtype=object, keep_default_na=False,
+                            na_values=[""], usecols=lambda col: col in variables)
+    return _keep_bound(df_output, variables)
+
+
+def from_json(results: dict, variables: list[str]) -> pd.core.frame.DataFrame:
+    """ DataFrame from SPARQL JSON results """
+    bindings = results["results"]["bindings"]
+    df_output = pd.DataFrame(
+        {var: [binding[var]["value"] if var in binding else None for binding in bindings] \
+            for var in variables}, dtype=object)
+    return _keep_bound(df_output, variables)
+
+
+def query_df(query: str, sparql_endpoint: str = WIKIDATA_SPARQL_ENDPOINT,
+             timeout: int = None) -> pd.core.frame.DataFrame:
+    """ Executing input SPARQL query, decoded results (timeout: client side, in s) """
+    sparql = SPARQLWrapper(sparql_endpoint, agent=AGENT)
+    sparql.setQuery(query)
+    sparql.setReturnFormat(CSV)
+    if timeout:
+        sparql.setTimeout(timeout)
+    with span("request", service="sparql"):
+        count("requests", service="sparql")
+        try:
+            response = sparql.query().response
+            body = response.read()
+        except Exception:
+            count("errors", service="sparql")
+            raise
+    count("bytes", len(body), service="sparql")
+    variables = get_col_to_keep(query)
+    if "json" in (response.headers.get("Content-Type") or ""):
+        return from_json(json.loads(body), variables)
+    return from_csv(body, variables)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache for the outputs of the pipeline stages
+
+Each entry is stored under a key derived from the hashes of the stage inputs,
+its parameters and its code version, in an efficient format:
+- `table` (DataFrame): Parquet, loaded memory-mapped
+- `json` (dict): gzip-compressed json
+- `graph` (rdflib graph): gzip-compressed Turtle
+
+Command line, from the root of the repository:
+python -m narrative.artifacts list
+python -m narrative.artifacts inspect <key or key prefix>
+python -m narrative.artifacts gc --max_age_days 30 --max_size_mb 2000
+(entries of the last pipeline run are never garbage-collected)
+"""
+import os
+import io
+import gzip
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import tempfile
+import argparse
+
+import pandas as pd
+
+from settings.settings import CACHE_FOLDER, PIPELINE_FOLDER
+
+ARTIFACT_FOLDER = os.path.join(CACHE_FOLDER, "artifacts")
+
+KIND_TO_FILE = {"table": "data.parquet", "json": "data.json.gz", "graph": "data.ttl.gz"}
+
+
+def hash_json(value) -> str:
+    """ sha256 of a json-serializable value, independent of key order """
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def hash_table(df_input: pd.core.frame.DataFrame) -> str:
+    """ sha256 of a DataFrame content, independent of the column order """
+    sha = hashlib.sha256()
+    for col in sorted(df_input.columns, key=str):
+        try:
+            values = pd.util.hash_pandas_object(df_input[col], index=False).values
+        except TypeError:  # unhashable values (e.g. lists)
+            values = pd.util.hash_pandas_object(df_input[col].astype(str), index=False).values
+        sha.update(str(col).encode())
+        sha.update(values.tobytes())
+    return sha.hexdigest()
+
+
+def hash_graph(graph) -> str:
+    """ sha256 of the sorted N-Triples serialization of graph """
+    lines = sorted(graph.serialize(format="nt").splitlines())
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+def hash_value(value, kind: str) -> str:
+    """ Content hash of a stage output """
+    if kind == "table":
+        return hash_table(value)
+    if kind == "graph":
+        return hash_graph(value)
+    return hash_json(value)
+
+
+class ArtifactCache:
+    """ One folder per entry (<folder>/<key[:2]>/<key>/) with the data file and a meta.json """
+
+    def __init__(self, folder: str = ARTIFACT_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(**inputs) -> str:
+        """ Cache key from anything json-serializable
+        (e.g. stage name, code version, parameters, input hashes) """
+        return hash_json(inputs)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key)
+
+    def __contains__(self, key: str):
+        return os.path.exists(os.path.join(self._entry(key), "meta.json"))
+
+    def meta(self, key: str) -> dict:
+        """ Metadata of an entry """
+        with open(os.path.join(self._entry(key), "meta.json"), encoding="utf-8") as file:
+            return json.load(file)
+
+    def _write_meta(self, key: str, meta: dict):
+        # unique temporary file: concurrent readers of an entry update its meta.json
+        entry = self._entry(key)
+        fd, tmp = tempfile.mkstemp(prefix="meta.json.", suffix=".tmp", dir=entry)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(meta, file, indent=4, default=str)
+            os.replace(tmp, os.path.join(entry, "meta.json"))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def put(self, key: str, value, kind: str, **info) -> dict:
+        """ Storing value (overwriting any previous entry), returns its metadata """
+        if kind not in KIND_TO_FILE:
+            raise ValueError(f"Artifact kind should be one of {list(KIND_TO_FILE)}")
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f"{key}.tmp", dir=os.path.dirname(entry))
+
+        filename = KIND_TO_FILE[kind]
+        if kind == "table":
+            try:
+                value.to_parquet(os.path.join(tmp, filename), index=False)
+            except Exception:  # columns pyarrow cannot convert (e.g. mixed types)
+                filename = "data.pkl.gz"
+                with gzip.open(os.path.join(tmp, filename), "wb") as file:
+                    pickle.dump(value, file)
+        elif kind == "json":
+            with gzip.open(os.path.join(tmp, filename), "wt", encoding="utf-8") as file:
+                json.dump(value, file, default=str)
+        else:
+            with gzip.open(os.path.join(tmp, filename), "wt", encoding="utf-8") as file:
+                file.write(value.serialize(format="turtle"))
+
+        now = time.time()
+        meta = dict(info, key=key, kind=kind, file=filename, hash=hash_value(value, kind),
+                    size=os.path.getsize(os.path.join(tmp, filename)),
+                    created=now, last_access=now)
+        for attempt in range(3):  # another writer may recreate the entry in between
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.replace(tmp, entry)
+                break
+            except OSError:
+                if attempt == 2:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    raise
+        self._write_meta(key, meta)
+        return meta
+
+    def get(self, key: str):
+        """ Stored value, None if key is not in cache """
+        if key not in self:
+            return None
+        meta = self.meta(key)
+        path = os.path.join(self._entry(key), meta["file"])
+        meta["last_access"] = time.time()
+        try:  # best effort, e.g. the entry is being overwritten
+            self._write_meta(key, meta)
+        except OSError:
+            pass
+
+        if meta["file"].endswith(".parquet"):
+            import pyarrow.parquet as pq
+            return pq.read_table(path, memory_map=True).to_pandas()
+        if meta["file"].endswith(".pkl.gz"):
+            with gzip.open(path, "rb") as file:
+                return pickle.load(file)
+        if meta["kind"] == "json":
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                return json.load(file)
+        from graph_building.converter import init_graph
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return init_graph().parse(io.StringIO(file.read()), format="turtle")
+
+    def entries(self) -> list[dict]:
+        """ Metadata of all entries, most recently used first """
+        res = list()
+        for prefix in os.listdir(self.folder):
+            if not os.path.isdir(os.path.join(self.folder, prefix)):
+                continue
+            for key in os.listdir(os.path.join(self.folder, prefix)):
+                if ".tmp" not in key and key in self:
+                    res.append(self.meta(key))
+        return sorted(res, key=lambda meta: meta["last_access"], reverse=True)
+
+    def remove(self, key: str):
+        """ Removing one entry """
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def gc(self, max_age_days: float = None, max_size_mb: float = None,
+           keep: set[str] = None) -> list[str]:
+        """ Removing entries not used for max_age_days, then least recently used ones
+        until the cache is under max_size_mb. Keys in keep are never removed """
+        keep, removed, total = keep or set(), list(), 0
+        now = time.time()
+        for meta in self.entries():
+            too_old = max_age_days is not None and \
+                now - meta["last_access"] > max_age_days * 86400
+            too_big = max_size_mb is not None and \
+                total + meta["size"] > max_size_mb * 1024 * 1024
+            if meta["key"] not in keep and (too_old or too_big):
+                self.remove(meta["key"])
+                removed.append(meta["key"])
+            else:
+                total += meta["size"]
+        return removed
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("action", choices=["list", "inspect", "gc"],
+                    help="`list` entries, `inspect` one entry, `gc` to remove old/large entries")
+    ap.add_argument("key", nargs="?", default=None, help="key (or key prefix) for `inspect`")
+    ap.add_argument("-f", "--folder", default=ARTIFACT_FOLDER, help="cache folder")
+    ap.add_argument("-a", "--max_age_days", default=None, type=float,
+                    help="for `gc`, remove entries not used for this number of days")
+    ap.add_argument("-m", "--max_size_mb", default=None, type=float,
+                    help="for `gc`, remove least recently used entries above this size")
+    ap.add_argument("-p", "--pipeline_folder", default=PIPELINE_FOLDER,
+                    help="for `gc`, entries of the last pipeline run in this folder are kept")
+    ARGS = vars(ap.parse_args())
+
+    CACHE = ArtifactCache(folder=ARGS["folder"])
+    if ARGS["action"] == "list":
+        for META in CACHE.entries():
+            print(f"{META['key'][:12]}  {META.get('stage', ''):<20} {META['kind']:<6} " + \
+                f"{META['size']/1024:>10.1f} kB  " + \
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(META['last_access'])))
+    elif ARGS["action"] == "inspect":
+        if not ARGS["key"]:
+            raise ValueError("`inspect` requires a key")
+        for META in [meta for meta in CACHE.entries() if meta["key"].startswith(ARGS["key"])]:
+            print(json.dumps(META, indent=4, default=str))
+            VALUE = CACHE.get(META["key"])
+            if META["kind"] == "table":
+                print(VALUE.dtypes, VALUE.head(), sep="\n")
+            elif META["kind"] == "graph":
+                print(f"{len(VALUE)} triples")
+            else:
+                print(json.dumps(VALUE, indent=4, default=str)[:2000])
+    else:
+        KEEP = set()
+        if os.path.exists(os.path.join(ARGS["pipeline_folder"], "manifest.json")):
+            with open(os.path.join(ARGS["pipeline_folder"], "manifest.json"),
+                      encoding="utf-8") as FILE:
+                KEEP = {info["key"] for info in json.load(FILE).values()}
+        REMOVED = CACHE.gc(max_age_days=ARGS["max_age_days"], max_size_mb=ARGS["max_size_mb"],
+                           keep=KEEP)
+        print(f"Removed {len(REMOVED)} entries")
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Cache decorator of the library modules, independent of the front-end
+
+`@cached(**kwargs)` resolves its backend at the first call:
+- `streamlit`: `st.cache(**kwargs)` (kwargs are the ones of `st.cache`)
+- `memory`: results kept in the process, keyed by the pickled arguments
+(calls with unpicklable arguments are not cached)
+- `none`: no caching
+Backend from NARRATIVE_CACHE_BACKEND (cf. settings/settings.py), `auto` by default:
+`streamlit` if streamlit is already imported (i.e. in the app), else `none`.
+Other backends can be added with `register_backend`.
+"""
+import sys
+import pickle
+import hashlib
+import threading
+from functools import wraps
+
+from settings.settings import CACHE_BACKEND
+
+BACKENDS = dict()
+
+
+def register_backend(name: str, decorator):
+    """ decorator(func, **kwargs) -> cached version of func """
+    BACKENDS[name] = decorator
+
+
+def _no_cache(func, **kwargs):
+    return func
+
+
+def _streamlit_cache(func, **kwargs):
+    import streamlit as st
+    return st.cache(**kwargs)(func)
+
+
+def _memory_cache(func, **kwargs):
+    results, lock = dict(), threading.Lock()
+
+    @wraps(func)
+    def wrapper(*args, **kw):
+        try:
+            key = hashlib.sha256(pickle.dumps((args, sorted(kw.items())))).hexdigest()
+        except Exception:  # unpicklable arguments
+            return func(*args, **kw)
+        with lock:
+            if key in results:
+                return results[key]
+        res = func(*args, **kw)
+        with lock:
+            results[key] = res
+        return res
+    return wrapper
+
+
+register_backend("none", _no_cache)
+register_backend("streamlit", _streamlit_cache)
+register_backend("memory", _memory_cache)
+
+
+def get_backend_name() -> str:
+    """ Backend used by functions decorated from now on (first call) """
+    if CACHE_BACKEND != "auto":
+        return CACHE_BACKEND
+    return "streamlit" if "streamlit" in sys.modules else "none"
+
+
+def cached(**kwargs):
+    """ Decorator, kwargs are passed to the backend (e.g. `show_spinner` for streamlit) """
+    def decorator(func):
+        state = dict()
+
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if "func" not in state:
+                name = get_backend_name()
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown cache backend `{name}`, " + \
+                        f"backends are: {list(BACKENDS)}")
+                state["func"] = BACKENDS[name](func, **kwargs)
+            return state["func"](*args, **kw)
+        return wrapper
+    return decorator
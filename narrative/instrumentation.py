@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight tracing and metrics: spans (stages, network calls), counters
+(requests, bytes, cache hits/misses, errors, retries) and latency histograms.
+
+Off by default, switched on with NARRATIVE_TRACE=1 (cf. settings/settings.py).
+When off, `span` returns a shared no-op context manager and `count`/`observe` return
+immediately.
+
+Metrics recorded in `multiprocessing` workers are sent back with the results,
+cf. `worker_call` and `merge_worker`.
+
+Export: `export_json` (Chrome trace event format, opens in chrome://tracing or
+https://ui.perfetto.dev) and `to_prometheus` (Prometheus text format).
+"""
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter, deque, defaultdict
+from contextlib import nullcontext
+from functools import wraps
+
+from settings.settings import TRACE
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")]
+
+# Counters of each stage in `stage_breakdown`
+BREAKDOWN_COUNTERS = ["requests", "bytes", "cache_hits", "cache_misses", "errors", "retries"]
+
+NO_SPAN = nullcontext()
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class SpanStacks(threading.local):
+    """ Open spans of each thread """
+
+    def __reduce__(self):
+        # `st.cache` hashes the objects reachable from cached functions
+        return (SpanStacks, ())
+
+
+class Span:
+    """ One timed operation. Counters recorded while it is open (in its thread,
+    including the ones of workers merged in that time) are also kept in `counters` """
+
+    def __init__(self, tracer, name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.counters = Counter()
+        self.start = self.duration = None
+        self.parent = None
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.tracer.stack().pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.end_span(self)
+        return False
+
+    def to_dict(self) -> dict:
+        """ Finished span, json-serializable """
+        return {"name": self.name, "attrs": self.attrs, "counters": dict(self.counters),
+                "start": self.tracer.origin + self.start, "duration": self.duration,
+                "parent": self.parent, "pid": os.getpid(), "tid": threading.get_ident()}
+
+
+class Tracer:
+    """ Spans, counters and histograms of the current process.
+    The last `max_spans` spans are kept, counters and histograms are cumulative """
+
+    def __init__(self, enabled: bool = TRACE, max_spans: int = 100000):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self._local = SpanStacks()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __reduce__(self):
+        # Recorded data is per process, only the configuration is pickled
+        # (also makes functions using the tracer hashable by `st.cache`)
+        return (Tracer, (self.enabled, self.max_spans))
+
+    def reset(self):
+        """ Removing everything recorded so far """
+        with self._lock:
+            self.pid = os.getpid()
+            # epoch time of perf_counter() == 0, to put spans of all processes on the same axis
+            self.origin = time.time() - time.perf_counter()
+            self.spans = deque(maxlen=self.max_spans)
+            self.counters = Counter()
+            self.histograms = defaultdict(lambda: [0] * len(BUCKETS) + [0.0])
+
+    def _check_fork(self):
+        """ A forked worker starts with a copy of the parent's data, not recorded by it """
+        if self.pid != os.getpid():
+            self._local = SpanStacks()
+            self.reset()
+
+    def stack(self) -> list[Span]:
+        """ Open spans of the current thread """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = list()
+        return stack
+
+    def span(self, name: str, **attrs):
+        """ Context manager timing the enclosed block """
+        if not self.enabled:
+            return NO_SPAN
+        self._check_fork()
+        return Span(self, name, attrs)
+
+    def end_span(self, span: Span):
+        """ Storing a finished span and its latency """
+        self.observe(f"{span.name}_seconds", span.duration, **{
+            k: v for k, v in span.attrs.items() if k in ["stage", "service"]})
+        with self._lock:
+            self.spans.append(span.to_dict())
+
+    def count(self, name: str, value: float = 1, **labels):
+        """ Incrementing counter name (e.g. `requests`, `bytes`, `cache_hits`) """
+        if not self.enabled:
+            return
+        self._check_fork()
+        with self._lock:
+            self.counters[(name, _labels_key(labels))] += value
+        for span in self.stack():
+            span.counters[name] += value
+
+    def observe(self, name: str, value: float, **labels):
+        """ Adding value to histogram name """
+        if not self.enabled:
+            return
+        self._check_fork()
+        with self._lock:
+            hist = self.histograms[(name, _labels_key(labels))]
+            hist[bisect_left(BUCKETS, value)] += 1
+            hist[-1] += value
+
+    def drain(self) -> dict:
+        """ Everything recorded since the last drain (json-serializable), then reset.
+        Used in workers, cf. `worker_call` """
+        self._check_fork()
+        with self._lock:
+            res = {"spans": list(self.spans),
+                   "counters": [[name, list(labels), value] \
+                       for (name, labels), value in self.counters.items()],
+                   "histograms": [[name, list(labels), hist] \
+                       for (name, labels), hist in self.histograms.items()]}
+        self.reset()
+        return res
+
+    def merge(self, data: dict):
+        """ Adding the output of `drain` of another process.
+        Its counters are also attributed to the spans open in the current thread """
+        self._check_fork()
+        with self._lock:
+            self.spans.extend(data["spans"])
+            for name, labels, value in data["counters"]:
+                self.counters[(name, tuple(tuple(x) for x in labels))] += value
+            for name, labels, hist in data["histograms"]:
+                curr = self.histograms[(name, tuple(tuple(x) for x in labels))]
+                for i, val in enumerate(hist):
+                    curr[i] += val
+        for span in self.stack():
+            for name, _, value in data["counters"]:
+                span.counters[name] += value
+
+    def stage_breakdown(self) -> list[dict]:
+        """ Last run of each stage (spans named `stage`): duration and counters """
+        stages = dict()
+        with self._lock:
+            for span in self.spans:
+                if span["name"] == "stage":
+                    stages[span["attrs"].get("stage")] = span
+        return [dict({"stage": stage, "duration_s": round(span["duration"], 3)},
+                     **{name: span["counters"].get(name, 0) for name in BREAKDOWN_COUNTERS}) \
+            for stage, span in stages.items()]
+
+    def to_trace_events(self) -> dict:
+        """ Spans in Chrome trace event format, counters and histograms in `metadata` """
+        with self._lock:
+            events = [{"name": span["attrs"].get("stage", span["name"]), "cat": span["name"],
+                       "ph": "X", "ts": span["start"] * 1e6, "dur": span["duration"] * 1e6,
+                       "pid": span["pid"], "tid": span["tid"],
+                       "args": dict(span["attrs"], **span["counters"])} \
+                for span in self.spans]
+            counters = [{"name": name, "labels": dict(labels), "value": value} \
+                for (name, labels), value in self.counters.items()]
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "metadata": {"counters": counters}}
+
+    def to_prometheus(self, prefix: str = "narrative") -> str:
+        """ Counters and histograms in Prometheus text format """
+        def fmt(labels, extra=None):
+            labels = list(labels) + (extra or list())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines, typed = list(), set()
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                metric = f"{prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, nb in zip(BUCKETS, hist):
+                    cumulative += nb
+                    lines.append(f"{metric}_bucket{fmt(labels, [('le', bound)])} {cumulative}"\
+                        .replace('le="inf"', 'le="+Inf"'))
+                lines.append(f"{metric}_sum{fmt(labels)} {hist[-1]}")
+                lines.append(f"{metric}_count{fmt(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attrs):
+    """ Span of the process tracer, e.g. `with span("stage", stage="events"): ...` """
+    return TRACER.span(name, **attrs) if TRACER.enabled else NO_SPAN
+
+
+def count(name: str, value: float = 1, **labels):
+    """ Counter of the process tracer """
+    if TRACER.enabled:
+        TRACER.count(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    """ Histogram of the process tracer """
+    if TRACER.enabled:
+        TRACER.observe(name, value, **labels)
+
+
+def traced(name: str, **attrs):
+    """ Decorator: each call of the function is a span """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with TRACER.span(name, **attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def worker_call(func, *args):
+    """ In a worker process: (func(*args), metrics recorded during the call) """
+    res = func(*args)
+    return res, TRACER.drain() if TRACER.enabled else None
+
+
+def merge_worker(output: tuple):
+    """ In the parent process: merging the metrics of `worker_call`, returns the result """
+    res, data = output
+    if data is not None:
+        TRACER.merge(data)
+    return res
+
+
+def export_json(path: str):
+    """ Writing the trace in Chrome trace event format """
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(TRACER.to_trace_events(), file, default=str)
+
+
+def export_prometheus(path: str):
+    """ Writing the metrics in Prometheus text format """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(TRACER.to_prometheus())
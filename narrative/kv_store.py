@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+""" Persistent key-value store shared by all runs (sqlite3 file in CACHE_FOLDER) """
+import os
+import json
+import sqlite3
+import threading
+
+from settings.settings import CACHE_FOLDER
+from narrative.instrumentation import count
+
+
+class KVStore:
+    """ Key-value store, keys are strings and values anything json-serializable.
+    One sqlite file per store name, the connection is opened lazily
+    (and re-opened in forked processes) """
+
+    chunk_size = 500
+
+    def __init__(self, name: str, folder: str = None):
+        folder = folder or CACHE_FOLDER
+        os.makedirs(folder, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(folder, f"{name}.sqlite")
+        self._conn, self._pid = None, None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        """ Connection of the current process """
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, keys: list[str]) -> dict:
+        """ Stored values of keys, missing keys are not in the output """
+        keys, res = list(keys), dict()
+        with self._lock:
+            for i in range(0, len(keys), self.chunk_size):
+                chunk = keys[i:i+self.chunk_size]
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({','.join('?'*len(chunk))})",
+                    chunk)
+                res.update({key: json.loads(value) for key, value in rows})
+        count("cache_hits", len(res), cache=self.name)
+        count("cache_misses", len(keys) - len(res), cache=self.name)
+        return res
+
+    def set_many(self, items: dict):
+        """ Storing (or replacing) all key/values of items """
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                                  [(key, json.dumps(value)) for key, value in items.items()])
+
+    def get(self, key: str, default=None):
+        """ Stored value of key, default if missing """
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key: str, value):
+        """ Storing value for key """
+        self.set_many({key: value})
+
+    def __contains__(self, key: str):
+        return key in self.get_many([key])
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def clear(self):
+        """ Removing all entries """
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM kv")
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+JSON requests to the MediaWiki APIs (Wikipedia, Wikidata)
+
+Failed calls raise instead of returning an empty response, so that callers never store
+the results of a failed call in their persistent caches:
+- HTTP errors (e.g. 429, 503) and connection errors are retried with an increasing wait
+  (or the `Retry-After` of the response), then raised
+- errors in the body of a response (`error` key) raise `APIError`, without retry
+"""
+import time
+import requests
+
+from narrative.instrumentation import span, count
+
+
+class APIError(requests.exceptions.RequestException):
+    """ Error returned in the body of an API response """
+
+
+def get_json(session: requests.Session, url: str, params: dict, service: str,
+             attempts: int = 3, backoff: float = 1.0) -> dict:
+    """ Decoded json response of a GET request, instrumented for service """
+    for attempt in range(attempts):
+        try:
+            with span("request", service=service):
+                count("requests", service=service)
+                response = session.get(url, params=params)
+            count("bytes", len(response.content), service=service)
+            response.raise_for_status()
+            res = response.json()
+        except (requests.exceptions.RequestException, ValueError) as error:
+            count("errors", service=service)
+            if attempt == attempts - 1:
+                raise
+            count("retries", service=service)
+            retry_after = getattr(getattr(error, "response", None), "headers", dict()) \
+                .get("Retry-After", "")
+            time.sleep(max(float(retry_after) if retry_after.isdigit() else 0,
+                           backoff * 2 ** attempt))
+            continue
+        if "error" in res:
+            count("errors", service=service)
+            raise APIError(f"{res['error'].get('code')}: {res['error'].get('info')}",
+                           response=response)
+        return res
+    return dict()
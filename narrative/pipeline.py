@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Headless pipeline, same steps as the streamlit app:
+collect -> wikipedia mapping + outgoing links -> page content -> infoboxes
+-> Wikidata IDs -> RDF graph -> timeline
+
+Stages form a DAG, each stage output is stored in the artifact cache
+(cf. narrative/artifacts.py) under a key derived from its inputs' content hashes,
+its parameters and its code. Independent stages run concurrently, and a stage is
+skipped if its key is already in cache. The keys of the last run are in
+<output folder>/manifest.json.
+"""
+import os
+import json
+import inspect
+import hashlib
+import logging
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import yaml
+
+from settings.settings import PIPELINE_FOLDER
+from narrative.artifacts import ArtifactCache
+from narrative.instrumentation import TRACER, span, count, export_json, export_prometheus
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "app-demo", "content", "event_collection.yaml")
+
+
+class Stage:
+    """ One step of the pipeline.
+    func(config, **inputs) -> output value, inputs being the outputs of other stages.
+    kind is the type of output (cf. narrative/artifacts.py): `table`, `json` or `graph`.
+    `params` are the config keys the stage depends on, `version` can be increased
+    to invalidate previous outputs (the code of func is also part of the cache key) """
+
+    def __init__(self, name: str, func, kind: str, inputs: list[str] = None,
+                 params: list[str] = None, version: int = 1):
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.inputs = inputs or list()
+        self.params = params or list()
+        self.version = version
+
+    @property
+    def code_hash(self) -> str:
+        """ Hash of the source code of the stage function """
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = self.func.__qualname__
+        return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _collect(config):
+    import pandas as pd
+    from kb_sparql.gather_events import build_args_for_collect, collect_data, EVENT_COLUMNS
+    paths = config["path_for_event"]
+    id_query_type_l = [(paths[path]["id"], paths[path]["query_type"],
+                        config["year_begin"], config["year_end"]) for path in config["paths"]]
+    args_collect_list = build_args_for_collect(id_query_type_l)
+    if config.get("refresh"):
+        from kb_sparql.refresh import Refresher
+        df_wd, _ = Refresher(config["refresh"]).refresh_events(
+            args_collect_list, combined=bool(config.get("combined")))
+    else:
+        df_wd = collect_data(args_collect_list=args_collect_list,
+                             combined=bool(config.get("combined")))
+    if df_wd is None:  # no query returned rows
+        df_wd = pd.DataFrame(columns=EVENT_COLUMNS + \
+            (["query_type"] if config.get("combined") else list()))
+    return df_wd.drop_duplicates().fillna("")
+
+
+def _map_wikipedia(config, events):
+    from wikipedia_narrative.map_wikidata_wikipedia import add_wikipedia_page
+    return add_wikipedia_page(events, col_wikidata=config["col_wikidata"])
+
+
+def _forward_links(config, events):
+    from kb_sparql.gather_events import get_outgoing_nodes
+    if config.get("refresh"):
+        from kb_sparql.refresh import Refresher
+        df_wd, _ = Refresher(config["refresh"]).refresh_forward_links(
+            events=list(events[config["col_wikidata"]].unique()))
+        return df_wd
+    return get_outgoing_nodes(events=list(events[config["col_wikidata"]].unique()))
+
+
+def _page_content(config, events_mapped):
+    from wikipedia_narrative.store_page_content import get_page_content
+    data, not_found = get_page_content(
+        df_input=events_mapped, col_main_name=config["col_main_name"],
+        col_wd_name=config["col_wikidata"], col_wp_name="wikipedia_page",
+        col_query_type="query_type", pointintime=config["pointintime"], extract_text=True)
+    return {"data": data, "not_found": not_found}
+
+
+def _infoboxes(config, page_content):
+    from wikipedia_narrative.info_boxes.get_infobox import collect_all_infobox
+    wp_data, _ = collect_all_infobox(wp_data=page_content["data"], options=config["options"])
+    return wp_data
+
+
+def _title_index(config, events_mapped):
+    from wikipedia_narrative.title_index import TitleIndex
+    return TitleIndex().update_from_df(
+        events_mapped, col_wikidata=config["col_wikidata"], col_wikipedia="wikipedia_page")
+
+
+def _wikipedia_for_graph(config, infoboxes, events_mapped):
+    from wikipedia_narrative.info_boxes.infobox_table import build_df_from_infobox
+    from wikipedia_narrative.info_boxes.infobox_for_graph import get_wikipedia_for_graph
+    df_infobox = build_df_from_infobox(
+        {k: v.get("infobox", dict()) for k, v in infoboxes.items()}).drop_duplicates()
+    return get_wikipedia_for_graph(df_infobox=df_infobox, df_collected=events_mapped,
+                                   title_index=_title_index(config, events_mapped))
+
+
+def _graph(config, wikipedia_for_graph, wikidata_for_graph):
+    from graph_building.converter import build_narrative_graph
+    graph, _ = build_narrative_graph(df_wp=wikipedia_for_graph, df_wd=wikidata_for_graph)
+    return graph
+
+
+def get_text_info(page_content: dict) -> dict[str, str]:
+    """ Summary (first section) of each Wikipedia page """
+    return {k: info['content'].split('==')[0] for k, info in page_content["data"].items()}
+
+
+def _timeline(config, graph, page_content):
+    from graph_building.timeline import build_timeline
+    return build_timeline(graph=graph, text_info=get_text_info(page_content))
+
+
+COLS = ["col_wikidata", "col_main_name"]
+
+STAGES = [
+    Stage("events", _collect, "table",
+          params=["path_for_event", "paths", "year_begin", "year_end", "combined"]),
+    Stage("events_mapped", _map_wikipedia, "table",
+          inputs=["events"], params=COLS),
+    Stage("wikidata_for_graph", _forward_links, "table",
+          inputs=["events"], params=COLS),
+    Stage("page_content", _page_content, "json",
+          inputs=["events_mapped"], params=COLS + ["pointintime"]),
+    Stage("infoboxes", _infoboxes, "json",
+          inputs=["page_content"], params=["options"]),
+    Stage("wikipedia_for_graph", _wikipedia_for_graph, "table",
+          inputs=["infoboxes", "events_mapped"], params=COLS),
+    Stage("graph", _graph, "graph",
+          inputs=["wikipedia_for_graph", "wikidata_for_graph"], params=COLS),
+    Stage("timeline", _timeline, "json",
+          inputs=["graph", "page_content"]),
+]
+
+
+@lru_cache(maxsize=None)
+def load_content(content_path: str = CONTENT_PATH) -> dict:
+    """ App content file, parsed once per process (not to be modified in place) """
+    with open(content_path, encoding="utf-8") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def get_config(content_path: str = CONTENT_PATH, **overrides) -> dict:
+    """ Pipeline parameters: app content file (all `path_for_event` by default) + overrides """
+    config = dict(load_content(content_path))
+    config.update({"paths": list(config["path_for_event"].keys()), "options": ["1", "2"]})
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+def read_manifest(folder: str) -> dict:
+    """ Cache key and content hash of each stage of the last run in folder """
+    manifest_path = os.path.join(folder, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return dict()
+    with open(manifest_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+class Pipeline:
+    """ Running stages in dependency order, independent ones concurrently """
+
+    def __init__(self, folder: str = PIPELINE_FOLDER, config: dict = None,
+                 stages: list[Stage] = None, max_workers: int = 4, force: bool = False,
+                 cache: ArtifactCache = None, rerun: list[str] = None):
+        self.folder = folder
+        self.cache = cache if cache is not None else ArtifactCache()
+        self.config = config if config is not None else get_config()
+        self.stages = {stage.name: stage for stage in (stages or STAGES)}
+        self.max_workers = max_workers
+        self.force = force
+        # stages run even if their inputs did not change (e.g. refreshed from Wikidata)
+        self.rerun = set(rerun or [])
+        os.makedirs(folder, exist_ok=True)
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self) -> dict:
+        return read_manifest(self.folder)
+
+    def _write_manifest(self):
+        with open(self.manifest_path, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=4)
+
+    def stage_key(self, stage: Stage) -> str:
+        """ Hash of stage name/version/code, parameters and content of input artifacts """
+        return self.cache.key(
+            stage=stage.name, version=stage.version, code=stage.code_hash,
+            params={param: self.config.get(param) for param in stage.params},
+            inputs={name: self.manifest[name]["hash"] for name in stage.inputs})
+
+    def is_up_to_date(self, stage: Stage, key: str = None) -> bool:
+        """ Output for the same key already in cache """
+        return (not self.force) and (stage.name not in self.rerun) and \
+            (key or self.stage_key(stage)) in self.cache
+
+    def required_stages(self, targets: list[str] = None) -> list[str]:
+        """ Targets and all the stages they depend on """
+        todo, res = list(targets or self.stages.keys()), set()
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage `{name}`, stages are: {list(self.stages)}")
+            if name not in res:
+                res.add(name)
+                todo.extend(self.stages[name].inputs)
+        return [name for name in self.stages if name in res]
+
+    def run_stage(self, name: str, key: str = None) -> bool:
+        """ Running one stage if not up to date, returns whether it was run """
+        stage = self.stages[name]
+        if self.is_up_to_date(stage, key=key):
+            LOGGER.info("Stage `%s` up to date, skipped", name)
+            count("cache_hits", cache="artifacts")
+            return False
+        LOGGER.info("Running stage `%s`", name)
+        count("cache_misses", cache="artifacts")
+        with span("stage", stage=name):
+            inputs = {name_in: self.cache.get(self.manifest[name_in]["key"]) \
+                for name_in in stage.inputs}
+            self.cache.put(key or self.stage_key(stage), stage.func(self.config, **inputs),
+                           kind=stage.kind, stage=name, inputs=stage.inputs)
+        return True
+
+    def run(self, targets: list[str] = None) -> dict[str, bool]:
+        """ Running targets (all stages by default) and their dependencies.
+        Returns whether each stage was run (False = skipped) """
+        pending, done, running = self.required_stages(targets), dict(), dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in [name for name in pending \
+                        if all(name_in in done for name_in in self.stages[name].inputs)]:
+                    # key computed before submission, inputs are final at that point
+                    key = self.stage_key(self.stages[name])
+                    running[executor.submit(self.run_stage, name, key)] = (name, key)
+                    pending.remove(name)
+                if not running:
+                    raise ValueError(f"Stages {pending} have unresolvable inputs")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, key = running.pop(future)
+                    done[name] = future.result()
+                    self.manifest[name] = {"key": key, "hash": self.cache.meta(key)["hash"]}
+                    self._write_manifest()
+        return done
+
+
+def load_outputs(folder: str = PIPELINE_FOLDER, cache: ArtifactCache = None) -> dict:
+    """ Outputs of the last run in folder that are still in cache (stage name -> value) """
+    cache = cache if cache is not None else ArtifactCache()
+    return {name: cache.get(info["key"]) for name, info in read_manifest(folder).items() \
+        if info["key"] in cache}
+
+
+if __name__ == '__main__':
+    # Example (e.g. nightly cron job), from the root of the repository:
+    # python -m narrative.pipeline -o ./data/pipeline -yb 1789 -ye 1799
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-o", "--output", default=PIPELINE_FOLDER,
+                    help="folder where the keys of the last run are stored (manifest.json)")
+    ap.add_argument("-c", "--content", default=CONTENT_PATH,
+                    help="yaml file with the parameters of the app (event collection)")
+    ap.add_argument("-s", "--stages", nargs="*", default=None,
+                    help="stages to run (with their dependencies), all by default. " + \
+                        f"Stages are: {[stage.name for stage in STAGES]}")
+    ap.add_argument("-yb", "--year_begin", default=None, help="start of the year range")
+    ap.add_argument("-ye", "--year_end", default=None, help="end of the year range")
+    ap.add_argument("-u", "--union", action="store_true",
+                    help="collect events with one UNION query instead of one query per path")
+    ap.add_argument("-f", "--force", action="store_true",
+                    help="run stages even if their inputs did not change")
+    ap.add_argument("-r", "--refresh", action="store_true",
+                    help="refresh the events and their outgoing links from their " + \
+                        "revision IDs (kb_sparql/refresh.py), stored in <output>/refresh")
+    ap.add_argument("-w", "--workers", default=4, type=int,
+                    help="max number of stages running concurrently")
+    ap.add_argument("-t", "--trace", default=None,
+                    help="json file for the trace of the run (cf. narrative/instrumentation.py)")
+    ap.add_argument("-m", "--metrics", default=None,
+                    help="file for the metrics of the run, in Prometheus text format")
+    ARGS = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    CONFIG = get_config(content_path=ARGS["content"], year_begin=ARGS["year_begin"],
+                        year_end=ARGS["year_end"], combined=ARGS["union"] or None,
+                        refresh=os.path.join(ARGS["output"], "refresh") if ARGS["refresh"] \
+                            else None)
+    if ARGS["trace"] or ARGS["metrics"]:
+        TRACER.enabled = True
+    Pipeline(folder=ARGS["output"], config=CONFIG, max_workers=ARGS["workers"],
+             force=ARGS["force"],
+             rerun=["events", "wikidata_for_graph"] if ARGS["refresh"] else None) \
+        .run(targets=ARGS["stages"])
+
+    for STAGE in TRACER.stage_breakdown():
+        LOGGER.info("Stage breakdown: %s", STAGE)
+    if ARGS["trace"]:
+        export_json(ARGS["trace"])
+    if ARGS["metrics"]:
+        export_prometheus(ARGS["metrics"])
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Wikidata/Wikipedia endpoints, for reproducible load tests
+without network access.
+
+Routes (same parameters as the live services):
+- /sparql                              Wikidata Query Service
+- /wikidata/w/api.php                  Wikidata API (wbgetentities)
+- /wikipedia/<lang>/w/api.php          MediaWiki API (query, parse), used by the
+                                       `wikipedia` and `wptools` modules
+- /wikipedia/<lang>/wiki/<title>       page html
+- /_stats                              counters of the server
+- /_edit                               new round of synthetic edits (revision IDs of
+                                       about 10% of the entities are increased)
+
+Requests are answered from recorded responses (one json file per request in the
+recordings folder). On a miss, the response is either synthesized from the request
+(same shape as the live one, deterministic), fetched from the live endpoint and
+recorded (`--record`), or a 404 (`--strict`).
+Latency, error rate and rate limit are configurable.
+
+Every module is pointed at the server by setting STANDIN_URL in settings/private.py,
+or the NARRATIVE_STANDIN_URL environment variable, e.g.:
+python -m narrative.standin_server -p 8765 --latency_ms 50 --error_rate 0.05 --rate_limit 20
+NARRATIVE_STANDIN_URL=http://127.0.0.1:8765 python -m narrative.pipeline
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import parse_qsl, urlparse, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from settings.settings import CACHE_FOLDER, AGENT
+
+RECORDING_FOLDER = os.path.join(CACHE_FOLDER, "standin")
+
+LIVE_SPARQL = "https://query.wikidata.org/sparql"
+LIVE_WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+LIVE_WIKIPEDIA = "https://{lang}.wikipedia.org"
+
+WIKIPEDIA_PATTERN = re.compile(r"^/wikipedia/(?P<lang>[a-z\-]+)(?P<route>/w/api\.php|/wiki/.+)$")
+LIVE_PAGE_URL_PATTERN = re.compile(r"https://(?P<lang>[a-z\-]+)\.wikipedia\.org/wiki/")
+SELECT_PATTERN = re.compile(r"SELECT\s+(?:DISTINCT\s+)?(.+?)\s*(?:\{|WHERE)",
+                            re.IGNORECASE | re.DOTALL)
+
+# Parameters that do not change the content of a response
+IGNORED_PARAMS = {"format", "output", "results"}
+
+
+def stable_int(value: str, modulo: int = 10**7) -> int:
+    """ Deterministic integer from a string (page IDs, revision IDs, ...) """
+    return int(hashlib.sha256(value.encode()).hexdigest()[:12], 16) % modulo + 1
+
+
+def request_key(path: str, params: dict) -> str:
+    """ Recording key of a request, independent of parameter order and query formatting """
+    params = {k: " ".join(v.split()) if k == "query" else v \
+        for k, v in params.items() if k not in IGNORED_PARAMS}
+    return hashlib.sha256(json.dumps([path, sorted(params.items())]).encode()).hexdigest()
+
+
+class Recordings:
+    """ Recorded responses, one json file per request in folder """
+
+    def __init__(self, folder: str = RECORDING_FOLDER):
+        self.folder = folder
+        self.responses = dict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        for name in os.listdir(folder):
+            if name.endswith(".json"):
+                with open(os.path.join(folder, name), encoding="utf-8") as file:
+                    self.responses[name[:-5]] = json.load(file)
+
+    def get(self, key: str):
+        """ Recorded response (status, content_type, body), None if not recorded """
+        return self.responses.get(key)
+
+    def put(self, key: str, path: str, params: dict, response: dict):
+        """ Recording one response """
+        with self._lock:
+            self.responses[key] = response
+            with open(os.path.join(self.folder, f"{key}.json"), "w", encoding="utf-8") as file:
+                json.dump(dict(response, path=path, params=params), file, ensure_ascii=False)
+
+
+class Throttle:
+    """ Token bucket, at most `rate` requests per second on average (bursts up to `rate`) """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Whether a request can be served now """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def synthetic_sparql(params: dict) -> dict:
+    """ Empty SPARQL results with the projection of the query """
+    matches = SELECT_PATTERN.search(params.get("query", ""))
+    variables = [var.strip() for var in matches.group(1).split("?") if var.strip()] \
+        if matches else list()
+    return {"head": {"vars": variables}, "results": {"bindings": list()}}
+
+
+def synthetic_revision(wd_id: str, epoch: int = 0) -> int:
+    """ Revision ID of wd_id after `epoch` rounds of edits, each one editing ~10% of the IDs """
+    return stable_int(wd_id) + sum(1 for curr in range(1, epoch + 1) \
+        if stable_int(f"{wd_id}:{curr}") % 10 == 0)
+
+
+def synthetic_wikidata_api(params: dict, base_url: str, epoch: int = 0) -> dict:
+    """ wbgetentities: each ID has an English label, a sitelink and a revision ID """
+    entities = dict()
+    for wd_id in params.get("ids", "").split("|"):
+        if not wd_id:
+            continue
+        title = f"Page {wd_id}"
+        entities[wd_id] = {
+            "type": "item", "id": wd_id, "lastrevid": synthetic_revision(wd_id, epoch),
+            "labels": {"en": {"language": "en", "value": f"Entity {wd_id}"}},
+            "sitelinks": {"enwiki": {
+                "site": "enwiki", "title": title, "badges": list(),
+                "url": f"{base_url}/wikipedia/en/wiki/{title.replace(' ', '_')}"}}}
+    return {"entities": entities, "success": 1}
+
+
+def synthetic_content(title: str) -> str:
+    """ Plain text content of a page """
+    return f"{title} is an event of the French Revolution.\n\n== Background ==\n" + \
+        f"Context of {title}.\n\n== Aftermath ==\nConsequences of {title}.\n\n" + \
+        "== References ==\nNone."
+
+
+def synthetic_wikipedia_query(params: dict, base_url: str, lang: str) -> dict:
+    """ action=query: list=search, prop=info|pageprops|extracts|revisions """
+    if params.get("list") == "search":
+        return {"query": {"search": [{"ns": 0, "title": params.get("srsearch", "")}]}}
+
+    props = params.get("prop", "").split("|")
+    titles = params.get("titles", "").split("|") if params.get("titles") else \
+        [f"Page {pageid}" for pageid in params.get("pageids", "").split("|") if pageid]
+    pages = list()
+    for title in titles:
+        page = {"pageid": stable_int(title), "ns": 0, "title": title}
+        # no page is a disambiguation page
+        if "pageprops" in props and "wikibase_item" in params.get("ppprop", "wikibase_item"):
+            page["pageprops"] = {"wikibase_item": f"Q{stable_int(title)}"}
+        if "info" in props:
+            page["fullurl"] = page["canonicalurl"] = \
+                f"{base_url}/wikipedia/{lang}/wiki/{title.replace(' ', '_')}"
+        if "extracts" in props:
+            page["extract"] = synthetic_content(title)
+        if "revisions" in props:
+            page["revisions"] = [{"revid": stable_int(f"rev-{title}"), "parentid": 0}]
+        pages.append(page)
+
+    if params.get("formatversion") == "2":
+        return {"query": {"pages": pages}}
+    return {"query": {"pages": {str(page["pageid"]): page for page in pages}}}
+
+
+def synthetic_wikipedia_parse(params: dict) -> dict:
+    """ action=parse (as requested by wptools): parse tree with an infobox """
+    title = params.get("page", "").replace("_", " ")
+    parts = "".join(f"<part><name>{name}</name><equals>=</equals><value>[[{value}]]</value></part>" \
+        for name, value in [("partof", "French Revolution"), ("place", "Paris"),
+                            ("combatant1", f"Side of {title}")])
+    return {"parse": {
+        "title": title, "pageid": stable_int(title), "wikitext": "", "iwlinks": list(),
+        "parsetree": f"<root><template><title>Infobox event</title>{parts}</template></root>",
+        "properties": {"wikibase_item": f"Q{stable_int(title)}"}}}
+
+
+def synthetic_page_html(title: str) -> str:
+    """ Page html with an infobox table """
+    links = "".join(f'<tr><td><a href="/wiki/{value.replace(" ", "_")}">{value}</a></td></tr>' \
+        for value in ["French Revolution", "Paris", f"Side of {title}"])
+    return f'<html><body><h1>{title}</h1><table class="infobox">{links}</table>' + \
+        f"<p>{synthetic_content(title)}</p></body></html>"
+
+
+class StandinServer(ThreadingHTTPServer):
+    """ Threaded http server holding the configuration and state of the stand-in """
+    daemon_threads = True
+
+    def __init__(self, address, recordings: Recordings, latency_ms: float = 0,
+                 jitter_ms: float = 0, error_rate: float = 0, rate_limit: float = None,
+                 record: bool = False, strict: bool = False, seed: int = 0,
+                 revision_epoch: int = 0):
+        super().__init__(address, StandinHandler)
+        self.recordings = recordings
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.error_rate = error_rate
+        self.throttle = Throttle(rate_limit) if rate_limit else None
+        self.record, self.strict = record, strict
+        self.rng = random.Random(seed)
+        self.revision_epoch = revision_epoch
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, *keys: str):
+        """ Incrementing counters of the /_stats route """
+        with self._lock:
+            self.stats.update(keys)
+
+    def random(self) -> float:
+        """ Seeded random number, shared by all threads """
+        with self._lock:
+            return self.rng.random()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """ One request: throttling, latency, errors, then recorded or synthetic response """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self) -> dict:
+        params = dict(parse_qsl(urlparse(self.path).query, keep_blank_values=True))
+        if self.command == "POST":
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+                params["query"] = body
+            else:
+                params.update(parse_qsl(body, keep_blank_values=True))
+        return params
+
+    def _send(self, status: int, body: str, content_type: str = "application/json",
+              headers: dict = None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, path: str):
+        """ (route name, live url, lang) of path, None if unknown """
+        if path == "/sparql":
+            return "sparql", LIVE_SPARQL, None
+        if path == "/wikidata/w/api.php":
+            return "wikidata_api", LIVE_WIKIDATA_API, None
+        matches = WIKIPEDIA_PATTERN.match(path)
+        if matches:
+            live = LIVE_WIKIPEDIA.format(lang=matches.group("lang")) + matches.group("route")
+            name = "wikipedia_api" if matches.group("route") == "/w/api.php" else "wikipedia_page"
+            return name, live, matches.group("lang")
+        return None
+
+    def _synthesize(self, route: str, params: dict, path: str, lang: str):
+        base_url = f"http://{self.headers.get('Host')}"
+        if route == "sparql":
+            return 200, "application/json", json.dumps(synthetic_sparql(params))
+        if route == "wikidata_api":
+            return 200, "application/json", \
+                json.dumps(synthetic_wikidata_api(params, base_url=base_url,
+                                                  epoch=self.server.revision_epoch))
+        if route == "wikipedia_page":
+            title = unquote(path.split("/wiki/", 1)[1]).replace("_", " ")
+            return 200, "text/html", synthetic_page_html(title)
+        if params.get("action") == "parse":
+            return 200, "application/json", json.dumps(synthetic_wikipedia_parse(params))
+        return 200, "application/json", \
+            json.dumps(synthetic_wikipedia_query(params, base_url=base_url, lang=lang))
+
+    def _fetch_live(self, live_url: str, params: dict):
+        response = requests.get(live_url, params=dict(params, format=params.get("format", "json")) \
+            if "api.php" in live_url or live_url == LIVE_SPARQL else None,
+                                headers={"User-Agent": AGENT,
+                                         "Accept": "application/sparql-results+json"})
+        return {"status": response.status_code, "body": response.text,
+                "content_type": response.headers.get("Content-Type", "").split(";")[0]}
+
+    def _handle(self):
+        server = self.server
+        path = urlparse(self.path).path
+        if path == "/_stats":
+            self._send(200, json.dumps(server.stats))
+            return
+        if path == "/_edit":
+            with server._lock:
+                server.revision_epoch += 1
+            self._send(200, json.dumps({"revision_epoch": server.revision_epoch}))
+            return
+
+        params = self._params()
+        route = self._route(path)
+        if route is None:
+            self._send(404, json.dumps({"error": f"Unknown route {path}"}))
+            return
+        name, live_url, lang = route
+        server.count("requests", f"requests:{name}")
+
+        if server.throttle is not None and not server.throttle.allow():
+            server.count("throttled")
+            self._send(429, json.dumps({"error": "Too many requests"}),
+                       headers={"Retry-After": "1"})
+            return
+        if server.latency_ms or server.jitter_ms:
+            time.sleep((server.latency_ms + server.jitter_ms * server.random()) / 1000)
+        if server.random() < server.error_rate:
+            server.count("errors")
+            self._send(503, json.dumps({"error": "Injected error"}))
+            return
+
+        key = request_key(path, params)
+        response = server.recordings.get(key)
+        if response is not None:
+            server.count("recorded")
+        elif server.record:
+            response = self._fetch_live(live_url, params)
+            server.recordings.put(key, path, params, response)
+            server.count("live")
+        elif server.strict:
+            server.count("missing")
+            self._send(404, json.dumps({"error": "Request not recorded"}))
+            return
+        else:
+            status, content_type, body = self._synthesize(name, params, path, lang)
+            response = {"status": status, "content_type": content_type, "body": body}
+            server.count("synthetic")
+
+        body = response["body"]
+        if name in ["wikidata_api", "wikipedia_api"]:  # page urls point to the stand-in
+            body = LIVE_PAGE_URL_PATTERN.sub(
+                lambda m: f"http://{self.headers.get('Host')}/wikipedia/{m.group('lang')}/wiki/",
+                body)
+        self._send(response["status"], body, response["content_type"] or "application/json")
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+
+def start(port: int = 0, host: str = "127.0.0.1", background: bool = True,
+          **kwargs) -> StandinServer:
+    """ Starting the stand-in (port 0 = any free port), in a daemon thread if background.
+    kwargs are the options of `StandinServer` (+ `folder` for the recordings) """
+    recordings = Recordings(folder=kwargs.pop("folder", RECORDING_FOLDER))
+    server = StandinServer((host, port), recordings=recordings, **kwargs)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--port", default=8765, type=int, help="port of the server")
+    ap.add_argument("-f", "--folder", default=RECORDING_FOLDER,
+                    help="folder of the recorded responses")
+    ap.add_argument("-l", "--latency_ms", default=0, type=float,
+                    help="latency added to each response, in ms")
+    ap.add_argument("-j", "--jitter_ms", default=0, type=float,
+                    help="random extra latency, uniform between 0 and this value, in ms")
+    ap.add_argument("-e", "--error_rate", default=0, type=float,
+                    help="proportion of requests answered with a 503 error")
+    ap.add_argument("-r", "--rate_limit", default=None, type=float,
+                    help="max requests per second, others are answered with a 429 error")
+    ap.add_argument("-s", "--seed", default=0, type=int, help="seed of the random errors/jitter")
+    ap.add_argument("--revision_epoch", default=0, type=int,
+                    help="initial number of rounds of synthetic edits (cf. /_edit)")
+    ap.add_argument("--record", action="store_true",
+                    help="fetch and record requests that are not recorded yet (needs network)")
+    ap.add_argument("--strict", action="store_true",
+                    help="answer requests that are not recorded with a 404 error, " + \
+                        "instead of a synthetic response")
+    ARGS = vars(ap.parse_args())
+
+    if ARGS["record"] and ARGS["strict"]:
+        raise ValueError("`record` and `strict` cannot be used together")
+    print(f"Stand-in server on http://127.0.0.1:{ARGS['port']}")
+    start(port=ARGS["port"], background=False, folder=ARGS["folder"],
+          latency_ms=ARGS["latency_ms"], jitter_ms=ARGS["jitter_ms"],
+          error_rate=ARGS["error_rate"], rate_limit=ARGS["rate_limit"],
+          record=ARGS["record"], strict=ARGS["strict"], seed=ARGS["seed"],
+          revision_epoch=ARGS["revision_epoch"])
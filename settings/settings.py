@@ -1,7 +1,48 @@
 # -*- coding: utf-8 -*-
 """ Importing main private settings """
+import os
+
+# Default values, can be overridden in the `private.py` file
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "narrative-prototype")
+# Stage outputs of the headless pipeline, <CACHE_FOLDER>/pipeline if not set
+PIPELINE_FOLDER = None
+SHARED_CACHE_MAX_MB = 2000
+WIKIDATA_SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+WIKIPEDIA_URL = "https://{lang}.wikipedia.org"
+# Base url of the local stand-in server (cf. narrative/standin_server.py), e.g. http://127.0.0.1:8765
+STANDIN_URL = os.environ.get("NARRATIVE_STANDIN_URL")
+# Spans and metrics of narrative/instrumentation.py, off by default
+TRACE = os.environ.get("NARRATIVE_TRACE", "0") == "1"
+# Handler profiling of the graph converters (cf. graph_building/profiling.py), off by default
+PROFILE_CONVERTERS = os.environ.get("NARRATIVE_PROFILE_CONVERTERS", "0") == "1"
+# Decoding of SPARQL results (cf. kb_sparql/sparql_results.py): typed or json (pd.json_normalize)
+SPARQL_DECODER = os.environ.get("NARRATIVE_SPARQL_DECODER", "typed")
+# Paginated SPARQL queries (cf. kb_sparql/sparql_query.py): initial/minimal page size,
+# cap on the total number of rows and client timeout of each page (s)
+SPARQL_PAGE_SIZE = 10000
+SPARQL_MIN_PAGE_SIZE = 250
+SPARQL_MAX_ROWS = 500000
+SPARQL_PAGE_TIMEOUT = 70
+# Labels of the SPARQL queries: `service` (SERVICE wikibase:label in the queries) or
+# `resolver` (queries return IDs, labels are filled from a persistent cache, cf. kb_sparql/labels.py)
+SPARQL_LABELS = os.environ.get("NARRATIVE_SPARQL_LABELS", "service")
+# SQLite index of a Wikidata dump (cf. kb_sparql/dump_backend.py): if set, the queries of
+# SPARQL_QUERIES are answered from it instead of the SPARQL endpoint
+DUMP_INDEX = os.environ.get("NARRATIVE_DUMP_INDEX")
+# Cache of the library functions (cf. narrative/cache.py): auto, streamlit, memory or none
+CACHE_BACKEND = os.environ.get("NARRATIVE_CACHE_BACKEND", "auto")
 
 try:
     from settings.private import *
 except:
     pass
+
+# Derived from the settings above, once overridden
+if PIPELINE_FOLDER is None:
+    PIPELINE_FOLDER = os.path.join(CACHE_FOLDER, "pipeline")
+
+if STANDIN_URL:
+    WIKIDATA_SPARQL_ENDPOINT = f"{STANDIN_URL}/sparql"
+    WIKIDATA_API = f"{STANDIN_URL}/wikidata/w/api.php"
+    WIKIPEDIA_URL = f"{STANDIN_URL}/wikipedia/{{lang}}"
@@ -1,23 +1,23 @@
 # -*- coding: utf-8 -*-
 """ Retrieving info from infoboxes """
-import re
-import wptools
-import streamlit as st
-import urllib3
-import requests
-from bs4 import BeautifulSoup
+import logging
+import multiprocessing as mp
+from functools import partial
+from collections import Counter
+from typing import TYPE_CHECKING
+from wikipedia_narrative.info_boxes.html_helpers import get_html_from_url
 from wikipedia_narrative.info_boxes.pre_process_infobox import \
     filter_infobox_edges, merge_infobox_edges
+from wikipedia_narrative.info_boxes.link_resolver import LinkResolver
+from wikipedia_narrative.info_boxes.infobox_table import InfoboxTableBuilder
+from settings.settings import WIKIPEDIA_URL
+from narrative.instrumentation import span, count, worker_call, merge_worker
+from narrative.cache import cached
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-
-def get_html_from_url(url: str) -> BeautifulSoup:
-    """ Retrieving html from url """
-    session = requests.Session()
-    html = session.get(url, verify=False).content
-    return BeautifulSoup(html, 'lxml')
+LOGGER = logging.getLogger(__name__)
 
 
 def extract_infobox_no_url(page_name:str, options:list[str] = []) -> dict:
@@ -26,8 +26,11 @@ def extract_infobox_no_url(page_name:str, options:list[str] = []) -> dict:
     1. Keeping only specific labels in infoboxes
     2. Merging similar labels (i.e. one representative class for several edges)
     3. Pre-processing content of infoboxes values (for later narrative building) """
-    page = wptools.page(page_name, show=False)
-    page.get_parse()
+    import wptools  # slow to import, only needed here
+    page = wptools.page(page_name, show=False, wiki=WIKIPEDIA_URL.format(lang="en"))
+    with span("request", service="wikipedia_parse"):
+        count("requests", service="wikipedia_parse")
+        page.get_parse()
     if page.data['infobox']:
         infobox = page.data['infobox']
         if "1" in options:  # Only keep relevant infobox labels for the narrative
@@ -41,7 +44,7 @@ def extract_infobox_no_url(page_name:str, options:list[str] = []) -> dict:
     return dict()
 
 
-def get_link_from_html(html_content: BeautifulSoup) -> dict[str, str]:
+def get_link_from_html(html_content: "BeautifulSoup") -> dict[str, str]:
     """ Retrieving href links found in infobox
     Output format = dict[<text pointing to link>, <url of link>] """
     output = html_content.find('table', {'class': 'infobox'})
@@ -56,7 +59,7 @@ img_noise = ["Question_book-new.svg", 'Translation_to_english_arrow.svg',
              'Text_document_with_page_number_icon.svg', 'Text_document_with_red_question_mark.svg',
              'Ambox_important.svg']
 
-def get_img_src(html_content: BeautifulSoup) -> str:
+def get_img_src(html_content: "BeautifulSoup") -> str:
     """ Returning url of first img find in html_content, exclusing noisy images """
     imgs = html_content.find_all("img")
     for img in imgs:
@@ -66,30 +69,77 @@ def get_img_src(html_content: BeautifulSoup) -> str:
             return img.get('src', '')
     return ''
 
-@st.cache(show_spinner=False)
-def add_url(infobox: dict, links: dict[str, str]) -> dict[str, dict]:
+@cached(show_spinner=False)
+def add_url(infobox: dict, links: dict[str, str], fuzzy: bool = False) -> dict[str, dict]:
     """ For each infobox label in infobox:
     1. Detecting links (delimited by [[]])
-    2. Adding corresponding href found in infobox """
-    res = dict()
-    for pred, val in infobox.items():
-        if isinstance(val["text"], str):
-            urls = list()
-            cand_links = re.findall(pattern="\\[\\[([^\\[]+)\\]\\]+?", string=val["text"])
-            print(cand_links)
-            for cands in cand_links:
-                for cand in cands.split("|"):
-                    try:
-                        print(cand.strip())
-                        urls.append(f"https://en.wikipedia.org{links[cand.strip()]}")
-                    except Exception as error:
-                        print(error)
-            val.update(dict(href=urls))
-            res[pred] = val
-        else:
-            val.update(dict(href=list()))
-            res[pred] = val
-    return res
+    2. Adding corresponding href found in infobox
+    If fuzzy, also matching links regardless of underscores, case and url-encoding """
+    return LinkResolver(links=links, fuzzy=fuzzy).add_url(infobox)
+
+
+@cached(show_spinner=False)
+def fetch_one_infobox(wp_page_name: str, url: str, wd_page_name: str,
+                      options: list[str], get_image: bool = False):
+    """ Infobox in wikipedia page (if none empty dict, links not resolved yet), links scraped
+    from its html (cf. `get_link_from_html`) and image (if get_image, else None).
+    options specify any additional preprocessing steps for the infoboxes (cf. in app) """
+    infobox = extract_infobox_no_url(page_name=wp_page_name, options=options)
+    html_content = get_html_from_url(url=url)
+    links = get_link_from_html(html_content=html_content)
+    return (wd_page_name, infobox, links, get_img_src(html_content) if get_image else None)
+
+
+def resolve_infobox(infobox: dict, resolver: LinkResolver) -> dict[str, dict]:
+    """ Infobox with the hrefs of its links, without the `boxes` and `count` keys """
+    return {k: v for k, v in resolver.add_url(infobox).items() if k not in ["boxes", "count"]}
+
+
+def get_one_infobox(wp_page_name: str, url: str, wd_page_name: str,
+                    options: list[str], get_image: bool = False, fuzzy: bool = True):
+    """ Searches and return two main elements
+    1. Infobox in wikipedia page - if none empty dict.
+        options specify any additional preprocessing steps for the infoboxes (cf. in app)
+    2. Url links in the infobox if any (scraping and searching for such links) """
+    wd_page_name, infobox, links, img = fetch_one_infobox(
+        wp_page_name, url, wd_page_name, options, get_image)
+    return (wd_page_name, resolve_infobox(infobox, LinkResolver(links=links, fuzzy=fuzzy)), img)
+
+
+def _fetch_one_infobox_from_args(args: tuple):
+    """ Unpacking arguments, `imap_unordered` only passes one argument """
+    return fetch_one_infobox(*args)
+
+
+def iter_all_infobox(wp_data: dict[str, dict], options: list[str], get_image: bool = False,
+                     fuzzy: bool = True, stats: Counter = None):
+    """ Collecting infoboxes of all pages in wp_data (output of `get_page_content`).
+    Parallelized, each (wd_page_name, infobox, img) is yielded as soon as its page is done.
+    Links of all infoboxes are resolved in this process with one shared counter
+    (`exact`, `normalized` and `missed` links, logged at the end), if fuzzy also
+    regardless of underscores, case and url-encoding (cf. link_resolver.py) """
+    stats = stats if stats is not None else Counter()
+    args = [(x["wikipedia"].split("/")[-1].replace("_", " "), x["wikipedia"],
+             x["event_wd_name"], options, get_image) for _, x in wp_data.items()]
+    with mp.Pool(mp.cpu_count()) as pool:
+        for res in pool.imap_unordered(partial(worker_call, _fetch_one_infobox_from_args), args):
+            wd_page_name, infobox, links, img = merge_worker(res)
+            resolver = LinkResolver(links=links, fuzzy=fuzzy, stats=stats)
+            yield (wd_page_name, resolve_infobox(infobox, resolver), img)
+    LOGGER.info("Links of %d infoboxes: %s", len(args), dict(stats))
+
+
+def collect_all_infobox(wp_data: dict[str, dict], options: list[str]):
+    """ Collecting all infoboxes, the infobox table is filled page by page
+    while the extraction is still running.
+    Returns wp_data with an `infobox` (and `img`) key per page + the infobox table """
+    builder = InfoboxTableBuilder()
+    for k, infobox, img in iter_all_infobox(wp_data=wp_data, options=options):
+        wp_data[k]["infobox"] = infobox
+        builder.add_infobox(event_label=k, infobox=infobox)
+        if img:
+            wp_data[k]['img'] = img
+    return wp_data, builder.to_df()
 
 
 if __name__ == '__main__':
@@ -1,26 +1,43 @@
 # -*- coding: utf-8 -*-
 """ Html helpers for infoboxes """
+import logging
+from typing import TYPE_CHECKING
 import urllib3
 import requests
-from bs4 import BeautifulSoup
+
+from settings.settings import WIKIDATA_API
+from narrative.instrumentation import span, count
+
+LOGGER = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def get_html_from_url(url: str) -> BeautifulSoup:
+def get_html_from_url(url: str) -> "BeautifulSoup":
     """ Retrieving html from url """
+    from bs4 import BeautifulSoup
     session = requests.Session()
-    html = session.get(url, verify=False).content
+    with span("request", service="wikipedia_html"):
+        count("requests", service="wikipedia_html")
+        html = session.get(url, verify=False).content
+    count("bytes", len(html), service="wikipedia_html")
     return BeautifulSoup(html, 'lxml')
 
 
 def get_wp_url_from_wd_id(wikidata_id:str, lang:str = 'en', debug:bool = False) -> str:
     """ Retrieving Wikipedia URL from Wikidata page. If not found return empty string """
 
-    url = "https://www.wikidata.org/w/api.php?action=wbgetentities&props=sitelinks/" + \
+    url = f"{WIKIDATA_API}?action=wbgetentities&props=sitelinks/" + \
         f"urls&ids={wikidata_id}&format=json"
-    json_response = requests.get(url).json()
+    with span("request", service="wikidata_api"):
+        count("requests", service="wikidata_api")
+        response = requests.get(url)
+    count("bytes", len(response.content), service="wikidata_api")
+    json_response = response.json()
     if debug:
-        print(wikidata_id, url, json_response)
+        LOGGER.info("%s %s %s", wikidata_id, url, json_response)
 
     try:
         url = json_response.get('entities').get(wikidata_id) \
@@ -28,5 +45,6 @@ def get_wp_url_from_wd_id(wikidata_id:str, lang:str = 'en', debug:bool = False)
         return requests.utils.unquote(url)
 
     except Exception as error:
-        print(error)
+        LOGGER.debug("No %s Wikipedia page for %s: %r", lang, wikidata_id, error)
+        count("not_found", service="wikidata_api")
         return ""
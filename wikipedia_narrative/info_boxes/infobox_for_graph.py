@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+""" Preparing the infobox table for graph building (narrative labels, Wikidata IDs) """
+import pandas as pd
+
+from wikipedia_narrative.titles import normalize_title_series
+from wikipedia_narrative.wd_id_resolver import WikidataIdResolver
+from kb_sparql.event_table import EventTable, to_url
+
+I_FILTER = [''] + [i for i in range(1,15)]
+
+PRED_GROUPING_WP = {
+    'who': [f"{x}{i}" for x in \
+        ['Participants', 'appointer', 'combatant', 'commander', 'commanders',
+        'deputy', "founder", "house", "leader", "legislature", "organisers",
+        "p", "participants", "precursor"] for i in I_FILTER],
+    'where': [f"{x}{i}" for x in \
+        ['Location', 'area', 'coordinates', "location", "place"] \
+            for i in I_FILTER],
+    'when': [f"{x}{i}" for x in \
+        ['Date', 'abolished', 'date', 'date_end', 'date_event', 'date_pre',
+        'date_start', 'defunct', 'disbanded', 'established', "formation",
+        "founded_date", "life_span", 'year_'] for i in I_FILTER],
+    'temporal_link': [f"{x}{i}" for x in \
+        ["era", "event", "event_end", "event_pre", "event_start", "partof",
+        "preceded_by", "succeeded_by", "succession"] for i in I_FILTER],
+    'causal_link': [f"{x}{i}" for x in \
+        ['Result', 'cause', 'outcome', 'result', 'territory'] \
+            for i in I_FILTER],
+}
+
+INVERSE_PRED_WP = {x: k for k, v in PRED_GROUPING_WP.items() for x in v}
+
+NAME_MAPPING = {
+    "Kingdom_of_France_(1791%E2%80%9392)": "Constitutional_Cabinet_of_Louis_XVI"
+}
+
+
+def filter_narrative_predicates(df_input: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+    """ Only keeping infobox labels relevant for the narrative, adding their `type` """
+    df_filter = df_input[df_input.predicate.isin(INVERSE_PRED_WP)].copy()
+    df_filter['type'] = df_filter.predicate.map(INVERSE_PRED_WP)
+    return df_filter
+
+
+def clean_df(df_input: pd.core.frame.DataFrame, title_index=None) -> pd.core.frame.DataFrame:
+    """ Preprocessing of content: decoding Wikipedia titles from urls,
+    done once per unique url and broadcast back to rows.
+    If title_index, titles are replaced by the ones mapped during collection """
+    cols_to_keep = ['eventLabel', 'predicate', 'objectLabel', 'type']
+
+    df_wp = df_input[df_input.object.str.startswith("https")][cols_to_keep].copy()
+    df_wp["wptools_name"] = normalize_title_series(df_wp['objectLabel'], name_mapping=NAME_MAPPING)
+    df_wp = df_wp[~df_wp.wptools_name.str.startswith("index.php")].copy()
+    if title_index is not None:
+        df_wp["wptools_name"] = title_index.canonical_titles(df_wp["wptools_name"])
+    df_wp['objectLabel'] = df_wp['wptools_name'].str.replace("_", " ", regex=False)
+
+    return df_wp
+
+
+def find_wd_id(name: str) -> str:
+    """ Find Wikidata URI from Wikipedia page name """
+    return WikidataIdResolver()(name)
+
+
+def add_wd_id(df_wp: pd.core.frame.DataFrame, title_index=None,
+              resolver: WikidataIdResolver = None) -> pd.core.frame.DataFrame:
+    """ Adding wikidata ID of each Wikipedia feature.
+    Titles are first searched in title_index, the others are resolved
+    in batches (and cached across runs) and added to title_index """
+    titles = df_wp.wptools_name.unique()
+    mapping = {title: title_index.get_id(title) for title in titles} \
+        if title_index is not None else dict()
+    mapping = {title: wd_id for title, wd_id in mapping.items() if wd_id}
+
+    resolver = resolver if resolver is not None else WikidataIdResolver()
+    found = resolver.resolve([title for title in titles if title not in mapping])
+    if title_index is not None:
+        title_index.update(found)
+    mapping.update(found)
+
+    df_wp["wd_id"] = df_wp.wptools_name.map(mapping)
+    return df_wp
+
+
+def add_event_wd_page(df_wp: pd.core.frame.DataFrame, df_collected) -> pd.core.frame.DataFrame:
+    """ Adding Wikidata urls of events (from collected data, DataFrame or EventTable)
+    and objects. Infobox rows are joined once with each (event, label) of the collection """
+    if not isinstance(df_collected, EventTable):
+        df_collected = EventTable.from_frames(events=df_collected[["event", "eventLabel"]])
+    df_wp = df_wp.merge(df_collected.event_labels(), how='left', on='eventLabel')
+    df_wp["wd_page"] = to_url(df_wp.pop("qid")).values
+    df_wp["obj_wd"] = "http://www.wikidata.org/entity/" + df_wp["wd_id"]
+    return df_wp.drop_duplicates()
+
+
+def get_wikipedia_for_graph(df_infobox: pd.core.frame.DataFrame, df_collected,
+                            title_index=None, resolver: WikidataIdResolver = None):
+    """ Infobox table (output of `build_df_from_infobox`) -> input of `WikipediaConverter` """
+    df_wp = clean_df(df_input=filter_narrative_predicates(df_infobox), title_index=title_index)
+    df_wp = add_wd_id(df_wp, title_index=title_index, resolver=resolver)
+    return add_event_wd_page(df_wp=df_wp, df_collected=df_collected)
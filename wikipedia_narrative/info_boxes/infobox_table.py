@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+""" Building tabular data from infoboxes """
+import pandas as pd
+
+INFOBOX_COLUMNS = ["eventLabel", "predicate", "object", "objectLabel"]
+
+
+class InfoboxTableBuilder:
+    """ Gathering infobox records in flat columns,
+    the DataFrame is only constructed once when calling `to_df`.
+    Columns are Python lists rather than Arrow arrays: records arrive one page at a time
+    and Arrow arrays are immutable, and the string columns are object columns
+    in the DataFrame anyway """
+
+    def __init__(self):
+        self.columns = {col: list() for col in INFOBOX_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["eventLabel"])
+
+    def add_infobox(self, event_label: str, infobox: dict[str, dict]):
+        """ One record per href of each infobox label,
+        or one record with the text content if the label has no href """
+        for predicate, curr_info in infobox.items():
+            values = curr_info["href"] if curr_info.get("href") else [curr_info["text"]]
+            nb_values = len(values)
+            self.columns["eventLabel"].extend([event_label] * nb_values)
+            self.columns["predicate"].extend([predicate] * nb_values)
+            self.columns["object"].extend(values)
+            self.columns["objectLabel"].extend(values)
+        return self
+
+    def add_infoboxes(self, infoboxes: dict[str, dict]):
+        """ Adding several infoboxes, keys are the event labels """
+        for event_label, infobox in infoboxes.items():
+            self.add_infobox(event_label=event_label, infobox=infobox)
+        return self
+
+    def tail(self, nb_records: int = 20) -> pd.core.frame.DataFrame:
+        """ DataFrame of the last nb_records records only (e.g. to show the progress) """
+        start = max(len(self) - nb_records, 0)
+        return pd.DataFrame({col: values[start:] for col, values in self.columns.items()},
+                            columns=INFOBOX_COLUMNS, index=range(start, len(self)))
+
+    def to_df(self) -> pd.core.frame.DataFrame:
+        """ Building the DataFrame from the records gathered so far """
+        return pd.DataFrame(self.columns, columns=INFOBOX_COLUMNS)
+
+
+def build_df_from_infobox(infoboxes: dict[str, dict]) -> pd.core.frame.DataFrame:
+    """ Input = infobox dict, output = pandas dataframe """
+    return InfoboxTableBuilder().add_infoboxes(infoboxes=infoboxes).to_df()
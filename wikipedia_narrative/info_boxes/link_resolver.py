@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+""" Resolving [[...]] links in infobox values to the hrefs scraped from the infobox html """
+import re
+from collections import Counter
+from urllib.parse import unquote
+
+LINK_PATTERN = re.compile("\\[\\[([^\\[]+)\\]\\]+?")
+WHITESPACE_PATTERN = re.compile("[\\s_]+")
+
+
+def normalize_link_text(text: str) -> str:
+    """ Underscores/spaces, case and url-encoding insensitive version of text """
+    return WHITESPACE_PATTERN.sub(" ", unquote(text)).strip().casefold()
+
+
+class LinkResolver:
+    """ Matching candidate link texts against the links of one infobox
+    (output of `get_link_from_html`: dict[<text pointing to link>, <url of link>]).
+    Exact matches are plain dict lookups, if `fuzzy` a precomputed normalized index
+    (built from both link texts and link targets) is used as fallback """
+
+    def __init__(self, links: dict[str, str], fuzzy: bool = False,
+                 base_url: str = "https://en.wikipedia.org", stats: Counter = None):
+        self.links = {text.strip(): href for text, href in links.items() if href}
+        self.base_url = base_url
+        self.stats = stats if stats is not None else Counter()
+
+        self.normalized = dict()
+        if fuzzy:
+            for text, href in self.links.items():
+                if href.startswith("/wiki/"):
+                    self.normalized.setdefault(normalize_link_text(href[6:]), href)
+            for text, href in self.links.items():
+                self.normalized[normalize_link_text(text)] = href
+
+    def resolve(self, cand: str):
+        """ href of a candidate link text, None if not found """
+        cand = cand.strip()
+        href = self.links.get(cand)
+        if href is not None:
+            self.stats["exact"] += 1
+            return href
+        href = self.normalized.get(normalize_link_text(cand)) if self.normalized else None
+        if href is not None:
+            self.stats["normalized"] += 1
+            return href
+        return None
+
+    def get_urls(self, text: str) -> list[str]:
+        """ Urls of all links (delimited by [[]]) found in text,
+        for [[target|text]] links the first candidate found is kept """
+        urls = list()
+        for cands in LINK_PATTERN.findall(text):
+            href = next((href for href in map(self.resolve, cands.split("|")) \
+                if href is not None), None)
+            if href is None:
+                self.stats["missed"] += 1
+            else:
+                urls.append(f"{self.base_url}{href}")
+        return urls
+
+    def add_url(self, infobox: dict) -> dict[str, dict]:
+        """ For each infobox label in infobox:
+        1. Detecting links (delimited by [[]])
+        2. Adding corresponding href found in infobox """
+        return {pred: dict(val, href=self.get_urls(val["text"]) \
+                    if isinstance(val["text"], str) else list()) \
+                for pred, val in infobox.items()}
+
@@ -2,28 +2,39 @@
 """ Pre processing info boxes labels """
 import os
 import re
+from functools import lru_cache
 import yaml
-from settings.settings import ROOT_PATH
 
-with open(os.path.join(ROOT_PATH, "wikipedia_narrative/info_boxes/to_discard.txt"), 'r') as file:
-    to_discard_patterns = [elt.strip() for elt in file.read().split("\n")]
+FOLDER = os.path.dirname(os.path.abspath(__file__))
 
-with open(os.path.join(ROOT_PATH, "wikipedia_narrative/info_boxes/merge_labels.yaml"), 'r') as file:
-    merge_labels = yaml.load(file, Loader=yaml.FullLoader)
 
-LABEL_TO_REPR = {k: v for v, l in merge_labels.items() for k in l}
+@lru_cache(maxsize=None)
+def get_discard_patterns() -> tuple:
+    """ Compiled patterns of the labels to discard (to_discard.txt), read once """
+    with open(os.path.join(FOLDER, "to_discard.txt"), 'r', encoding="utf-8") as file:
+        return tuple(re.compile(elt.strip()) for elt in file.read().split("\n"))
 
 
-def filter_infobox_edges(infobox: dict,
-                         to_filter: list[str] = to_discard_patterns) -> dict[str, str]:
-    """ Return only keys and values that are not in to_filter """
+@lru_cache(maxsize=None)
+def get_label_to_repr() -> dict[str, str]:
+    """ Label -> representative label (merge_labels.yaml), read once """
+    with open(os.path.join(FOLDER, "merge_labels.yaml"), 'r', encoding="utf-8") as file:
+        merge_labels = yaml.load(file, Loader=yaml.FullLoader)
+    return {k: v for v, l in merge_labels.items() for k in l}
+
+
+def filter_infobox_edges(infobox: dict, to_filter: list = None) -> dict[str, str]:
+    """ Return only keys and values that are not in to_filter
+    (patterns or compiled patterns, to_discard.txt by default) """
+    to_filter = get_discard_patterns() if to_filter is None else to_filter
     return {k: v for k, v in infobox.items() if \
         not any(re.search(pattern, k) for pattern in to_filter)}
 
 
-def merge_infobox_edges(infobox:dict,
-                        label_to_repr: dict[str, str] = LABEL_TO_REPR) -> dict[str, str]:
-    """ Merging labels that are similar with one representant only """
+def merge_infobox_edges(infobox:dict, label_to_repr: dict[str, str] = None) -> dict[str, str]:
+    """ Merging labels that are similar with one representant only
+    (merge_labels.yaml by default) """
+    label_to_repr = get_label_to_repr() if label_to_repr is None else label_to_repr
 
     # Special cases
     if "year_start" and "date_start" in infobox:
@@ -5,21 +5,35 @@ Finding Wikipedia page from a Wikidata page
 
 import argparse
 import multiprocessing as mp
+from functools import partial
 import pandas as pd
-import streamlit as st
 from wikipedia_narrative.info_boxes.html_helpers import get_wp_url_from_wd_id
+from narrative.instrumentation import worker_call, merge_worker
+from narrative.cache import cached
+from kb_sparql.event_table import wd_ids
 
-@st.cache(show_spinner=False)
+def iter_wikipedia_page(df_pd: pd.core.frame.DataFrame, col_wikidata: str,
+                        chunk_size: int = 25):
+    """ Same as `add_wikipedia_page`, rows of df_pd are yielded by chunks of chunk_size
+    (in order, with their wikipedia_page column) as soon as they are mapped. Parallelized. """
+    ids = wd_ids(df_pd[col_wikidata].values)
+    urls = list()
+    with mp.Pool(mp.cpu_count()) as pool:
+        for res in pool.imap(partial(worker_call, get_wp_url_from_wd_id), ids, chunksize=4):
+            urls.append(merge_worker(res))
+            if len(urls) % chunk_size == 0 or len(urls) == len(ids):
+                start = chunk_size * ((len(urls) - 1) // chunk_size)
+                yield df_pd.iloc[start:len(urls)].assign(wikipedia_page=urls[start:])
+
+
+@cached(show_spinner=False)
 def add_wikipedia_page(df_pd: pd.core.frame.DataFrame,
                        col_wikidata: str,
                        save_path:str = None) -> pd.core.frame.DataFrame:
     """ Adding a wikipedia_page column in the input df_pd.
     If found adds link to English Wikipedia page. Parallelized. """
-    with mp.Pool(mp.cpu_count()) as pool:
-        df_pd["wikipedia_page"] = pool.map(get_wp_url_from_wd_id,
-                                        [x.split("/")[-1] for x in df_pd[col_wikidata].values])
-        pool.close()
-        pool.join()
+    df_pd["wikipedia_page"] = [url for chunk in \
+        iter_wikipedia_page(df_pd, col_wikidata=col_wikidata) for url in chunk.wikipedia_page]
     if save_path:
         df_pd.to_csv(save_path)
     return df_pd
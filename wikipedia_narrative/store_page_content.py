@@ -3,11 +3,23 @@
 Extract text from Wikipedia page
 """
 import json
+import logging
 import argparse
+from functools import partial
 import multiprocessing as mp
 import pandas as pd
-import streamlit as st
 from wikipedia_narrative.wikipedia_page import WikipediaPage
+from narrative.instrumentation import worker_call, merge_worker
+from narrative.cache import cached
+
+LOGGER = logging.getLogger(__name__)
+
+
+def to_json_value(value):
+    """ Dates of the typed SPARQL output (cf. kb_sparql/sparql_results.py) as ISO strings """
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return "" if value is pd.NaT else value
 
 
 def get_info_from_one_event(row: pd.core.series.Series, col_main_name: str,
@@ -29,29 +41,42 @@ def get_info_from_one_event(row: pd.core.series.Series, col_main_name: str,
                     "wikidata": row[col_wd_name], "wikipedia": row[col_wp_name],
                     "query_type": row[col_query_type]}
 
-        res.update({k: row[v] for (k, v) in \
+        res.update({k: to_json_value(row[v]) for (k, v) in \
             [("pointintime", pointintime)] if v})
         return res
     except Exception as exception:
-        print(f"=={exception}\nEvent {event_wd} could not" + \
-            " be searched through the wikipedia module\n==")
+        LOGGER.warning("Event %s could not be searched through the wikipedia module: %r",
+                       event_wd, exception)
         return dict(event_wd_name=event_wd)
 
 
-@st.cache(allow_output_mutation=True, show_spinner=False)
+def _get_info_from_args(args: tuple) -> dict:
+    """ Unpacking arguments, `imap_unordered` only passes one argument """
+    return get_info_from_one_event(*args)
+
+
+def iter_page_content(df_input: pd.core.frame.DataFrame, col_main_name: str,
+                      col_wd_name: str, col_wp_name: str,
+                      col_query_type: str, pointintime: str, extract_text: bool):
+    """ Same as `get_page_content`, the info of each event is yielded as soon as it is
+    retrieved (dict with only `event_wd_name` if no Wikipedia page was found). Parallelized """
+    args = [(row, col_main_name, col_wp_name, col_wd_name,
+             col_query_type, pointintime, extract_text) for _, row in df_input.iterrows()]
+    with mp.Pool(mp.cpu_count()) as pool:
+        for res in pool.imap_unordered(partial(worker_call, _get_info_from_args), args):
+            yield merge_worker(res)
+
+
+@cached(allow_output_mutation=True, show_spinner=False)
 def get_page_content(df_input: pd.core.frame.DataFrame, col_main_name: str,
                      col_wd_name: str, col_wp_name: str,
                      col_query_type: str, pointintime: str, extract_text: bool) -> dict[str, dict]:
     """ [Optional] Getting wikipedia text content from all rows in input df_input +
     [All] Formatting text output"""
-    num_workers = mp.cpu_count()
-    pool = mp.Pool(num_workers)
-    res = pool.starmap(get_info_from_one_event,
-                       [(row, col_main_name, col_wp_name, col_wd_name,
-                         col_query_type, pointintime, extract_text) \
-                            for _, row in df_input.iterrows()])
-    pool.close()
-    pool.join()
+    res = list(iter_page_content(
+        df_input=df_input, col_main_name=col_main_name, col_wd_name=col_wd_name,
+        col_wp_name=col_wp_name, col_query_type=col_query_type, pointintime=pointintime,
+        extract_text=extract_text))
 
     return {x["event_wd_name"]: x for x in res if len(x.keys()) > 1}, \
         [x["event_wd_name"] for x in res if len(x.keys()) == 1]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Bidirectional Wikipedia title <-> Wikidata ID index,
+filled from the data collected at the first step (Wikidata -> Wikipedia mapping)
+"""
+from collections import Counter
+import pandas as pd
+
+from wikipedia_narrative.titles import normalize_title
+
+
+def title_key(title: str) -> str:
+    """ Same key for urls and titles of the same page
+    (underscores/spaces, url-encoding, case of the first letter) """
+    title = normalize_title(title).replace(" ", "_")
+    return title[:1].upper() + title[1:]
+
+
+class TitleIndex:
+    """ Wikipedia title <-> Wikidata ID. Lookups are counted (hits and misses)
+    so that the share of network calls avoided can be reported """
+
+    def __init__(self):
+        self.title_to_id = dict()
+        self.id_to_title = dict()
+        self.stats = Counter()
+
+    def __len__(self):
+        return len(self.title_to_id)
+
+    def add(self, wd_id: str, title: str):
+        """ Adding one pair, wd_id can be a Wikidata url and title a Wikipedia url """
+        wd_id = wd_id.split("/")[-1]
+        if not title or not wd_id.startswith("Q") or wd_id == "Q":
+            return self
+        key = title_key(title)
+        self.title_to_id[key] = wd_id
+        self.id_to_title.setdefault(wd_id, key)
+        return self
+
+    def update(self, mapping: dict[str, str]):
+        """ Adding all title -> wd_id pairs from mapping """
+        for title, wd_id in mapping.items():
+            self.add(wd_id=wd_id, title=title)
+        return self
+
+    def update_from_df(self, df_input: pd.core.frame.DataFrame,
+                       col_wikidata: str, col_wikipedia: str = "wikipedia_page"):
+        """ Adding all pairs from the output of `add_wikipedia_page` """
+        pairs = df_input[[col_wikidata, col_wikipedia]].dropna().drop_duplicates()
+        for wd_id, title in pairs.itertuples(index=False):
+            self.add(wd_id=wd_id, title=title)
+        return self
+
+    def get_id(self, title: str):
+        """ Wikidata ID of title, None if unknown """
+        wd_id = self.title_to_id.get(title_key(title))
+        self.stats["hit" if wd_id else "miss"] += 1
+        return wd_id
+
+    def get_title(self, wd_id: str):
+        """ Wikipedia title of a Wikidata ID (or url), None if unknown """
+        return self.id_to_title.get(wd_id.split("/")[-1])
+
+    def canonical_title(self, title: str) -> str:
+        """ Title under which the page was mapped during collection, title itself if unknown """
+        wd_id = self.title_to_id.get(title_key(title))
+        return self.id_to_title[wd_id] if wd_id else title
+
+    def canonical_titles(self, titles: pd.core.series.Series) -> pd.core.series.Series:
+        """ `canonical_title` computed once per unique title """
+        return titles.map({title: self.canonical_title(title) for title in pd.unique(titles)})
+
+    def hit_rate(self) -> float:
+        """ Share of `get_id` lookups answered by the index """
+        nb_lookups = self.stats["hit"] + self.stats["miss"]
+        return self.stats["hit"] / nb_lookups if nb_lookups else 0.0
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+""" Normalizing Wikipedia titles found in urls """
+import re
+import unicodedata
+from urllib.parse import unquote
+import pandas as pd
+
+# `.../wiki/` prefix of page urls (absolute or relative), titles can contain `/` (e.g. AC/DC)
+WIKI_PREFIX = re.compile(r"^(?:[a-z]+://[^?#]*?)?/wiki/")
+URL_SCHEME = re.compile(r"^[a-z]+://")
+
+
+def url_title(url: str) -> str:
+    """ Title of a page url (everything after `/wiki/`), last part of other urls
+    (e.g. `index.php?...`), titles are kept as they are """
+    matches = WIKI_PREFIX.match(url)
+    if matches:
+        return url[matches.end():]
+    if URL_SCHEME.match(url):
+        path, sep, query = url.partition("?")
+        return path.split("/")[-1] + sep + query
+    return url
+
+
+def normalize_title(url: str, name_mapping: dict[str, str] = None) -> str:
+    """ Wikipedia url (or url title) -> page title as used by the API
+    1. Full percent-decoding + NFC normalization
+    2. Replacing title if it is in name_mapping (redirects, manual corrections) """
+    title = unicodedata.normalize("NFC", unquote(url_title(url)))
+    if name_mapping:
+        return name_mapping.get(title, title)
+    return title
+
+
+def normalize_name_mapping(name_mapping: dict[str, str]) -> dict[str, str]:
+    """ Keys of name_mapping in the same form as normalized titles """
+    return {normalize_title(k): normalize_title(v) for k, v in name_mapping.items()}
+
+
+def normalize_title_series(urls: pd.core.series.Series,
+                           name_mapping: dict[str, str] = None) -> pd.core.series.Series:
+    """ `normalize_title` computed once per unique value, then broadcast back to all rows """
+    name_mapping = normalize_name_mapping(name_mapping) if name_mapping else None
+    titles = {url: normalize_title(url, name_mapping) for url in pd.unique(urls)}
+    return urls.map(titles)
+
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Finding Wikidata IDs from Wikipedia page titles
+(MediaWiki `pageprops` API, 50 titles per request, persistent cache)
+"""
+from collections import Counter
+import requests
+
+from narrative.kv_store import KVStore
+from settings.settings import AGENT, WIKIPEDIA_URL
+from narrative.mediawiki import get_json
+
+NOT_FOUND = "Q"
+
+
+class WikidataIdResolver:
+    """ Wikipedia title -> Wikidata ID, redirects are followed.
+    Results (including titles without Wikidata ID) are stored
+    in a title -> ID cache shared by all runs """
+
+    batch_size = 50
+
+    def __init__(self, lang: str = "en", store: KVStore = None):
+        self.lang = lang
+        self.api = f"{WIKIPEDIA_URL.format(lang=lang)}/w/api.php"
+        self.store = store if store is not None else KVStore(name="wp_title_to_wd_id")
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": AGENT})
+        self.stats = Counter()
+
+    def _key(self, title: str) -> str:
+        return f"{self.lang}:{title}"
+
+    def _query_batch(self, titles: list[str]) -> dict[str, str]:
+        """ One API call for up to `batch_size` titles, raises if the call failed """
+        json_response = get_json(self.session, self.api, params={
+            "action": "query", "prop": "pageprops", "ppprop": "wikibase_item",
+            "redirects": 1, "titles": "|".join(titles),
+            "format": "json", "formatversion": 2}, service="wikipedia_api")
+        query = json_response.get("query", {})
+
+        # title sent -> normalized title -> redirect target -> page
+        renaming = {x["from"]: x["to"] for x in query.get("normalized", [])}
+        redirects = {x["from"]: x["to"] for x in query.get("redirects", [])}
+        wd_ids = {page["title"]: page.get("pageprops", {}).get("wikibase_item", NOT_FOUND) \
+            for page in query.get("pages", [])}
+
+        res = dict()
+        for title in titles:
+            curr = renaming.get(title, title)
+            curr = redirects.get(curr, curr)
+            res[title] = wd_ids.get(curr, NOT_FOUND)
+        return res
+
+    def resolve(self, titles: list[str]) -> dict[str, str]:
+        """ Wikidata ID for each title, `NOT_FOUND` if the page has none.
+        Raises if an API call fails (results of the batches done so far are stored) """
+        titles = list(dict.fromkeys(titles))
+        cached = self.store.get_many([self._key(title) for title in titles])
+        res = {title: cached[self._key(title)] for title in titles if self._key(title) in cached}
+
+        missing = [title for title in titles if title not in res]
+        self.stats["cache"] += len(res)
+        self.stats["network"] += len(missing)
+        for i in range(0, len(missing), self.batch_size):
+            found = self._query_batch(missing[i:i+self.batch_size])
+            self.store.set_many({self._key(title): wd_id for title, wd_id in found.items()})
+            res.update(found)
+        return res
+
+    def __call__(self, title: str) -> str:
+        return self.resolve([title])[title]
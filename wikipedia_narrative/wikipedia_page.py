@@ -1,8 +1,24 @@
 # -*- coding: utf-8 -*-
 """ Getting content from Wikipedia """
 import re
+import logging
 from collections import defaultdict
-import wikipedia
+from functools import lru_cache
+
+from settings.settings import WIKIPEDIA_URL
+from narrative.instrumentation import span, count
+
+LOGGER = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_wikipedia_module():
+    """ `wikipedia` module (slow to import, loaded with the first page), pointing to
+    the live Wikipedia or to the local stand-in server (cf. narrative/standin_server.py) """
+    import wikipedia
+    wikipedia.wikipedia.API_URL = f"{WIKIPEDIA_URL.format(lang='en')}/w/api.php"
+    return wikipedia
+
 
 class WikipediaPage:
     """ Main class """
@@ -17,14 +33,19 @@ class WikipediaPage:
             raise ValueError("Either `title`, or `title` and `content` should be specified")
 
         if not content:
-            try:
-                page = wikipedia.page(title)
-            except Exception as exception:
-                print(exception)
-                raise ValueError("Could not get the page from title")
+            # `wikipedia` fetches the page then its content: one page = one request here
+            with span("request", service="wikipedia_api"):
+                count("requests", service="wikipedia_api")
+                try:
+                    page = get_wikipedia_module().page(title)
+                    self.content = page.content
+                except Exception as exception:
+                    LOGGER.warning("Could not get the page `%s`: %r", title, exception)
+                    count("errors", service="wikipedia_api")
+                    raise ValueError("Could not get the page from title")
+            count("bytes", len(self.content.encode()), service="wikipedia_api")
 
             self.title = page.title
-            self.content = page.content
             self.url = page.url
 
         else: